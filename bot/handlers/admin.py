@@ -1,5 +1,4 @@
 import datetime
-import pandas as pd
 import io
 from datetime import datetime as dt
 
@@ -15,8 +14,17 @@ import logging
 
 from bot.services.errors import global_error_handler
 from bot.services.security import hash_password
-from bot.services.database import get_db
+from bot.services.database import (
+    toggle_agent_active,
+    run_db,
+    db_fetchone,
+    db_fetchall,
+    db_read,
+    db_transaction,
+)
 from bot.services.auth import require_admin
+from bot.services import ledger
+from bot.services.reporting import collect_metrics, active_agents_by, cached_read
 
 logger = logging.getLogger(__name__)
 
@@ -49,7 +57,7 @@ async def admin_menu(update, context):
         ["🔎 جستجوی حواله‌ها", "⛔ فعال / غیرفعال عامل"],
         ["📊 گزارش مالی", "📥 دانلود گزارش اکسل"],
         ["📈 داشبورد آماری", "💸 پنل سود ادمین"],
-        ["💰 مدیریت مالی مرکزی"],
+        ["💰 مدیریت مالی مرکزی", "🗂 دانلود رسیدهای گروهی"],
         ["🚪 خروج"],
     ]
 
@@ -68,7 +76,7 @@ async def admin_logout(update, context):
     # استفاده از تابع جدید
     from bot.services.database import unbind_admin_telegram_id
 
-    unbind_admin_telegram_id(user_id)
+    await run_db(unbind_admin_telegram_id, user_id)
 
     # پاک کردن context
     context.user_data.clear()
@@ -169,15 +177,14 @@ async def confirm_password(update, context):
         await admin_menu(update, context)
         return ConversationHandler.END
 
-    if confirm != context.user_data["temp_password"]:
+    if confirm != context.user_data.get("temp_password"):
         await update.message.reply_text(
             "❌ پسوردها یکسان نیست\n🔐 لطفاً دوباره پسورد را وارد کنید:"
         )
         return PASSWORD
 
-    # حالا هش می‌کنیم
-    context.user_data["password"] = hash_password(confirm)
-    context.user_data.pop("temp_password", None)
+    # هش فقط هنگام ثبت نهایی (confirm_agent) ساخته می‌شود؛ تا آن موقع فقط temp_password
+    # در user_data است که هرگز روی دیسک نوشته نمی‌شود (persistence.TRANSIENT_KEYS)
 
     await update.message.reply_text(
         "📍 ولایت عامل را وارد کنید:",
@@ -213,11 +220,7 @@ async def get_phone(update, context):
         await admin_menu(update, context)
         return ConversationHandler.END
 
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM agents WHERE phone = ?", (phone,))
-    exists = cur.fetchone()
-    conn.close()
+    exists = await db_fetchone("SELECT id FROM agents WHERE phone = ?", (phone,))
 
     if exists:
         await update.message.reply_text("❌ این شماره قبلاً ثبت شده\n🏠 /start")
@@ -250,13 +253,7 @@ async def get_tazkira(update, context):
 
     # 2️⃣ چک تکراری بودن در دیتابیس
     try:
-        conn = get_db()
-        cur = conn.cursor()
-
-        cur.execute("SELECT id FROM agents WHERE tazkira = ?", (tazkira,))
-        exists = cur.fetchone()
-
-        conn.close()
+        exists = await db_fetchone("SELECT id FROM agents WHERE tazkira = ?", (tazkira,))
 
         if exists:
             await update.message.reply_text(
@@ -394,7 +391,7 @@ async def confirm_agent(update, context):
     # اگر تأیید کرد
     try:
         # دیباگ: بررسی مقادیر context
-        required_fields = ["name", "province", "phone", "tazkira", "password", "currency", "balance"]
+        required_fields = ["name", "province", "phone", "tazkira", "temp_password", "currency", "balance"]
         missing_fields = []
         
         for field in required_fields:
@@ -409,41 +406,36 @@ async def confirm_agent(update, context):
             )
             return ConversationHandler.END
         
-        conn = get_db()
-        cur = conn.cursor()
+        password_hash = hash_password(context.user_data["temp_password"])
 
-        # ثبت عامل در جدول agents
-        cur.execute(
-            """
-            INSERT INTO agents (name, province, phone, tazkira, password_hash)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (
-                context.user_data["name"],
-                context.user_data["province"],
-                context.user_data["phone"],
-                context.user_data["tazkira"],
-                context.user_data["password"],
-            ),
-        )
+        def _save(cur):
+            # ثبت عامل در جدول agents
+            cur.execute(
+                """
+                INSERT INTO agents (name, province, phone, tazkira, password_hash)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (
+                    context.user_data["name"],
+                    context.user_data["province"],
+                    context.user_data["phone"],
+                    context.user_data["tazkira"],
+                    password_hash,
+                ),
+            )
 
-        agent_id = cur.lastrowid
+            agent_id = cur.lastrowid
 
-        # ثبت موجودی در جدول balances
-        cur.execute(
-            """
-            INSERT INTO balances (agent_id, currency, balance)
-            VALUES (?, ?, ?)
-            """,
-            (
+            # ثبت موجودی اولیه (همراه با سند افتتاحیه در دفتر کل)
+            ledger.open_balance(
+                cur,
                 agent_id,
                 context.user_data["currency"],
                 context.user_data["balance"],
-            ),
-        )
+            )
+            return agent_id
 
-        conn.commit()
-        conn.close()
+        agent_id = await db_transaction(_save)
 
         context.user_data.clear()
 
@@ -477,81 +469,23 @@ async def financial_report(update, context):
     """گزارش مالی پیشرفته برای ادمین"""
     await update.message.reply_text("📊 در حال آماده‌سازی گزارش مالی...")
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    # آمار کل سیستم
-    cur.execute("SELECT COUNT(*) FROM agents WHERE is_active = 1")
-    active_agents = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM agents")
-    total_agents = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM transactions")
-    total_transactions = cur.fetchone()[0]
-
-    cur.execute(
-        """
-        SELECT COUNT(*) FROM transactions 
-        WHERE status = 'pending'
-    """
-    )
-    pending_transactions = cur.fetchone()[0]
-
-    cur.execute(
-        """
-        SELECT COUNT(*) FROM transactions 
-        WHERE status = 'completed'
-    """
-    )
-    completed_transactions = cur.fetchone()[0]
-
-    cur.execute(
-        """
-        SELECT SUM(amount) FROM transactions 
-        WHERE status != 'cancelled'
-    """
-    )
-    total_amount = cur.fetchone()[0] or 0
-
-    cur.execute(
-        """
-        SELECT SUM(commission) FROM transactions 
-        WHERE status != 'cancelled'
-    """
-    )
-    total_commission = cur.fetchone()[0] or 0
-
-    # آمار بر اساس ولایت
-    cur.execute(
-        """
-        SELECT a.province, COUNT(*) as agent_count, 
-               SUM(b.balance) as total_balance
-        FROM agents a
-        LEFT JOIN balances b ON a.id = b.agent_id
-        WHERE a.is_active = 1
-        GROUP BY a.province
-        ORDER BY agent_count DESC
-    """
-    )
-    province_stats = cur.fetchall()
+    # همه معیارها با یک بار خواندن جمع روزانه حواله‌ها (مشترک با داشبورد و بررسی سلامت)
+    metrics = await cached_read("metrics", collect_metrics)
+    totals = metrics["totals"]
+    active_agents = metrics["active_agents"]
+    total_agents = metrics["total_agents"]
+    total_transactions = totals["total"]
+    pending_transactions = totals["pending"]
+    completed_transactions = totals["completed"]
+    total_amount = totals["amount"]
+    total_commission = totals["commission"]
+    province_stats = metrics["province_stats"]
 
     # برترین عامل‌ها
-    cur.execute(
-        """
-        SELECT a.name, a.province, COUNT(t.id) as transaction_count,
-               SUM(t.commission) as total_commission
-        FROM agents a
-        LEFT JOIN transactions t ON a.id = t.agent_id AND t.status != 'cancelled'
-        WHERE a.is_active = 1
-        GROUP BY a.id, a.name, a.province
-        ORDER BY transaction_count DESC
-        LIMIT 5
-    """
-    )
-    top_agents = cur.fetchall()
-
-    conn.close()
+    top_agents = [
+        (agent["name"], agent["province"], agent["count"], agent["commission"])
+        for agent in active_agents_by(metrics, "count")[:5]
+    ]
 
     # ساخت گزارش
     report = "📊 *گزارش مالی پیشرفته سیستم*\n"
@@ -600,28 +534,28 @@ async def list_agents(update, context):
         message = update.message
         is_callback = False
 
-    conn = get_db()
-    cur = conn.cursor()
+    def _load(cur):
+        # دریافت اطلاعات پایه عامل‌ها
+        cur.execute(
+            """
+            SELECT id, name, province, phone, is_active
+            FROM agents
+            ORDER BY id
+            """
+        )
+        agents_rows = cur.fetchall()
 
-    # دریافت اطلاعات پایه عامل‌ها
-    cur.execute(
-        """
-        SELECT id, name, province, phone, is_active
-        FROM agents
-        ORDER BY id
-        """
-    )
-    agents_rows = cur.fetchall()
-    
-    # دریافت تمام موجودی‌ها
-    cur.execute(
-        """
-        SELECT agent_id, balance, currency
-        FROM balances
-        """
-    )
-    balances_rows = cur.fetchall()
-    conn.close()
+        # دریافت تمام موجودی‌ها
+        cur.execute(
+            """
+            SELECT agent_id, balance, currency
+            FROM balances
+            """
+        )
+        balances_rows = cur.fetchall()
+        return agents_rows, balances_rows
+
+    agents_rows, balances_rows = await db_read(_load)
 
     if not agents_rows:
         if is_callback:
@@ -733,27 +667,12 @@ async def toggle_agent_by_id(update, context):
             
         agent_id = int(text)
 
-        conn = get_db()
-        cur = conn.cursor()
-
-        cur.execute("SELECT is_active FROM agents WHERE id = ?", (agent_id,))
-        row = cur.fetchone()
+        new_status = await run_db(toggle_agent_active, agent_id)
 
-        if not row:
+        if new_status is None:
             await update.message.reply_text("❌ عاملی با این شناسه پیدا نشد")
-            conn.close()
             return ConversationHandler.END
 
-        new_status = 0 if row[0] == 1 else 1
-
-        cur.execute(
-            "UPDATE agents SET is_active = ? WHERE id = ?",
-            (new_status, agent_id),
-        )
-
-        conn.commit()
-        conn.close()
-
         status_text = "✅ فعال شد" if new_status else "⛔ غیرفعال شد"
         await update.message.reply_text(
             f"🔄 وضعیت عامل با شناسه {agent_id} {status_text}"
@@ -784,10 +703,7 @@ async def toggle_agent_by_id(update, context):
 @require_admin
 async def list_balance_requests(update, context):
     """نمایش لیست درخواست‌های شارژ در انتظار"""
-    conn = get_db()
-    cur = conn.cursor()
-    
-    cur.execute(
+    requests = await db_fetchall(
         """
         SELECT 
             br.id, br.agent_id, br.amount, br.currency, br.receipt_photo_id, br.created_at,
@@ -798,8 +714,6 @@ async def list_balance_requests(update, context):
         ORDER BY br.created_at ASC
         """
     )
-    requests = cur.fetchall()
-    conn.close()
     
     if not requests:
         await update.message.reply_text("📥 هیچ درخواست شارژ در انتظاری وجود ندارد.")
@@ -857,54 +771,20 @@ async def process_balance_request_callback(update, context):
     action = "approved" if data.startswith("approve_br_") else "rejected"
     req_id = int(data.split("_")[-1])
     
-    conn = get_db()
-    cur = conn.cursor()
-    
     try:
-        # دریافت اطلاعات درخواست
-        cur.execute(
-            "SELECT agent_id, amount, currency, status FROM balance_requests WHERE id = ?",
-            (req_id,)
+        # تغییر وضعیت درخواست و افزایش موجودی در یک تراکنش (فقط اگر هنوز pending است)
+        agent_id, amount, currency, agent_tg = await run_db(
+            ledger.process_balance_request, req_id, action == "approved"
         )
-        request = cur.fetchone()
-        
-        if not request:
+    except ledger.TransactionNotFound as e:
+        if e.status is None:
             await query.edit_message_caption("❌ درخواست یافت نشد.")
-            conn.close()
-            return
-            
-        agent_id, amount, currency, status = request
-        
-        if status != "pending":
-            await query.edit_message_caption(f"⚠️ این درخواست قبلاً `{status}` شده است.")
-            conn.close()
-            return
+        else:
+            await query.edit_message_caption(f"⚠️ این درخواست قبلاً `{e.status}` شده است.")
+        return
 
+    try:
         if action == "approved":
-            # ۱. افزایش موجودی عامل
-            # چک موجود بودن رکورد
-            cur.execute(
-                "SELECT balance FROM balances WHERE agent_id = ? AND currency = ?",
-                (agent_id, currency)
-            )
-            row = cur.fetchone()
-            if row:
-                cur.execute(
-                    "UPDATE balances SET balance = balance + ? WHERE agent_id = ? AND currency = ?",
-                    (amount, agent_id, currency)
-                )
-            else:
-                cur.execute(
-                    "INSERT INTO balances (agent_id, currency, balance) VALUES (?, ?, ?)",
-                    (agent_id, currency, amount)
-                )
-            
-            # ۲. آپدیت وضعیت درخواست
-            cur.execute(
-                "UPDATE balance_requests SET status = 'approved', processed_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (req_id,)
-            )
-            
             status_msg = "✅ تأیید شد"
             notif_to_agent = (
                 "💰 *اطلاعیه افزایش موجودی*\n"
@@ -916,11 +796,6 @@ async def process_balance_request_callback(update, context):
                 "🙏 از شکیبایی شما سپاسگزاریم."
             )
         else:
-            # فقط آپدیت وضعیت
-            cur.execute(
-                "UPDATE balance_requests SET status = 'rejected', processed_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (req_id,)
-            )
             status_msg = "❌ رد شد"
             notif_to_agent = (
                 "⚠️ *اطلاعیه درخواست شارژ*\n"
@@ -933,12 +808,8 @@ async def process_balance_request_callback(update, context):
                 "📞 برای اطلاعات بیشتر با مدیریت تماس بگیرید.\n"
                 "⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯"
             )
-
-        conn.commit()
         
         # اطلاع‌رسانی به عامل
-        cur.execute("SELECT telegram_id FROM agents WHERE id = ?", (agent_id,))
-        agent_tg = cur.fetchone()[0]
         if agent_tg:
             try:
                 await context.bot.send_message(
@@ -954,8 +825,6 @@ async def process_balance_request_callback(update, context):
     except Exception as e:
         logger.exception("Error processing balance request")
         await query.edit_message_caption(f"{query.message.caption}\n\n❌ خطا در پردازش: {str(e)}")
-    finally:
-        conn.close()
 
 @require_admin
 async def handle_agents_callback(update, context):
@@ -1031,11 +900,8 @@ async def admin_search_tx_process(update, context):
         await admin_menu(update, context)
         return ConversationHandler.END
         
-    conn = get_db()
-    cur = conn.cursor()
-    
     # جستجو در کل سیستم (بدون محدودیت عامل)
-    cur.execute("""
+    results = await db_fetchall("""
         SELECT t.transaction_code, t.receiver_name, t.amount, t.currency, t.status, t.created_at,
                a_sender.name as sender_agent, a_receiver.name as receiver_agent
         FROM transactions t
@@ -1046,9 +912,6 @@ async def admin_search_tx_process(update, context):
         LIMIT 10
     """, (f"%{query}%", f"%{query}%", f"%{query}%"))
     
-    results = cur.fetchall()
-    conn.close()
-    
     if not results:
         await update.message.reply_text(
             f"❌ هیچ حواله‌ای برای عبارت '{query}' یافت نشد.",
@@ -1136,9 +999,6 @@ async def execute_search(update, context):
         await search_agents(update, context)
         return
     
-    conn = get_db()
-    cur = conn.cursor()
-    
     query = """
         SELECT a.id, a.name, a.province, a.phone, a.is_active,
                b.balance, b.currency,
@@ -1161,9 +1021,7 @@ async def execute_search(update, context):
     
     query += " GROUP BY a.id ORDER BY a.name"
     
-    cur.execute(query, params)
-    results = cur.fetchall()
-    conn.close()
+    results = await db_fetchall(query, params)
     
     if not results:
         await update.message.reply_text(
@@ -1213,9 +1071,6 @@ async def admin_search_handler(update, context):
         await search_agents(update, context)
         return
     
-    conn = get_db()
-    cur = conn.cursor()
-    
     query = """
         SELECT a.id, a.name, a.province, a.phone, a.is_active,
                b.balance, b.currency,
@@ -1239,9 +1094,7 @@ async def admin_search_handler(update, context):
     query += " GROUP BY a.id ORDER BY a.name"
     
     try:
-        cur.execute(query, params)
-        results = cur.fetchall()
-        conn.close()
+        results = await db_fetchall(query, params)
         
         if not results:
             await update.message.reply_text(
@@ -1286,10 +1139,7 @@ async def admin_search_handler(update, context):
 @require_admin
 async def filter_active_agents(update, context):
     """فیلتر عامل‌های فعال"""
-    conn = get_db()
-    cur = conn.cursor()
-    
-    cur.execute("""
+    results = await db_fetchall("""
         SELECT a.id, a.name, a.province, a.phone,
                b.balance, b.currency,
                COUNT(t.id) as transaction_count
@@ -1300,8 +1150,6 @@ async def filter_active_agents(update, context):
         GROUP BY a.id
         ORDER BY a.name
     """)
-    results = cur.fetchall()
-    conn.close()
     
     if not results:
         await update.message.reply_text("❌ هیچ عامل فعالی وجود ندارد")
@@ -1332,10 +1180,7 @@ async def filter_active_agents(update, context):
 @require_admin
 async def filter_inactive_agents(update, context):
     """فیلتر عامل‌های غیرفعال"""
-    conn = get_db()
-    cur = conn.cursor()
-    
-    cur.execute("""
+    results = await db_fetchall("""
         SELECT a.id, a.name, a.province, a.phone,
                b.balance, b.currency,
                COUNT(t.id) as transaction_count
@@ -1346,8 +1191,6 @@ async def filter_inactive_agents(update, context):
         GROUP BY a.id
         ORDER BY a.name
     """)
-    results = cur.fetchall()
-    conn.close()
     
     if not results:
         await update.message.reply_text("❌ هیچ عامل غیرفعالی وجود ندارد")
@@ -1,12 +1,33 @@
 from telegram import ReplyKeyboardMarkup
 import logging
-from datetime import datetime as dt, timedelta
+from datetime import datetime as dt
 
-from bot.services.database import get_db
+from bot.services.database import run_db, db_read, pool_stats, identity_cache_stats
+from bot.services.ledger import run_in_unit_of_work
+from bot.services.alerts import (
+    LOW_BALANCE,
+    ZERO_BALANCE,
+    OLD_PENDING,
+    INACTIVE_WITH_BALANCE,
+    INACTIVE_AGENT,
+    HIGH_AMOUNT,
+    sync_time_alerts,
+    load_alerts,
+)
+from bot.services.alert_scan import scan_scheduled
 from bot.services.auth import require_admin
+from bot.services.reporting import collect_metrics, cached_read, report_cache_stats, evaluate_health
+from config import ALERT_LOW_BALANCE_AFN, ALERT_HIGH_AMOUNT, ALERT_PENDING_DAYS, ALERT_INACTIVE_DAYS
 
 logger = logging.getLogger(__name__)
 
+# نام فارسی کش‌های هویت (نام خود کش‌ها _ دارد و Markdown پیام را خراب می‌کند)
+_IDENTITY_CACHE_LABELS = {
+    "admin_by_telegram": "ادمین‌ها",
+    "agent_id_by_telegram": "اتصال تلگرام عامل‌ها",
+    "agent_by_id": "اطلاعات عامل‌ها",
+}
+
 
 # =======================
 # 🚨 هشدارها و اطلاعیه‌ها
@@ -18,81 +39,17 @@ async def alerts_and_notifications(update, context):
     """هشدارها و اطلاعیه‌های سیستم"""
     await update.message.reply_text("🚨 در حال بررسی هشدارهای سیستم...")
     
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # هشدار ۱: عامل‌های با موجودی کم
-    cur.execute("""
-        SELECT a.id, a.name, a.province, b.balance, b.currency
-        FROM agents a
-        JOIN balances b ON a.id = b.agent_id
-        WHERE a.is_active = 1 AND b.currency = 'AFN' AND b.balance < 1000
-        ORDER BY b.balance ASC
-        LIMIT 10
-    """)
-    low_balance_agents = cur.fetchall()
-    
-    # هشدار ۲: عامل‌های با موجودی صفر
-    cur.execute("""
-        SELECT a.id, a.name, a.province
-        FROM agents a
-        WHERE a.is_active = 1 AND a.id NOT IN (
-            SELECT DISTINCT agent_id FROM balances WHERE balance > 0
-        )
-        ORDER BY a.name
-    """)
-    zero_balance_agents = cur.fetchall()
-    
-    # هشدار ۳: حواله‌های قدیمی در انتظار (بیش از ۷ روز)
-    seven_days_ago = (dt.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-    cur.execute("""
-        SELECT t.transaction_code, t.sender_name, t.receiver_name, 
-               t.amount, t.currency, t.created_at, a.name as agent_name
-        FROM transactions t
-        JOIN agents a ON t.agent_id = a.id
-        WHERE t.status = 'pending' AND DATE(t.created_at) < ?
-        ORDER BY t.created_at ASC
-        LIMIT 10
-    """, (seven_days_ago,))
-    old_pending_transactions = cur.fetchall()
-    
-    # هشدار ۴: عامل‌های غیرفعال با موجودی
-    cur.execute("""
-        SELECT a.id, a.name, a.province, b.balance, b.currency
-        FROM agents a
-        JOIN balances b ON a.id = b.agent_id
-        WHERE a.is_active = 0 AND b.balance > 0
-        ORDER BY b.balance DESC
-    """)
-    inactive_with_balance = cur.fetchall()
-    
-    # هشدار ۵: عامل‌های بدون فعالیت اخیر (۳۰ روز اخیر)
-    thirty_days_ago = (dt.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-    cur.execute("""
-        SELECT a.id, a.name, a.province, MAX(t.created_at) as last_activity
-        FROM agents a
-        LEFT JOIN transactions t ON a.id = t.agent_id
-        WHERE a.is_active = 1
-        GROUP BY a.id, a.name, a.province
-        HAVING MAX(t.created_at) < ? OR MAX(t.created_at) IS NULL
-        ORDER BY last_activity ASC
-        LIMIT 10
-    """, (thirty_days_ago,))
-    inactive_agents = cur.fetchall()
-    
-    # هشدار ۶: حواله‌های با مبلغ بالا (بیش از ۱۰۰۰۰ افغانی)
-    cur.execute("""
-        SELECT t.transaction_code, t.sender_name, t.receiver_name, 
-               t.amount, t.currency, t.created_at, a.name as agent_name
-        FROM transactions t
-        JOIN agents a ON t.agent_id = a.id
-        WHERE t.status != 'cancelled' AND t.amount > 10000
-        ORDER BY t.amount DESC
-        LIMIT 5
-    """)
-    high_amount_transactions = cur.fetchall()
-    
-    conn.close()
+    # هشدارهای فعال با trigger ها به‌روز هستند؛ قانون‌های زمانی را اسکن دوره‌ای تازه می‌کند
+    # (اگر JobQueue در دسترس نباشد، همینجا)
+    if not scan_scheduled():
+        await run_db(run_in_unit_of_work, sync_time_alerts)
+    active_alerts = await db_read(load_alerts)
+    low_balance_agents = active_alerts[LOW_BALANCE]
+    zero_balance_agents = active_alerts[ZERO_BALANCE]
+    old_pending_transactions = active_alerts[OLD_PENDING]
+    inactive_with_balance = active_alerts[INACTIVE_WITH_BALANCE]
+    inactive_agents = active_alerts[INACTIVE_AGENT]
+    high_amount_transactions = active_alerts[HIGH_AMOUNT]
     
     # ساخت گزارش هشدارها
     alerts = "🚨 *هشدارها و اطلاعیه‌های سیستم*\n"
@@ -104,7 +61,7 @@ async def alerts_and_notifications(update, context):
     # هشدار موجودی کم
     if low_balance_agents:
         alert_count += 1
-        alerts += f"⚠️ *هشدار {alert_count}: عامل‌های با موجودی کم (زیر ۱۰۰۰ افغانی)*\n"
+        alerts += f"⚠️ *هشدار {alert_count}: عامل‌های با موجودی کم (زیر {ALERT_LOW_BALANCE_AFN:,.0f} افغانی)*\n"
         for agent_id, name, province, balance, currency in low_balance_agents:
             balance_text = f"{balance:,.0f}" if balance is not None else "۰"
             alerts += f"   🔴 #{agent_id:03d} | {name} ({province}): {balance_text} {currency}\n"
@@ -121,7 +78,7 @@ async def alerts_and_notifications(update, context):
     # هشدار حواله‌های قدیمی
     if old_pending_transactions:
         alert_count += 1
-        alerts += f"⚠️ *هشدار {alert_count}: حواله‌های قدیمی در انتظار (بیش از ۷ روز)*\n"
+        alerts += f"⚠️ *هشدار {alert_count}: حواله‌های قدیمی در انتظار (بیش از {ALERT_PENDING_DAYS} روز)*\n"
         for code, sender, receiver, amount, currency, created_at, agent_name in old_pending_transactions:
             days_old = (dt.now() - dt.strptime(created_at, '%Y-%m-%d %H:%M:%S')).days
             alerts += f"   🔴 `{code}` | {sender} → {receiver}\n"
@@ -140,7 +97,7 @@ async def alerts_and_notifications(update, context):
     # هشدار عدم فعالیت
     if inactive_agents:
         alert_count += 1
-        alerts += f"⚠️ *هشدار {alert_count}: عامل‌های بدون فعالیت (۳۰ روز اخیر)*\n"
+        alerts += f"⚠️ *هشدار {alert_count}: عامل‌های بدون فعالیت ({ALERT_INACTIVE_DAYS} روز اخیر)*\n"
         for agent_id, name, province, last_activity in inactive_agents:
             if last_activity:
                 days_inactive = (dt.now() - dt.strptime(last_activity, '%Y-%m-%d %H:%M:%S')).days
@@ -151,7 +108,7 @@ async def alerts_and_notifications(update, context):
     
     # اطلاعیه حواله‌های با مبلغ بالا
     if high_amount_transactions:
-        alerts += "💎 *اطلاعیه: حواله‌های با مبلغ بالا (بیش از ۱۰۰۰۰ افغانی)*\n"
+        alerts += f"💎 *اطلاعیه: حواله‌های با مبلغ بالا (بیش از {ALERT_HIGH_AMOUNT:,.0f} افغانی)*\n"
         for code, sender, receiver, amount, currency, created_at, agent_name in high_amount_transactions:
             alerts += f"   💎 `{code}` | {sender} → {receiver}\n"
             alerts += f"      💰 {amount:,.0f} {currency} | عامل: {agent_name}\n"
@@ -183,68 +140,9 @@ async def system_health_check(update, context):
     """بررسی سلامت کلی سیستم"""
     await update.message.reply_text("🏥 در حال بررسی سلامت سیستم...")
     
-    conn = get_db()
-    cur = conn.cursor()
-    
-    health_status = []
-    issues = []
-    
-    # بررسی ۱: تعداد کل عامل‌ها
-    cur.execute("SELECT COUNT(*) FROM agents WHERE is_active = 1")
-    active_agents = cur.fetchone()[0]
-    
-    if active_agents == 0:
-        issues.append("❌ هیچ عامل فعلی وجود ندارد")
-    elif active_agents < 3:
-        issues.append(f"⚠️ تعداد عامل‌های فعال کم است: {active_agents}")
-    else:
-        health_status.append(f"✅ عامل‌های فعال: {active_agents}")
-    
-    # بررسی ۲: موجودی کل سیستم
-    cur.execute("SELECT SUM(balance) FROM balances WHERE currency = 'AFN'")
-    total_afn = cur.fetchone()[0] or 0
-    
-    if total_afn == 0:
-        issues.append("❌ هیچ موجودی در سیستم ثبت نشده")
-    elif total_afn < 10000:
-        issues.append(f"⚠️ موجودی کل سیستم کم است: {total_afn:,.0f} افغانی")
-    else:
-        health_status.append(f"✅ موجودی کل سیستم: {total_afn:,.0f} افغانی")
-    
-    # بررسی ۳: حواله‌های در انتظار
-    cur.execute("SELECT COUNT(*) FROM transactions WHERE status = 'pending'")
-    pending_count = cur.fetchone()[0]
-    
-    if pending_count > 100:
-        issues.append(f"⚠️ حواله‌های در انتظار زیاد است: {pending_count}")
-    else:
-        health_status.append(f"✅ حواله‌های در انتظار: {pending_count}")
-    
-    # بررسی ۴: حواله‌های قدیمی
-    three_days_ago = (dt.now() - timedelta(days=3)).strftime('%Y-%m-%d')
-    cur.execute("SELECT COUNT(*) FROM transactions WHERE status = 'pending' AND DATE(created_at) < ?", (three_days_ago,))
-    old_pending = cur.fetchone()[0]
-    
-    if old_pending > 10:
-        issues.append(f"⚠️ حواله‌های قدیمی در انتظار: {old_pending}")
-    else:
-        health_status.append(f"✅ حواله‌های قدیمی: {old_pending}")
-    
-    # بررسی ۵: عامل‌های با موجودی صفر
-    cur.execute("""
-        SELECT COUNT(*) FROM agents a 
-        WHERE a.is_active = 1 AND NOT EXISTS (
-            SELECT 1 FROM balances b WHERE b.agent_id = a.id AND b.balance > 0
-        )
-    """)
-    zero_balance_count = cur.fetchone()[0]
-    
-    if zero_balance_count > active_agents * 0.5:  # بیش از نصف عامل‌ها موجودی صفر دارند
-        issues.append(f"⚠️ درصد بالایی از عامل‌ها موجودی صفر دارند: {zero_balance_count}/{active_agents}")
-    else:
-        health_status.append(f"✅ عامل‌های با موجودی صفر: {zero_balance_count}")
-    
-    conn.close()
+    # همه شمارش‌ها از آمار مشترک گزارش‌ها (یک بار خواندن جمع روزانه حواله‌ها)
+    metrics = await cached_read("metrics", collect_metrics)
+    health_status, issues = evaluate_health(metrics)
     
     # ساخت گزارش سلامت
     health_report = "🏥 *گزارش سلامت سیستم*\n"
@@ -252,7 +150,7 @@ async def system_health_check(update, context):
     
     if issues:
         health_report += "🚨 *مسائل شناسایی شده:*\n"
-        for issue in issues:
+        for issue in issues.values():
             health_report += f"   {issue}\n"
         health_report += "\n"
     
@@ -277,6 +175,23 @@ async def system_health_check(update, context):
     else:
         health_report += "🔴 *وضعیت سیستم: نیاز به توجه*\n"
     
+    # آمار استخر اتصال دیتابیس
+    stats = pool_stats()
+    health_report += "\n🔌 *اتصال‌های دیتابیس:*\n"
+    health_report += f"   در حال استفاده: {stats['in_use']}/{stats['size']} | امانت‌ها: {stats['checkouts']:,}\n"
+    health_report += f"   انتظارها: {stats['waits']:,} | میانگین انتظار: {stats['avg_wait'] * 1000:.1f}ms\n"
+
+    # آمار کش هویت کاربران
+    health_report += "\n🪪 *کش هویت:*\n"
+    for name, cache in identity_cache_stats().items():
+        label = _IDENTITY_CACHE_LABELS.get(name, name.replace("_", " "))
+        health_report += f"   {label}: {cache['size']}/{cache['maxsize']} | نرخ موفقیت: {cache['hit_rate']:.0%}\n"
+
+    # آمار کش گزارش‌های ادمین
+    cache = report_cache_stats()
+    health_report += "\n📈 *کش گزارش‌ها:*\n"
+    health_report += f"   {cache['size']}/{cache['maxsize']} | نرخ موفقیت: {cache['hit_rate']:.0%}\n"
+
     health_report += "\n⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯\n"
     health_report += f"📅 زمان بررسی: {dt.now().strftime('%Y/%m/%d %H:%M')}"
     
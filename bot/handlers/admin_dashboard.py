@@ -1,13 +1,15 @@
 import datetime
-import pandas as pd
-import io
 from datetime import datetime as dt
 
 from telegram import ReplyKeyboardMarkup
 from telegram.ext import ConversationHandler
 import logging
 
-from bot.services.database import get_db
+from bot.services.reporting import collect_metrics, active_agents_by, cached_read
+from bot.services.export import build_admin_report, export_transactions, file_size
+from bot.services.jobs import report_job, ReportFailed
+from bot.handlers.common import enqueue_report, name_export_parts
+from config import EXPORT_MAX_FILE_BYTES
 from bot.services.auth import require_admin
 
 logger = logging.getLogger(__name__)
@@ -23,90 +25,30 @@ async def dashboard_stats(update, context):
     """داشبورد آماری پیشرفته"""
     await update.message.reply_text("📈 در حال آماده‌سازی داشبورد آماری...")
     
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # آمار کلی
-    cur.execute("SELECT COUNT(*) FROM agents WHERE is_active = 1")
-    active_agents = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM transactions")
-    total_transactions = cur.fetchone()[0]
-    
-    cur.execute("SELECT SUM(amount) FROM transactions WHERE status != 'cancelled'")
-    total_amount = cur.fetchone()[0] or 0
-    
-    cur.execute("SELECT SUM(commission) FROM transactions WHERE status != 'cancelled'")
-    total_commission = cur.fetchone()[0] or 0
-    
-    # آمار ۷ روز گذشته
-    seven_days_ago = (dt.now() - datetime.timedelta(days=7)).strftime('%Y-%m-%d')
-    cur.execute("""
-        SELECT COUNT(*) FROM transactions 
-        WHERE DATE(created_at) >= ?
-    """, (seven_days_ago,))
-    last_7_days_transactions = cur.fetchone()[0]
-    
-    cur.execute("""
-        SELECT SUM(amount) FROM transactions 
-        WHERE DATE(created_at) >= ? AND status != 'cancelled'
-    """, (seven_days_ago,))
-    last_7_days_amount = cur.fetchone()[0] or 0
-    
-    # آمار ۳۰ روز گذشته
-    thirty_days_ago = (dt.now() - datetime.timedelta(days=30)).strftime('%Y-%m-%d')
-    cur.execute("""
-        SELECT COUNT(*) FROM transactions 
-        WHERE DATE(created_at) >= ?
-    """, (thirty_days_ago,))
-    last_30_days_transactions = cur.fetchone()[0]
-    
-    cur.execute("""
-        SELECT SUM(amount) FROM transactions 
-        WHERE DATE(created_at) >= ? AND status != 'cancelled'
-    """, (thirty_days_ago,))
-    last_30_days_amount = cur.fetchone()[0] or 0
-    
-    # پرکارترین عامل‌ها
-    cur.execute("""
-        SELECT a.name, COUNT(t.id) as transaction_count,
-               SUM(t.commission) as total_commission
-        FROM agents a
-        LEFT JOIN transactions t ON a.id = t.agent_id AND t.status != 'cancelled'
-        WHERE a.is_active = 1
-        GROUP BY a.id, a.name
-        ORDER BY transaction_count DESC
-        LIMIT 3
-    """)
-    top_agents = cur.fetchall()
-    
-    # کم‌کارترین عامل‌ها (فعال)
-    cur.execute("""
-        SELECT a.name, COUNT(t.id) as transaction_count
-        FROM agents a
-        LEFT JOIN transactions t ON a.id = t.agent_id AND t.status != 'cancelled'
-        WHERE a.is_active = 1
-        GROUP BY a.id, a.name
-        ORDER BY transaction_count ASC
-        LIMIT 3
-    """)
-    least_active_agents = cur.fetchall()
-    
-    # بیشترین درآمدزا
-    cur.execute("""
-        SELECT a.name, SUM(t.commission) as total_commission,
-               COUNT(t.id) as transaction_count
-        FROM agents a
-        LEFT JOIN transactions t ON a.id = t.agent_id AND t.status != 'cancelled'
-        WHERE a.is_active = 1
-        GROUP BY a.id, a.name
-        HAVING total_commission > 0
-        ORDER BY total_commission DESC
-        LIMIT 3
-    """)
-    top_earners = cur.fetchall()
-    
-    conn.close()
+    metrics = await cached_read("metrics", collect_metrics)
+    totals = metrics["totals"]
+    active_agents = metrics["active_agents"]
+    total_transactions = totals["total"]
+    total_amount = totals["amount"]
+    total_commission = totals["commission"]
+    last_7_days_transactions = totals["count_7d"]
+    last_7_days_amount = totals["amount_7d"]
+    last_30_days_transactions = totals["count_30d"]
+    last_30_days_amount = totals["amount_30d"]
+
+    # پرکارترین، کم‌کارترین و بیشترین درآمدزا (فقط عامل‌های فعال، حواله‌های غیرلغو شده)
+    top_agents = [
+        (agent["name"], agent["count"], agent["commission"])
+        for agent in active_agents_by(metrics, "count")[:3]
+    ]
+    least_active_agents = [
+        (agent["name"], agent["count"])
+        for agent in active_agents_by(metrics, "count", reverse=False)[:3]
+    ]
+    top_earners = [
+        (agent["name"], agent["commission"], agent["count"])
+        for agent in active_agents_by(metrics, "commission", positive_only=True)[:3]
+    ]
     
     # ساخت داشبورد
     dashboard = "📈 *داشبورد آماری پیشرفته*\n"
@@ -173,106 +115,46 @@ async def dashboard_stats(update, context):
 
 @require_admin
 async def download_admin_excel_report(update, context):
-    """دانلود گزارش کامل اکسل برای ادمین"""
-    await update.message.reply_text("📥 در حال آماده‌سازی گزارش اکسل ادمین...")
-    
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # دریافت تمام اطلاعات عامل‌ها
-    cur.execute("""
-        SELECT a.id, a.name, a.province, a.phone, a.is_active,
-               b.balance, b.currency,
-               COUNT(t.id) as transaction_count,
-               SUM(t.amount) as total_amount,
-               SUM(t.commission) as total_commission
-        FROM agents a
-        LEFT JOIN balances b ON a.id = b.agent_id
-        LEFT JOIN transactions t ON a.id = t.agent_id AND t.status != 'cancelled'
-        GROUP BY a.id, b.currency
-        ORDER BY a.id
-    """)
-    agents_data = cur.fetchall()
-    
-    # دریافت آمار حواله‌ها بر اساس روز
-    cur.execute("""
-        SELECT DATE(created_at) as date, COUNT(*) as count,
-               SUM(amount) as total_amount, SUM(commission) as total_commission
-        FROM transactions
-        WHERE status != 'cancelled'
-        GROUP BY DATE(created_at)
-        ORDER BY date DESC
-        LIMIT 30
-    """)
-    daily_stats = cur.fetchall()
-    
-    # دریافت آمار بر اساس ولایت
-    cur.execute("""
-        SELECT a.province, COUNT(t.id) as transaction_count,
-               SUM(t.amount) as total_amount, SUM(t.commission) as total_commission
-        FROM agents a
-        LEFT JOIN transactions t ON a.id = t.agent_id AND t.status != 'cancelled'
-        WHERE a.is_active = 1
-        GROUP BY a.province
-        ORDER BY total_amount DESC
-    """)
-    province_stats = cur.fetchall()
-    
-    conn.close()
-    
-    # ایجاد فایل اکسل
-    try:
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # شیت خلاصه سیستم
-            summary_data = {
-                'بخش': ['کل عامل‌ها', 'عامل‌های فعال', 'کل حواله‌ها', 'مجموع مبلغ', 'مجموع کارمزد'],
-                'مقدار': [
-                    len(agents_data),
-                    len([a for a in agents_data if a[4] == 1]),
-                    sum([a[7] if a[7] is not None and isinstance(a[7], (int, float)) else 0 for a in agents_data]),
-                    f"{sum([a[8] if a[8] is not None and isinstance(a[8], (int, float)) else 0 for a in agents_data]):,.0f} افغانی",
-                    f"{sum([a[9] if a[9] is not None and isinstance(a[9], (int, float)) else 0 for a in agents_data]):,.0f} افغانی"
-                ]
-            }
-            pd.DataFrame(summary_data).to_excel(writer, sheet_name='خلاصه سیستم', index=False)
-            
-            # شیت اطلاعات عامل‌ها
-            agents_df = pd.DataFrame(agents_data, columns=[
-                'کد عامل', 'نام', 'ولایت', 'تلفن', 'وضعیت', 'موجودی', 'ارز',
-                'تعداد حواله', 'مجموع مبلغ', 'مجموع کارمزد'
-            ])
-            agents_df['وضعیت'] = agents_df['وضعیت'].apply(lambda x: 'فعال' if x == 1 else 'غیرفعال')
-            agents_df.to_excel(writer, sheet_name='عامل‌ها', index=False)
-            
-            # شیت آمار روزانه
-            daily_df = pd.DataFrame(daily_stats, columns=[
-                'تاریخ', 'تعداد حواله', 'مبلغ کل', 'کارمزد کل'
-            ])
-            daily_df.to_excel(writer, sheet_name='آمار روزانه', index=False)
-            
-            # شیت آمار ولایت‌ها
-            province_df = pd.DataFrame(province_stats, columns=[
-                'ولایت', 'تعداد حواله', 'مبلغ کل', 'کارمزد کل'
-            ])
-            province_df.to_excel(writer, sheet_name='آمار ولایت‌ها', index=False)
-        
-        output.seek(0)
-        
-        filename = f"گزارش_ادمین_کامل_{dt.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        
-        await update.message.reply_document(
-            document=output,
-            filename=filename,
-            caption=f"📊 *گزارش کامل ادمین*\n\n"
-                    f"📅 تاریخ: {dt.now().strftime('%Y-%m-%d %H:%M')}\n"
-                    f"📦 شامل: اطلاعات عامل‌ها، آمار روزانه، آمار ولایت‌ها\n"
-                    f"📊 تحلیل کامل عملکرد سیستم",
-            parse_mode="Markdown"
+    """ثبت گزارش کامل اکسل ادمین در صف؛ فایل بعد از آماده شدن ارسال می‌شود"""
+    await enqueue_report(update, "admin_xlsx", {})
+
+
+@require_admin
+async def download_admin_transactions_export(update, context, fmt):
+    """ثبت لیست همه حواله‌های سیستم (CSV فشرده یا Parquet) در صف"""
+    await enqueue_report(update, "admin_transactions", {"fmt": fmt})
+
+
+@report_job("admin_xlsx")
+def build_admin_xlsx_job():
+    # ایجاد فایل اکسل (ردیف به ردیف در فایل موقت)
+    output = build_admin_report()
+    if file_size(output) > EXPORT_MAX_FILE_BYTES:
+        output.close()
+        raise ReportFailed(
+            "❌ فایل اکسل از سقف ارسال تلگرام بزرگ‌تر است.\n"
+            "لطفاً خروجی CSV یا Parquet را انتخاب کنید (به چند فایل تقسیم می‌شود)."
         )
-    except Exception as e:
-        logger.exception("Error creating admin excel report")
-        await update.message.reply_text(f"❌ خطا در ایجاد گزارش اکسل: {str(e)}")
+
+    filename = f"گزارش_ادمین_کامل_{dt.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    caption = (
+        f"📊 *گزارش کامل ادمین*\n\n"
+        f"📅 تاریخ: {dt.now().strftime('%Y-%m-%d %H:%M')}\n"
+        f"📦 شامل: اطلاعات عامل‌ها، آمار روزانه، آمار ولایت‌ها\n"
+        f"📊 تحلیل کامل عملکرد سیستم"
+    )
+    return [(output, filename, caption)]
+
+
+@report_job("admin_transactions")
+def build_admin_transactions_job(fmt):
+    parts = export_transactions(fmt)
+    return name_export_parts(
+        parts,
+        fmt,
+        filename=f"hawala_all_{dt.now().strftime('%Y%m%d_%H%M%S')}",
+        caption=f"📊 *لیست حواله‌های سیستم*\n📅 تاریخ: {dt.now().strftime('%Y-%m-%d %H:%M')}",
+    )
 
 
 # =======================
@@ -284,50 +166,34 @@ async def admin_profit_panel(update, context):
     """نمایش پنل سود ادمین بر اساس کمیسیون‌ها"""
     await update.message.reply_text("💸 در حال محاسبه سود سیستم...")
     
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # سود کل بر اساس ارز
-    cur.execute("""
-        SELECT currency, SUM(commission) as total_profit, COUNT(*) as tx_count
-        FROM transactions
-        WHERE status != 'cancelled'
-        GROUP BY currency
-        ORDER BY total_profit DESC
-    """)
-    total_profits = cur.fetchall()
-    
-    # سود ۳۰ روز گذشته
-    thirty_days_ago = (dt.now() - datetime.timedelta(days=30)).strftime('%Y-%m-%d')
-    cur.execute("""
-        SELECT currency, SUM(commission) as monthly_profit
-        FROM transactions
-        WHERE status != 'cancelled' AND DATE(created_at) >= ?
-        GROUP BY currency
-    """, (thirty_days_ago,))
-    monthly_profits = {row[0]: row[1] for row in cur.fetchall()}
-    
-    # سود ۷ روز گذشته
-    seven_days_ago = (dt.now() - datetime.timedelta(days=7)).strftime('%Y-%m-%d')
-    cur.execute("""
-        SELECT currency, SUM(commission) as weekly_profit
-        FROM transactions
-        WHERE status != 'cancelled' AND DATE(created_at) >= ?
-        GROUP BY currency
-    """, (seven_days_ago,))
-    weekly_profits = {row[0]: row[1] for row in cur.fetchall()}
-    
-    # سود امروز
-    today = dt.now().strftime('%Y-%m-%d')
-    cur.execute("""
-        SELECT currency, SUM(commission) as daily_profit
-        FROM transactions
-        WHERE status != 'cancelled' AND DATE(created_at) >= ?
-        GROUP BY currency
-    """, (today,))
-    daily_profits = {row[0]: row[1] for row in cur.fetchall()}
-
-    conn.close()
+    def _load(cur):
+        # همه دوره‌ها در یک بار خواندن جدول جمع روزانه daily_stats
+        thirty_days_ago = (dt.now() - datetime.timedelta(days=30)).strftime('%Y-%m-%d')
+        seven_days_ago = (dt.now() - datetime.timedelta(days=7)).strftime('%Y-%m-%d')
+        today = dt.now().strftime('%Y-%m-%d')
+        cur.execute("""
+            SELECT currency,
+                   SUM(commission) as total_profit,
+                   SUM(tx_count) as tx_count,
+                   SUM(CASE WHEN day >= ? THEN commission END) as monthly_profit,
+                   SUM(CASE WHEN day >= ? THEN commission END) as weekly_profit,
+                   SUM(CASE WHEN day >= ? THEN commission END) as daily_profit
+            FROM daily_stats
+            WHERE status != 'cancelled'
+            GROUP BY currency
+            ORDER BY total_profit DESC
+        """, (thirty_days_ago, seven_days_ago, today))
+        rows = cur.fetchall()
+
+        # سود کل بر اساس ارز
+        total_profits = [(row[0], row[1], row[2]) for row in rows]
+        # سود ۳۰ روز، ۷ روز و امروز (ارزهای بدون سود در این دوره‌ها حذف می‌شوند)
+        monthly_profits = {row[0]: row[3] for row in rows if row[3] is not None}
+        weekly_profits = {row[0]: row[4] for row in rows if row[4] is not None}
+        daily_profits = {row[0]: row[5] for row in rows if row[5] is not None}
+        return total_profits, monthly_profits, weekly_profits, daily_profits
+
+    total_profits, monthly_profits, weekly_profits, daily_profits = await cached_read("profit_panel", _load)
     
     # ساخت متن پنل
     text = "💸 *پنل سود و درآمد سیستم*\n"
@@ -1,10 +1,11 @@
 from telegram import ReplyKeyboardMarkup
 from telegram.ext import ConversationHandler
 import logging
-from datetime import datetime as dt
 
-from bot.services.database import get_db
+from bot.services.database import run_db, db_fetchone, db_fetchall
+from bot.services import ledger
 from bot.services.auth import require_admin
+from bot.services.reporting import cached_read
 from bot.handlers.admin import admin_menu
 
 logger = logging.getLogger(__name__)
@@ -23,52 +24,63 @@ async def central_finance_menu(update, context):
     """منوی مدیریت مالی مرکزی"""
     await update.message.reply_text("💰 در حال آماده‌سازی گزارش مالی مرکزی...")
     
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # کل موجودی سیستم بر اساس ارز
-    cur.execute("""
-        SELECT currency, SUM(balance) as total_balance
-        FROM balances
-        GROUP BY currency
-        ORDER BY total_balance DESC
-    """)
-    system_balances = cur.fetchall()
-    
-    # آمار کل سیستم
-    cur.execute("SELECT COUNT(*) FROM agents WHERE is_active = 1")
-    active_agents = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(DISTINCT agent_id || currency) FROM balances")
-    total_balance_records = cur.fetchone()[0]
-    
-    # عامل‌ها با موجودی کم (زیر ۱۰۰۰ افغانی)
-    cur.execute("""
-        SELECT a.name, a.province, SUM(b.balance) as total_balance, b.currency
-        FROM agents a
-        JOIN balances b ON a.id = b.agent_id
-        WHERE a.is_active = 1 AND b.currency = 'AFN'
-        GROUP BY a.id, b.currency
-        HAVING total_balance < 1000
-        ORDER BY total_balance ASC
-        LIMIT 5
-    """)
-    low_balance_agents = cur.fetchall()
-    
-    # عامل‌ها با موجودی بالا (بالای ۱۰۰۰۰ افغانی)
-    cur.execute("""
-        SELECT a.name, a.province, SUM(b.balance) as total_balance, b.currency
-        FROM agents a
-        JOIN balances b ON a.id = b.agent_id
-        WHERE a.is_active = 1 AND b.currency = 'AFN'
-        GROUP BY a.id, b.currency
-        HAVING total_balance > 10000
-        ORDER BY total_balance DESC
-        LIMIT 5
-    """)
-    high_balance_agents = cur.fetchall()
-    
-    conn.close()
+    def _load(cur):
+        # کل موجودی سیستم بر اساس ارز
+        cur.execute("""
+            SELECT currency, SUM(balance) as total_balance
+            FROM balances
+            GROUP BY currency
+            ORDER BY total_balance DESC
+        """)
+        system_balances = cur.fetchall()
+
+        # آمار کل سیستم
+        cur.execute("SELECT COUNT(*) FROM agents WHERE is_active = 1")
+        active_agents = cur.fetchone()[0]
+
+        cur.execute("SELECT COUNT(DISTINCT agent_id || currency) FROM balances")
+        total_balance_records = cur.fetchone()[0]
+
+        # عامل‌ها با موجودی کم (زیر ۱۰۰۰ افغانی)
+        cur.execute("""
+            SELECT a.name, a.province, SUM(b.balance) as total_balance, b.currency
+            FROM agents a
+            JOIN balances b ON a.id = b.agent_id
+            WHERE a.is_active = 1 AND b.currency = 'AFN'
+            GROUP BY a.id, b.currency
+            HAVING total_balance < 1000
+            ORDER BY total_balance ASC
+            LIMIT 5
+        """)
+        low_balance_agents = cur.fetchall()
+
+        # عامل‌ها با موجودی بالا (بالای ۱۰۰۰۰ افغانی)
+        cur.execute("""
+            SELECT a.name, a.province, SUM(b.balance) as total_balance, b.currency
+            FROM agents a
+            JOIN balances b ON a.id = b.agent_id
+            WHERE a.is_active = 1 AND b.currency = 'AFN'
+            GROUP BY a.id, b.currency
+            HAVING total_balance > 10000
+            ORDER BY total_balance DESC
+            LIMIT 5
+        """)
+        high_balance_agents = cur.fetchall()
+        return (
+            system_balances,
+            active_agents,
+            total_balance_records,
+            low_balance_agents,
+            high_balance_agents,
+        )
+
+    (
+        system_balances,
+        active_agents,
+        total_balance_records,
+        low_balance_agents,
+        high_balance_agents,
+    ) = await cached_read("central_finance", _load)
     
     # ساخت گزارش مالی مرکزی
     report = "💰 *مدیریت مالی مرکزی*\n"
@@ -127,18 +139,13 @@ async def central_finance_menu(update, context):
 @require_admin
 async def detailed_balances(update, context):
     """جزئیات کامل موجودی‌ها"""
-    conn = get_db()
-    cur = conn.cursor()
-    
-    cur.execute("""
+    all_balances = await db_fetchall("""
         SELECT a.id, a.name, a.province, a.is_active,
                b.currency, b.balance
         FROM agents a
         LEFT JOIN balances b ON a.id = b.agent_id
         ORDER BY a.id, b.currency
     """)
-    all_balances = cur.fetchall()
-    conn.close()
     
     if not all_balances:
         await update.message.reply_text("❌ هیچ موجودی ثبت نشده است")
@@ -222,16 +229,11 @@ async def start_transfer_funds(update, context):
 @require_admin
 async def get_transfer_amount(update, context):
     """دریافت شناسه عامل مبدأ"""
-    conn = None
     try:
         from_agent_id = int(update.message.text.strip())
         
-        conn = get_db()
-        cur = conn.cursor()
-        
         # بررسی وجود عامل مبدأ
-        cur.execute("SELECT name, is_active FROM agents WHERE id = ?", (from_agent_id,))
-        from_agent = cur.fetchone()
+        from_agent = await db_fetchone("SELECT name, is_active FROM agents WHERE id = ?", (from_agent_id,))
         
         if not from_agent:
             await update.message.reply_text("❌ عاملی با این شناسه پیدا نشد")
@@ -243,14 +245,13 @@ async def get_transfer_amount(update, context):
             return TRANSFER_AMOUNT
         
         # دریافت موجودی‌های عامل مبدأ (تجمیع شده بر اساس ارز)
-        cur.execute("""
+        from_balances = await db_fetchall("""
             SELECT currency, SUM(balance) as total_balance FROM balances 
             WHERE agent_id = ? 
             GROUP BY currency
             HAVING total_balance > 0
             ORDER BY currency
         """, (from_agent_id,))
-        from_balances = cur.fetchall()
         
         if not from_balances:
             await update.message.reply_text("❌ عامل مبدأ موجودی ندارد")
@@ -259,7 +260,7 @@ async def get_transfer_amount(update, context):
         # ذخیره اطلاعات تجمیع شده در context
         context.user_data["transfer_from_agent_id"] = from_agent_id
         context.user_data["transfer_from_name"] = from_name
-        context.user_data["transfer_from_balances"] = from_balances
+        context.user_data["transfer_from_balances"] = [tuple(row) for row in from_balances]
         
         # نمایش موجودی‌ها
         balance_text = f"💰 *موجودی عامل مبدأ: {from_name}*\n\n"
@@ -291,9 +292,6 @@ async def get_transfer_amount(update, context):
         logger.exception("Error in get_transfer_amount")
         await update.message.reply_text(f"❌ خطا: {str(e)}")
         return TRANSFER_AMOUNT
-    finally:
-        if conn:
-            conn.close()
 
 
 @require_admin
@@ -427,12 +425,8 @@ async def confirm_transfer(update, context):
             await update.message.reply_text("❌ نمی‌توانید به همان عامل انتقال دهید")
             return TRANSFER_CONFIRM
         
-        conn = get_db()
-        cur = conn.cursor()
-        
         # بررسی وجود عامل مقصد
-        cur.execute("SELECT name, is_active FROM agents WHERE id = ?", (to_agent_id,))
-        to_agent = cur.fetchone()
+        to_agent = await db_fetchone("SELECT name, is_active FROM agents WHERE id = ?", (to_agent_id,))
         
         if not to_agent:
             await update.message.reply_text("❌ عاملی با این شناسه پیدا نشد")
@@ -447,43 +441,19 @@ async def confirm_transfer(update, context):
         from_agent_id = context.user_data["transfer_from_agent_id"]
         amount = context.user_data["transfer_amount"]
         currency = context.user_data["transfer_currency"]
-        
+        from_name = context.user_data["transfer_from_name"]
+
         try:
-            # کسر از عامل مبدأ
-            cur.execute("""
-                UPDATE balances 
-                SET balance = balance - ?
-                WHERE agent_id = ? AND currency = ?
-            """, (amount, from_agent_id, currency))
-            
-            # افزودن به عامل مقصد
-            cur.execute("""
-                INSERT OR REPLACE INTO balances (agent_id, currency, balance)
-                VALUES (?, ?, COALESCE(
-                    (SELECT balance FROM balances WHERE agent_id = ? AND currency = ?), 0
-                ) + ?)
-            """, (to_agent_id, currency, to_agent_id, currency, amount))
-            
-            # ثبت تراکنش در جدول transactions (به عنوان حواله داخلی)
-            transaction_code = f"TRF{dt.now().strftime('%Y%m%d%H%M%S')}"
-            cur.execute("""
-                INSERT INTO transactions (
-                    transaction_code, sender_name, receiver_name, amount, 
-                    currency, commission, status, agent_id, created_at
-                ) VALUES (?, ?, ?, ?, ?, ?, 'completed', ?, ?)
-            """, (
-                transaction_code,
-                context.user_data["transfer_from_name"],
-                to_name,
-                amount,
-                currency,
-                0,  # انتقال داخلی کارمزد ندارد
+            # کسر شرطی از عامل مبدأ، افزودن به عامل مقصد و ثبت حواله داخلی در یک تراکنش
+            transaction_code, _, _ = await run_db(
+                ledger.transfer_funds,
                 from_agent_id,
-                dt.now()
-            ))
-            
-            conn.commit()
-            conn.close()
+                to_agent_id,
+                currency,
+                amount,
+                from_name,
+                to_name,
+            )
             
             await update.message.reply_text(
                 f"✅ *انتقال وجه با موفقیت انجام شد*\n\n"
@@ -502,9 +472,13 @@ async def confirm_transfer(update, context):
             # پاک کردن context
             context.user_data.clear()
             return ConversationHandler.END
+        except ledger.InsufficientBalance as e:
+            await update.message.reply_text(
+                f"❌ موجودی عامل مبدأ کافی نیست.\n"
+                f"💵 موجودی فعلی: {e.balance:,.0f} {currency}"
+            )
+            return ConversationHandler.END
         except Exception as e:
-            conn.rollback()
-            conn.close()
             logger.exception("Error in transfer funds")
             await update.message.reply_text("❌ خطا در انجام انتقال")
             return ConversationHandler.END
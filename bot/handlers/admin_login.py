@@ -2,6 +2,7 @@ from telegram.ext import ConversationHandler
 from bot.services.database import (
     get_admin_by_username,
     bind_admin_telegram_id,
+    run_db,
 )
 from bot.services.security import verify_password
 
@@ -15,7 +16,7 @@ async def admin_login_start(update, context):
 
 async def admin_login_username(update, context):
     username = update.message.text.strip()
-    admin = get_admin_by_username(username)
+    admin = await run_db(get_admin_by_username, username)
 
     if not admin:
         await update.message.reply_text("❌ ادمینی با این یوزرنیم وجود ندارد")
@@ -29,7 +30,7 @@ async def admin_login_username(update, context):
         await update.message.reply_text("❌ این ادمین قبلاً در سیستم لاگین شده است.")
         return ConversationHandler.END
 
-    context.user_data["admin"] = admin
+    context.user_data["admin"] = dict(admin)  # ردیف sqlite قابل ذخیره در persistence نیست
     await update.message.reply_text("🔑 پسورد را وارد کنید:")
     return ADMIN_PASSWORD
 
@@ -39,14 +40,20 @@ async def admin_login_username(update, context):
 
 async def admin_login_password(update, context):
     password = update.message.text
-    admin = context.user_data["admin"]
+    admin = context.user_data.get("admin")
+    if not admin:
+        # داده‌های موقت ورود ذخیره نمی‌شوند (مثلاً بعد از ری‌استارت یا /start)
+        await update.message.reply_text("⏱ ورود منقضی شد، لطفاً دوباره «👑 ورود ادمین» را بزنید")
+        return ConversationHandler.END
 
     if not verify_password(password, admin["password_hash"]):
+        context.user_data.pop("admin", None)
         await update.message.reply_text("❌ پسورد اشتباه است")
         return ConversationHandler.END
 
     # ذخیره telegram_id در دیتابیس
-    bind_admin_telegram_id(
+    await run_db(
+        bind_admin_telegram_id,
         admin_id=admin["id"],
         telegram_id=update.effective_user.id,
     )
@@ -55,7 +62,8 @@ async def admin_login_password(update, context):
     # 1. ذخیره اطلاعات ادمین در context
     context.user_data["admin_id"] = admin["id"]
     context.user_data["role"] = "admin"
-    context.user_data["admin_data"] = admin  # کل اطلاعات ادمین
+    # کل اطلاعات ادمین (بدون هش پسورد)
+    context.user_data["admin_data"] = {k: v for k, v in admin.items() if k != "password_hash"}
 
     # 2. پاک کردن داده‌های موقت
     context.user_data.pop("admin", None)
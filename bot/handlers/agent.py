@@ -1,20 +1,31 @@
 from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ConversationHandler
-import pandas as pd
-import io
 from datetime import datetime as dt
 import logging
 
 from bot.services.database import (
     get_agent_by_phone,
+    get_agent_by_id,
     bind_agent_telegram_id,
-    get_db,
     get_agent_balance,
     check_sufficient_balance,
+    run_db,
+    db_fetchone,
+    db_fetchall,
+    db_read,
+    db_transaction,
 )
 from bot.services.security import verify_password
+from bot.services import ledger
+from bot.services.codes import is_valid_code
 from bot.services.auth import require_agent, require_any_auth
-from bot.services.receipt import generate_receipt_image
+from bot.services.receipt import render_receipt, ReceiptBusy
+from bot.services.receipt_cache import send_receipt
+from bot.services.receipt_batch import build_receipt_batch, count_batch_transactions
+from bot.services.export import build_agent_report, export_transactions, file_size
+from bot.services.jobs import report_job, ReportFailed
+from bot.handlers.common import enqueue_report, name_export_parts
+from config import RECEIPT_BATCH_MAX, EXPORT_MAX_FILE_BYTES
 
 logger = logging.getLogger(__name__)
 
@@ -45,7 +56,11 @@ LOGIN_PHONE, LOGIN_PASSWORD = range(2)
     SEARCH_TYPE,
     SEARCH_QUERY,
     SEARCH_DATE_RANGE,
-) = range(24)
+    BATCH_AGENT,
+    BATCH_DATE_FROM,
+    BATCH_DATE_TO,
+    BATCH_FORMAT,
+) = range(28)
 
 # =======================
 # 🎛 منوی عامل
@@ -62,9 +77,7 @@ async def agent_menu(update, context):
     # 🔔 بررسی حواله‌های در انتظار برای این عامل (به عنوان گیرنده)
     pending_msg = ""
     try:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
+        pending_counts = await db_fetchall(
             """
             SELECT COUNT(*), currency 
             FROM transactions 
@@ -73,8 +86,6 @@ async def agent_menu(update, context):
             """,
             (agent_id,),
         )
-        pending_counts = cur.fetchall()
-        conn.close()
 
         if pending_counts:
             pending_msg = "🔔 *یادآوری حواله‌های در انتظار پرداخت:*\n"
@@ -104,6 +115,12 @@ async def agent_menu(update, context):
 # =======================
 
 
+def _clear_login(context):
+    """پاک کردن داده‌های موقت ورود (هش پسورد هرگز در user_data نمی‌ماند)"""
+    context.user_data.pop("login_agent_id", None)
+    context.user_data.pop("password_hash", None)
+
+
 async def agent_login_start(update, context):
     await update.message.reply_text("📞 شماره تماس خود را وارد کنید:")
     return LOGIN_PHONE
@@ -111,7 +128,7 @@ async def agent_login_start(update, context):
 
 async def agent_login_phone(update, context):
     phone = update.message.text.strip()
-    agent = get_agent_by_phone(phone)
+    agent = await run_db(get_agent_by_phone, phone)
 
     if not agent:
         await update.message.reply_text("❌ عامل با این شماره یافت نشد")
@@ -136,7 +153,12 @@ async def agent_login_phone(update, context):
 
 async def agent_login_password(update, context):
     password = update.message.text
-    hashed = context.user_data["password_hash"]
+    hashed = context.user_data.get("password_hash")
+    if not hashed or "login_agent_id" not in context.user_data:
+        # داده‌های موقت ورود ذخیره نمی‌شوند (مثلاً بعد از ری‌استارت یا /start)
+        _clear_login(context)
+        await update.message.reply_text("⏱ ورود منقضی شد، لطفاً دوباره «🔐 ورود عامل» را بزنید")
+        return ConversationHandler.END
 
     if not verify_password(password, hashed):
         await update.message.reply_text("❌ پسورد اشتباه است")
@@ -147,17 +169,20 @@ async def agent_login_password(update, context):
 
     # بررسی وضعیت فعال بودن عامل قبل از ورود
     from bot.services.database import get_agent_by_id
-    agent = get_agent_by_id(agent_id)
+    agent = await run_db(get_agent_by_id, agent_id)
     
     if not agent:
+        _clear_login(context)
         await update.message.reply_text("❌ عامل پیدا نشد")
-        return LOGIN_PASSWORD
+        return ConversationHandler.END
     
     if not agent["is_active"]:
+        _clear_login(context)
         await update.message.reply_text("⛔ حساب شما مسدود است. لطفاً با ادمین تماس بگیرید.")
         return ConversationHandler.END
 
-    bind_agent_telegram_id(agent_id, telegram_id)
+    await run_db(bind_agent_telegram_id, agent_id, telegram_id)
+    _clear_login(context)
 
     # ذخیره اطلاعات عامل در context
     context.user_data["agent_id"] = agent_id
@@ -195,10 +220,7 @@ async def send_hawala_start(update, context):
         context.user_data.pop(key, None)
 
     # دریافت لیست عامل‌های فعال (غیر از خودش)
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
+    agents = await db_fetchall(
         """
         SELECT id, name, province 
         FROM agents 
@@ -208,9 +230,6 @@ async def send_hawala_start(update, context):
         (context.user_data["agent_id"],),
     )
 
-    agents = cur.fetchall()
-    conn.close()
-
     if not agents:
         keyboard = [["🔙 بازگشت به منوی عامل"]]
         await update.message.reply_text(
@@ -264,10 +283,7 @@ async def send_receiver_agent(update, context):
         receiver_agent_id = int(text)
 
         # بررسی وجود عامل گیرنده
-        conn = get_db()
-        cur = conn.cursor()
-
-        cur.execute(
+        receiver = await db_fetchone(
             """
             SELECT id, name, province, is_active 
             FROM agents 
@@ -276,9 +292,6 @@ async def send_receiver_agent(update, context):
             (receiver_agent_id, context.user_data["agent_id"]),
         )
 
-        receiver = cur.fetchone()
-        conn.close()
-
         if not receiver:
             await update.message.reply_text(
                 "❌ عامل گیرنده یافت نشد یا غیرفعال است\n" "لطفاً کد صحیح را وارد کنید:"
@@ -428,87 +441,37 @@ async def confirm_transaction(update, context):
         return CONFIRM_TRANSACTION
 
     try:
-        # تولید کد حواله
-        import random
-
-        transaction_code = f"HWL{random.randint(100000, 999999)}"
-
         agent_id = context.user_data["agent_id"]
         amount = context.user_data["amount"]
         currency = context.user_data["currency"]
 
-        # ثبت در دیتابیس
-        conn = get_db()
-        cur = conn.cursor()
-
-        cur.execute(
-            """
-            INSERT INTO transactions 
-            (transaction_code, agent_id, receiver_agent_id, sender_name, 
-             receiver_name, receiver_tazkira, amount, currency, commission, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-            (
-                transaction_code,
-                agent_id,
-                context.user_data["receiver_agent_id"],
-                context.user_data["sender_name"],
-                context.user_data["receiver_name"],
-                context.user_data["receiver_tazkira"],
-                amount,
-                currency,
-                context.user_data["commission"],
-                "pending",
-            ),
-        )
-
-        # 🔴 افزایش موجودی عامل مبدأ (چون پول نقد گرفته)
-        # مطمئن شو رکورد موجودی وجود داره
-        cur.execute(
-            """
-            SELECT id FROM balances 
-            WHERE agent_id = ? AND currency = ?
-        """,
-            (agent_id, currency),
-        )
-        if not cur.fetchone():
-            cur.execute(
-                """
-                INSERT INTO balances (agent_id, currency, balance)
-                VALUES (?, ?, 0)
-            """,
-                (agent_id, currency),
-            )
-
-        cur.execute(
-            """
-            UPDATE balances 
-            SET balance = balance + ?
-            WHERE agent_id = ? AND currency = ?
-        """,
-            (amount, agent_id, currency),
+        # تولید کد، ثبت در دیتابیس و افزایش موجودی عامل مبدأ (چون پول نقد گرفته) در یک تراکنش
+        transaction_code, new_balance = await run_db(
+            ledger.create_hawala,
+            agent_id,
+            context.user_data["receiver_agent_id"],
+            context.user_data["sender_name"],
+            context.user_data["receiver_name"],
+            context.user_data["receiver_tazkira"],
+            amount,
+            currency,
+            context.user_data["commission"],
         )
 
-        conn.commit()
+        # اطلاعات عامل‌های مبدأ و مقصد (یکبار، از کش هویت)
+        receiver_agent_id = context.user_data.get("receiver_agent_id")
+        sender_agent = await run_db(get_agent_by_id, agent_id)
+        receiver_agent = await run_db(get_agent_by_id, receiver_agent_id) if receiver_agent_id else None
+        receiver_telegram_id = receiver_agent["telegram_id"] if receiver_agent else None
 
         # 🔔 اطلاع‌رسانی به عامل مقصد
         try:
-            receiver_agent_id = context.user_data.get("receiver_agent_id")
             if not receiver_agent_id:
                 logger.error("No receiver_agent_id found in context.user_data")
             else:
-                db_conn = get_db()
-                db_cur = db_conn.cursor()
-                db_cur.execute("SELECT telegram_id, name FROM agents WHERE id = ?", (receiver_agent_id,))
-                receiver_info = db_cur.fetchone()
-                
-                if receiver_info and receiver_info[0]:
-                    receiver_telegram_id = receiver_info[0]
-                    
-                    db_cur.execute("SELECT name, province FROM agents WHERE id = ?", (agent_id,))
-                    sender_agent_info = db_cur.fetchone()
-                    sender_agent_name = sender_agent_info[0] if sender_agent_info else "نامشخص"
-                    sender_agent_province = sender_agent_info[1] if sender_agent_info else "نامشخص"
+                if receiver_telegram_id:
+                    sender_agent_name = sender_agent["name"] if sender_agent else "نامشخص"
+                    sender_agent_province = sender_agent["province"] if sender_agent else "نامشخص"
 
                     notification_text = (
                         "🔔 *حواله جدید دریافت شد*\n"
@@ -533,34 +496,14 @@ async def confirm_transaction(update, context):
                     logger.info(f"Notification sent successfully to TG: {receiver_telegram_id}")
                 else:
                     logger.warning(f"Target agent {receiver_agent_id} has no telegram_id. No notification sent.")
-                
-                db_conn.close()
         except Exception as notify_err:
             logger.error(f"Failed to send notification: {notify_err}")
 
-        conn.close()
-
-        # دریافت موجودی جدید
-        new_balance = get_agent_balance(agent_id, currency)
-
         # نمایش کد حواله با گزارش کامل
         keyboard = [["💸 ارسال حواله جدید"], ["🔙 بازگشت به منوی عامل"]]
 
         # تولید و ارسال رسید تصویری
         try:
-            # دریافت نام عامل‌ها برای رسید
-            db_conn = get_db()
-            db_cur = db_conn.cursor()
-            
-            # نام عامل فرستنده
-            db_cur.execute("SELECT name FROM agents WHERE id = ?", (agent_id,))
-            sender_agent_name = db_cur.fetchone()[0]
-            
-            # نام عامل گیرنده
-            db_cur.execute("SELECT name FROM agents WHERE id = ?", (context.user_data['receiver_agent_id'],))
-            receiver_agent_name = db_cur.fetchone()[0]
-            db_conn.close()
-
             receipt_data = {
                 'transaction_code': transaction_code,
                 'sender_name': context.user_data['sender_name'],
@@ -568,12 +511,12 @@ async def confirm_transaction(update, context):
                 'receiver_tazkira': context.user_data['receiver_tazkira'],
                 'amount': amount,
                 'currency': currency,
-                'sender_agent': sender_agent_name,
-                'receiver_agent': receiver_agent_name,
+                'sender_agent': sender_agent["name"],
+                'receiver_agent': receiver_agent["name"],
                 'created_at': dt.now().strftime("%Y-%m-%d %H:%M"),
             }
             
-            receipt_img = generate_receipt_image(receipt_data)
+            receipt_img = await render_receipt(receipt_data)
             await context.bot.send_photo(
                 chat_id=update.effective_chat.id,
                 photo=receipt_img,
@@ -585,19 +528,10 @@ async def confirm_transaction(update, context):
 
         debug_info = ""
         # اگر برای تست است، نمایش وضعیت نوتیفیکیشن
-        try:
-            receiver_agent_id = context.user_data.get("receiver_agent_id")
-            db_conn = get_db()
-            db_cur = db_conn.cursor()
-            db_cur.execute("SELECT telegram_id FROM agents WHERE id = ?", (receiver_agent_id,))
-            row = db_cur.fetchone()
-            if row and row[0]:
-                debug_info = f"\n\n📡 *وضعیت نوتیفیکیشن:* ارسال شد به `{row[0]}`"
-            else:
-                debug_info = f"\n\n⚠️ *وضعیت نوتیفیکیشن:* ارسال نشد (عامل مقصد با آیدی {receiver_agent_id} تلگرام متصل ندارد)"
-            db_conn.close()
-        except:
-            pass
+        if receiver_telegram_id:
+            debug_info = f"\n\n📡 *وضعیت نوتیفیکیشن:* ارسال شد به `{receiver_telegram_id}`"
+        else:
+            debug_info = f"\n\n⚠️ *وضعیت نوتیفیکیشن:* ارسال نشد (عامل مقصد با آیدی {receiver_agent_id} تلگرام متصل ندارد)"
 
         await update.message.reply_text(
             f"✅ *حواله با موفقیت ثبت شد!*\n\n"
@@ -640,11 +574,8 @@ async def confirm_transaction(update, context):
 async def list_my_transactions(update, context):
     """نمایش حواله‌های ثبت‌شده توسط این عامل"""
 
-    conn = get_db()
-    cur = conn.cursor()
-
     # آمار کلی
-    cur.execute(
+    stats = await db_fetchone(
         """
         SELECT 
             COUNT(*) as total,
@@ -657,12 +588,10 @@ async def list_my_transactions(update, context):
     """,
         (context.user_data["agent_id"],),
     )
-
-    stats = cur.fetchone()
     total, pending_count, completed_count, cancelled_count, total_amount = stats
 
     # لیست تراکنش‌ها
-    cur.execute(
+    transactions = await db_fetchall(
         """
         SELECT 
             t.transaction_code,
@@ -682,9 +611,6 @@ async def list_my_transactions(update, context):
         (context.user_data["agent_id"],),
     )
 
-    transactions = cur.fetchall()
-    conn.close()
-
     if not transactions:
         await update.message.reply_text(
             "📭 *هنوز هیچ حواله‌ای ثبت نکرده‌اید*\n\n"
@@ -775,7 +701,7 @@ async def list_my_transactions(update, context):
 async def track_transaction_start(update, context):
     """شروع پیگیری حواله"""
     await update.message.reply_text(
-        "🔍 کد حواله را وارد کنید (مثال: HWL123456):",
+        "🔍 کد حواله را وارد کنید (مثال: HWL0000018):",
         reply_markup=ReplyKeyboardRemove(),
     )
     return TRACK_CODE
@@ -786,10 +712,12 @@ async def track_transaction_code(update, context):
     """پیگیری با کد حواله"""
     code = update.message.text.strip().upper()
 
-    conn = get_db()
-    cur = conn.cursor()
+    if not is_valid_code(code):
+        await update.message.reply_text("❌ کد حواله نامعتبر است، لطفاً دوباره بررسی کنید")
+        await agent_menu(update, context)
+        return ConversationHandler.END
 
-    cur.execute(
+    transaction = await db_fetchone(
         """
         SELECT 
             t.transaction_code,
@@ -811,9 +739,6 @@ async def track_transaction_code(update, context):
         (code,),
     )
 
-    transaction = cur.fetchone()
-    conn.close()
-
     if not transaction:
         await update.message.reply_text("❌ حواله‌ای با این کد یافت نشد")
         await agent_menu(update, context)
@@ -893,11 +818,8 @@ async def list_payable_transactions(update, context):
     """نمایش لیست حواله‌هایی که این عامل باید پرداخت کند"""
     agent_id = context.user_data.get("agent_id")
     
-    conn = get_db()
-    cur = conn.cursor()
-    
     # دریافت حواله‌های در انتظار برای این عامل
-    cur.execute(
+    payable_list = await db_fetchall(
         """
         SELECT 
             t.transaction_code, 
@@ -915,9 +837,6 @@ async def list_payable_transactions(update, context):
         (agent_id,),
     )
     
-    payable_list = cur.fetchall()
-    conn.close()
-    
     if not payable_list:
         await update.message.reply_text(
             "📭 هیچ حواله قابل پرداختی در سیستم برای شما وجود ندارد.",
@@ -967,10 +886,7 @@ async def pay_transaction_start(update, context):
         await agent_menu(update, context)
         return ConversationHandler.END
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
+    transaction = await db_fetchone(
         """
         SELECT 
             t.transaction_code,
@@ -986,9 +902,6 @@ async def pay_transaction_start(update, context):
         (code,),
     )
 
-    transaction = cur.fetchone()
-    conn.close()
-
     if not transaction:
         await update.message.reply_text("❌ حواله‌ای با این کد یافت نشد یا قبلاً پرداخت شده است")
         await agent_menu(update, context)
@@ -1011,7 +924,7 @@ async def pay_transaction_start(update, context):
         return ConversationHandler.END
 
     # چک موجودی عامل مقصد (باید پول داشته باشد تا بدهد)
-    balance = get_agent_balance(current_agent_id, currency)
+    balance = await run_db(get_agent_balance, current_agent_id, currency)
     if balance < amount:
         keyboard = [["🔙 بازگشت به منوی عامل"]]
         await update.message.reply_text(
@@ -1085,81 +998,44 @@ async def pay_transaction_confirm(update, context):
         await agent_menu(update, context)
         return ConversationHandler.END
 
-    conn = get_db()
-    cur = conn.cursor()
-
     try:
-        # چک مجدد که حواله هنوز pending است و این عامل مقصد است
-        cur.execute(
-            """
-            SELECT receiver_agent_id, status
-            FROM transactions
-            WHERE transaction_code = ? AND status = 'pending'
-        """,
-            (code,),
+        # چک وضعیت، کسر شرطی موجودی و تکمیل حواله در یک تراکنش
+        amount, currency, new_balance = await run_db(
+            ledger.pay_hawala, code, receiver_agent_id
         )
-
-        row = cur.fetchone()
-        if not row or row[0] != receiver_agent_id:
-            await update.message.reply_text(
-                "❌ این حواله قبلاً پرداخت شده یا شما عامل مقصد نیستید"
-            )
-            conn.close()
-            await agent_menu(update, context)
-            return ConversationHandler.END
-
-        # چک موجودی نهایی
-        balance = get_agent_balance(receiver_agent_id, currency)
-        if balance < amount:
-            await update.message.reply_text(
-                f"❌ موجودی شما برای پرداخت کافی نیست.\n"
-                f"💵 موجودی فعلی: {balance:,.0f} {currency}"
-            )
-            conn.close()
-            await agent_menu(update, context)
-            return ConversationHandler.END
-
-        # کسر از موجودی عامل مقصد (چون پول را به گیرنده می‌دهد)
-        cur.execute(
-            """
-            UPDATE balances
-            SET balance = balance - ?
-            WHERE agent_id = ? AND currency = ?
-        """,
-            (amount, receiver_agent_id, currency),
+    except ledger.TransactionNotFound:
+        await update.message.reply_text(
+            "❌ این حواله قبلاً پرداخت شده یا شما عامل مقصد نیستید"
         )
-
-        # تغییر وضعیت حواله به completed
-        cur.execute(
-            """
-            UPDATE transactions
-            SET status = 'completed', completed_at = CURRENT_TIMESTAMP
-            WHERE transaction_code = ? AND status = 'pending'
-        """,
-            (code,),
+        await agent_menu(update, context)
+        return ConversationHandler.END
+    except ledger.InsufficientBalance as e:
+        await update.message.reply_text(
+            f"❌ موجودی شما برای پرداخت کافی نیست.\n"
+            f"💵 موجودی فعلی: {e.balance:,.0f} {currency}"
         )
+        await agent_menu(update, context)
+        return ConversationHandler.END
+    except Exception:
+        logger.exception("Error completing payment")
+        await update.message.reply_text(
+            "❌ خطا در پرداخت حواله. لطفاً بعداً دوباره تلاش کنید."
+        )
+        return ConversationHandler.END
 
-        conn.commit()
-        conn.close()
-
-        new_balance = get_agent_balance(receiver_agent_id, currency)
-
+    try:
         keyboard = [["💸 ارسال حواله جدید"], ["🔙 بازگشت به منوی عامل"]]
 
         # تولید و ارسال رسید تصویری پرداخت
         try:
             # دریافت اطلاعات کامل حواله برای رسید
-            db_conn = get_db()
-            db_cur = db_conn.cursor()
-            db_cur.execute("""
+            row = await db_fetchone("""
                 SELECT t.sender_name, t.receiver_tazkira, a_sender.name as sender_agent_name, a_receiver.name as receiver_agent_name
                 FROM transactions t
                 JOIN agents a_sender ON t.agent_id = a_sender.id
                 JOIN agents a_receiver ON t.receiver_agent_id = a_receiver.id
                 WHERE t.transaction_code = ?
             """, (code,))
-            row = db_cur.fetchone()
-            db_conn.close()
 
             if row:
                 sender_name, receiver_tazkira, sender_agent_name, receiver_agent_name = row
@@ -1175,7 +1051,7 @@ async def pay_transaction_confirm(update, context):
                     'created_at': dt.now().strftime("%Y-%m-%d %H:%M"),
                 }
                 
-                receipt_img = generate_receipt_image(receipt_data)
+                receipt_img = await render_receipt(receipt_data)
                 await context.bot.send_photo(
                     chat_id=update.effective_chat.id,
                     photo=receipt_img,
@@ -1206,7 +1082,6 @@ async def pay_transaction_confirm(update, context):
         return ConversationHandler.END
 
     except Exception:
-        conn.close()
         logger.exception("Error completing payment")
         await update.message.reply_text(
             "❌ خطا در پرداخت حواله. لطفاً بعداً دوباره تلاش کنید."
@@ -1217,10 +1092,7 @@ async def pay_transaction_confirm(update, context):
 @require_agent
 async def manage_pending_transactions_start(update, context):
     """شروع مدیریت حواله‌های در انتظار"""
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
+    pending = await db_fetchall(
         """
         SELECT transaction_code, receiver_name, amount, currency, created_at
         FROM transactions 
@@ -1231,9 +1103,6 @@ async def manage_pending_transactions_start(update, context):
         (context.user_data["agent_id"],),
     )
 
-    pending = cur.fetchall()
-    conn.close()
-
     if not pending:
         keyboard = [["🔙 بازگشت به منوی عامل"]]
         await update.message.reply_text(
@@ -1285,10 +1154,7 @@ async def manage_pending_select_code(update, context):
         await list_my_transactions(update, context)
         return ConversationHandler.END
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
+    row = await db_fetchone(
         """
         SELECT transaction_code, receiver_name, amount, currency, created_at
         FROM transactions
@@ -1297,9 +1163,6 @@ async def manage_pending_select_code(update, context):
         (context.user_data["agent_id"], text),
     )
 
-    row = cur.fetchone()
-    conn.close()
-
     if not row:
         await update.message.reply_text(
             "❌ هیچ حواله در انتظاری با این کد برای شما پیدا نشد.\n"
@@ -1406,57 +1269,16 @@ async def edit_pending_amount(update, context):
         await agent_menu(update, context)
         return ConversationHandler.END
 
-    old_amount = context.user_data["edit_transaction_amount"]
     currency = context.user_data["edit_transaction_currency"]
     code = context.user_data["edit_transaction_code"]
     agent_id = context.user_data["agent_id"]
 
-    diff = new_amount - old_amount
-
-    conn = get_db()
-    cur = conn.cursor()
-
     try:
-        if diff > 0:
-            # اگر مبلغ افزایش یافت، موجودی عامل مبدأ هم باید افزایش یابد (پول بیشتر گرفته)
-            cur.execute(
-                """
-                UPDATE balances
-                SET balance = balance + ?
-                WHERE agent_id = ? AND currency = ?
-                """,
-                (diff, agent_id, currency),
-            )
-
-        elif diff < 0:
-            # اگر مبلغ کاهش یافت، موجودی عامل مبدأ هم باید کاهش یابد (باید پول برگرداند)
-            cur.execute(
-                """
-                UPDATE balances
-                SET balance = balance + ?
-                WHERE agent_id = ? AND currency = ?
-                """,
-                (diff, agent_id, currency),
-            )
-
-        # محاسبه کارمزد جدید (۱٪)
-        new_commission = new_amount * 0.01
-
-        # بروزرسانی رکورد حواله
-        cur.execute(
-            """
-            UPDATE transactions
-            SET amount = ?, commission = ?
-            WHERE transaction_code = ? AND agent_id = ? AND status = 'pending'
-            """,
-            (new_amount, new_commission, code, agent_id),
+        # اصلاح موجودی عامل مبدأ به اندازه تفاوت (کاهش فقط با موجودی کافی) و بروزرسانی حواله
+        old_amount, currency, new_commission, new_balance = await run_db(
+            ledger.edit_hawala_amount, code, agent_id, new_amount
         )
 
-        conn.commit()
-        conn.close()
-
-        new_balance = get_agent_balance(agent_id, currency)
-
         keyboard = [["✏️ مدیریت حواله‌های در انتظار"], ["🔙 بازگشت به منوی عامل"]]
 
         await update.message.reply_text(
@@ -1475,8 +1297,17 @@ async def edit_pending_amount(update, context):
         context.user_data.pop("edit_transaction_currency", None)
 
         return ConversationHandler.END
+    except ledger.TransactionNotFound:
+        await update.message.reply_text("❌ این حواله دیگر در انتظار نیست و قابل ویرایش نمی‌باشد.")
+        await agent_menu(update, context)
+        return ConversationHandler.END
+    except ledger.InsufficientBalance as e:
+        await update.message.reply_text(
+            f"❌ موجودی شما برای کاهش مبلغ حواله کافی نیست.\n"
+            f"💵 موجودی فعلی: {e.balance:,.0f} {currency}"
+        )
+        return EDIT_AMOUNT
     except Exception:
-        conn.close()
         logger.exception("Error updating pending transaction amount")
         await update.message.reply_text(
             "❌ خطا در بروزرسانی مبلغ حواله. لطفاً بعداً دوباره تلاش کنید."
@@ -1510,38 +1341,12 @@ async def delete_pending_confirm(update, context):
         return ConversationHandler.END
 
     code = context.user_data["edit_transaction_code"]
-    amount = context.user_data["edit_transaction_amount"]
     currency = context.user_data["edit_transaction_currency"]
     agent_id = context.user_data["agent_id"]
 
-    conn = get_db()
-    cur = conn.cursor()
-
     try:
-        # کسر مبلغ از موجودی عامل مبدأ (چون حواله لغو شد و باید پول برگرداند)
-        cur.execute(
-            """
-            UPDATE balances
-            SET balance = balance - ?
-            WHERE agent_id = ? AND currency = ?
-            """,
-            (amount, agent_id, currency),
-        )
-
-        # علامت‌گذاری حواله به‌عنوان لغو شده (فقط اگر هنوز pending است)
-        cur.execute(
-            """
-            UPDATE transactions
-            SET status = 'cancelled'
-            WHERE transaction_code = ? AND agent_id = ? AND status = 'pending'
-            """,
-            (code, agent_id),
-        )
-
-        conn.commit()
-        conn.close()
-
-        new_balance = get_agent_balance(agent_id, currency)
+        # لغو حواله و کسر مبلغ از موجودی عامل مبدأ (چون باید پول برگرداند) در یک تراکنش
+        amount, currency, new_balance = await run_db(ledger.cancel_hawala, code, agent_id)
 
         keyboard = [["💸 ارسال حواله جدید"], ["🔙 بازگشت به منوی عامل"]]
 
@@ -1558,9 +1363,19 @@ async def delete_pending_confirm(update, context):
         context.user_data.pop("edit_transaction_amount", None)
         context.user_data.pop("edit_transaction_currency", None)
 
+        return ConversationHandler.END
+    except ledger.TransactionNotFound:
+        await update.message.reply_text("❌ این حواله دیگر در انتظار نیست و قابل لغو نمی‌باشد.")
+        await agent_menu(update, context)
+        return ConversationHandler.END
+    except ledger.InsufficientBalance as e:
+        await update.message.reply_text(
+            f"❌ موجودی شما برای برگرداندن مبلغ حواله کافی نیست.\n"
+            f"💵 موجودی فعلی: {e.balance:,.0f} {currency}"
+        )
+        await agent_menu(update, context)
         return ConversationHandler.END
     except Exception:
-        conn.close()
         logger.exception("Error cancelling pending transaction")
         await update.message.reply_text(
             "❌ خطا در لغو حواله. لطفاً بعداً دوباره تلاش کنید."
@@ -1578,7 +1393,7 @@ async def balance_and_report_menu(update, context):
     """منوی موجودی و گزارش"""
     keyboard = [
         ["📊 نمایش گزارش کامل"],
-        ["📥 دانلود گزارش اکسل"],
+        ["📥 دانلود گزارش اکسل", "🗂 دانلود رسیدهای گروهی"],
         ["💵 مدیریت موجودی"],
         ["🔙 بازگشت به منوی عامل"],
     ]
@@ -1595,67 +1410,66 @@ async def show_full_report(update, context):
     """نمایش گزارش کامل: موجودی، آمار حواله‌ها، بدهی/طلب، کمیسیون"""
     agent_id = context.user_data["agent_id"]
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    # ۱. موجودی‌ها (تجمیع شده)
-    cur.execute(
-        """
-        SELECT currency, SUM(balance)
-        FROM balances
-        WHERE agent_id = ?
-        GROUP BY currency
-        ORDER BY currency
-    """,
-        (agent_id,),
-    )
-    balances = cur.fetchall()
+    def _load(cur):
+        # ۱. موجودی‌ها (تجمیع شده)
+        cur.execute(
+            """
+            SELECT currency, SUM(balance)
+            FROM balances
+            WHERE agent_id = ?
+            GROUP BY currency
+            ORDER BY currency
+        """,
+            (agent_id,),
+        )
+        balances = cur.fetchall()
 
-    # ۲. درآمد از کمیسیون (فقط حواله‌های غیر لغو شده)
-    cur.execute(
-        """
-        SELECT currency, SUM(commission)
-        FROM transactions
-        WHERE agent_id = ? AND status != 'cancelled'
-        GROUP BY currency
-    """,
-        (agent_id,),
-    )
-    commissions = {row[0]: row[1] for row in cur.fetchall()}
+        # ۲. درآمد از کمیسیون (فقط حواله‌های غیر لغو شده)
+        cur.execute(
+            """
+            SELECT currency, SUM(commission)
+            FROM transactions
+            WHERE agent_id = ? AND status != 'cancelled'
+            GROUP BY currency
+        """,
+            (agent_id,),
+        )
+        commissions = {row[0]: row[1] for row in cur.fetchall()}
 
-    # ۳. بدهی‌های دقیق به عامل‌های دیگر (حواله‌های ارسالی که هنوز پرداخت نشده‌اند)
-    cur.execute(
-        """
-        SELECT 
-            a.name as receiver_name,
-            t.currency,
-            SUM(t.amount) as debt_amount
-        FROM transactions t
-        JOIN agents a ON t.receiver_agent_id = a.id
-        WHERE t.agent_id = ? AND t.status = 'pending'
-        GROUP BY t.receiver_agent_id, t.currency
-    """,
-        (agent_id,),
-    )
-    debts = cur.fetchall()
+        # ۳. بدهی‌های دقیق به عامل‌های دیگر (حواله‌های ارسالی که هنوز پرداخت نشده‌اند)
+        cur.execute(
+            """
+            SELECT 
+                a.name as receiver_name,
+                t.currency,
+                SUM(t.amount) as debt_amount
+            FROM transactions t
+            JOIN agents a ON t.receiver_agent_id = a.id
+            WHERE t.agent_id = ? AND t.status = 'pending'
+            GROUP BY t.receiver_agent_id, t.currency
+        """,
+            (agent_id,),
+        )
+        debts = cur.fetchall()
 
-    # ۴. طلب‌های دقیق از عامل‌های دیگر (حواله‌های دریافتی که هنوز پرداخت نشده‌اند)
-    cur.execute(
-        """
-        SELECT 
-            a.name as sender_name,
-            t.currency,
-            SUM(t.amount) as credit_amount
-        FROM transactions t
-        JOIN agents a ON t.agent_id = a.id
-        WHERE t.receiver_agent_id = ? AND t.status = 'pending'
-        GROUP BY t.agent_id, t.currency
-    """,
-        (agent_id,),
-    )
-    credits = cur.fetchall()
+        # ۴. طلب‌های دقیق از عامل‌های دیگر (حواله‌های دریافتی که هنوز پرداخت نشده‌اند)
+        cur.execute(
+            """
+            SELECT 
+                a.name as sender_name,
+                t.currency,
+                SUM(t.amount) as credit_amount
+            FROM transactions t
+            JOIN agents a ON t.agent_id = a.id
+            WHERE t.receiver_agent_id = ? AND t.status = 'pending'
+            GROUP BY t.agent_id, t.currency
+        """,
+            (agent_id,),
+        )
+        credits = cur.fetchall()
+        return balances, commissions, debts, credits
 
-    conn.close()
+    balances, commissions, debts, credits = await db_read(_load)
 
     # ساخت گزارش
     report = "📊 *گزارش مالی و عملکرد حرفه‌ای*\n"
@@ -1731,7 +1545,7 @@ async def show_full_report(update, context):
     report += "\n⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯\n"
     report += "📈 *خلاصه عملکرد:* گزارش فوق بر اساس آخرین تراکنش‌های ثبت شده در سیستم می‌باشد."
 
-    keyboard = [["📊 نمایش گزارش کامل"], ["📥 دانلود گزارش اکسل"], ["💵 مدیریت موجودی"], ["🔙 بازگشت به منوی عامل"]]
+    keyboard = [["📊 نمایش گزارش کامل"], ["📥 دانلود گزارش اکسل", "🗂 دانلود رسیدهای گروهی"], ["💵 مدیریت موجودی"], ["🔙 بازگشت به منوی عامل"]]
 
     await update.message.reply_text(
         report,
@@ -1743,125 +1557,50 @@ async def show_full_report(update, context):
 
 @require_agent
 async def download_excel_report(update, context):
-    """تولید و ارسال گزارش اکسل کامل"""
-    agent_id = context.user_data["agent_id"]
-    
-    await update.message.reply_text("📥 در حال آماده‌سازی گزارش اکسل...")
-    
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # دریافت اطلاعات عامل
-    cur.execute("SELECT name, province FROM agents WHERE id = ?", (agent_id,))
-    agent_info = cur.fetchone()
-    agent_name, agent_province = agent_info if agent_info else ("نامشخص", "نامشخص")
-    
-    # دریافت تمام حواله‌های عامل
-    cur.execute(
-        """
-        SELECT 
-            t.transaction_code,
-            t.sender_name,
-            t.receiver_name,
-            t.receiver_tazkira,
-            t.amount,
-            t.currency,
-            t.commission,
-            t.status,
-            t.created_at,
-            t.completed_at,
-            a.name as receiver_agent_name,
-            a.province as receiver_province
-        FROM transactions t
-        LEFT JOIN agents a ON t.receiver_agent_id = a.id
-        WHERE t.agent_id = ?
-        ORDER BY t.created_at DESC
-    """,
-        (agent_id,),
-    )
-    transactions = cur.fetchall()
-    
-    # دریافت موجودی‌ها
-    cur.execute(
-        "SELECT currency, SUM(balance) FROM balances WHERE agent_id = ? GROUP BY currency ORDER BY currency",
-        (agent_id,),
+    """ثبت گزارش اکسل کامل در صف؛ فایل بعد از آماده شدن ارسال می‌شود"""
+    await enqueue_report(update, "agent_xlsx", {"agent_id": context.user_data["agent_id"]})
+
+
+@require_agent
+async def download_transactions_export(update, context, fmt):
+    """ثبت لیست حواله‌های عامل (CSV فشرده یا Parquet) در صف"""
+    await enqueue_report(
+        update, "agent_transactions", {"agent_id": context.user_data["agent_id"], "fmt": fmt}
     )
-    balances = cur.fetchall()
-    
-    conn.close()
-    
-    # ایجاد DataFrame برای حواله‌ها
-    df_transactions = pd.DataFrame(transactions, columns=[
-        'کد حواله', 'نام فرستنده', 'نام گیرنده', 'تذکره گیرنده',
-        'مبلغ', 'ارز', 'کارمزد', 'وضعیت', 'تاریخ ثبت', 'تاریخ تکمیل',
-        'عامل مقصد', 'ولایت مقصد'
-    ])
-    
-    # ایجاد DataFrame برای موجودی‌ها
-    df_balances = pd.DataFrame(balances, columns=['ارز', 'موجودی'])
-    
-    # ایجاد فایل اکسل با چند شیت
-    try:
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # شیت اطلاعات عامل
-            agent_data = {
-                'نام عامل': [agent_name],
-                'ولایت': [agent_province],
-                'تاریخ گزارش': [dt.now().strftime('%Y-%m-%d %H:%M:%S')],
-                'تعداد کل حواله‌ها': [len(transactions)]
-            }
-            pd.DataFrame(agent_data).to_excel(writer, sheet_name='اطلاعات عامل', index=False)
-            
-            # شیت حواله‌ها
-            if not df_transactions.empty:
-                df_transactions.to_excel(writer, sheet_name='حواله‌ها', index=False)
-            
-            # شیت موجودی‌ها
-            if not df_balances.empty:
-                df_balances.to_excel(writer, sheet_name='موجودی‌ها', index=False)
-            
-            # شیت خلاصه آمار
-            if not df_transactions.empty:
-                summary_data = {
-                    'نوع آمار': [
-                        'تعداد کل حواله‌ها',
-                        'حواله‌های در انتظار',
-                        'حواله‌های تکمیل شده',
-                        'حواله‌های لغو شده',
-                        'مجموع مبلغ حواله‌ها',
-                        'مجموع کارمزد دریافتی'
-                    ],
-                    'مقدار': [
-                        len(df_transactions),
-                        len(df_transactions[df_transactions['وضعیت'] == 'pending']),
-                        len(df_transactions[df_transactions['وضعیت'] == 'completed']),
-                        len(df_transactions[df_transactions['وضعیت'] == 'cancelled']),
-                        f"{df_transactions['مبلغ'].sum():,.0f}",
-                        f"{df_transactions['کارمزد'].sum():,.0f}"
-                    ]
-                }
-                pd.DataFrame(summary_data).to_excel(writer, sheet_name='خلاصه آمار', index=False)
-        
-        output.seek(0)
-        
-        # ارسال فایل
-        filename = f"گزارش_حواله‌ها_{agent_name}_{dt.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        
-        await update.message.reply_document(
-            document=output,
-            filename=filename,
-            caption=f"📊 *گزارش کامل حواله‌های شما*\n\n"
-                    f"👤 عامل: {agent_name}\n"
-                    f"📍 ولایت: {agent_province}\n"
-                    f"📦 تعداد حواله‌ها: {len(transactions)}\n"
-                    f"📅 تاریخ: {dt.now().strftime('%Y-%m-%d %H:%M')}\n\n"
-                    f"فایل شامل چند شیت با اطلاعات کامل است.",
-            parse_mode="Markdown"
+
+
+@report_job("agent_xlsx")
+def build_agent_xlsx_job(agent_id):
+    """تولید گزارش اکسل کامل عامل با چند شیت (ردیف به ردیف، بدون نگه داشتن کل تاریخچه در حافظه)"""
+    output, agent_name, agent_province, transaction_count = build_agent_report(agent_id)
+    if file_size(output) > EXPORT_MAX_FILE_BYTES:
+        output.close()
+        raise ReportFailed(
+            "❌ فایل اکسل از سقف ارسال تلگرام بزرگ‌تر است.\n"
+            "لطفاً خروجی CSV یا Parquet را انتخاب کنید (به چند فایل تقسیم می‌شود)."
         )
-    except Exception as e:
-        logger.exception("Error creating agent excel report")
-        await update.message.reply_text(f"❌ خطا در ایجاد گزارش اکسل: {str(e)}")
+
+    filename = f"گزارش_حواله‌ها_{agent_name}_{dt.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    caption = (
+        f"📊 *گزارش کامل حواله‌های شما*\n\n"
+        f"👤 عامل: {agent_name}\n"
+        f"📍 ولایت: {agent_province}\n"
+        f"📦 تعداد حواله‌ها: {transaction_count}\n"
+        f"📅 تاریخ: {dt.now().strftime('%Y-%m-%d %H:%M')}\n\n"
+        f"فایل شامل چند شیت با اطلاعات کامل است."
+    )
+    return [(output, filename, caption)]
+
+
+@report_job("agent_transactions")
+def build_agent_transactions_job(agent_id, fmt):
+    parts = export_transactions(fmt, agent_id)
+    return name_export_parts(
+        parts,
+        fmt,
+        filename=f"hawala_{agent_id}_{dt.now().strftime('%Y%m%d_%H%M%S')}",
+        caption=f"📊 *لیست حواله‌های شما*\n📅 تاریخ: {dt.now().strftime('%Y-%m-%d %H:%M')}",
+    )
 
 
 @require_agent
@@ -1964,10 +1703,7 @@ async def increase_balance_photo(update, context):
     currency = context.user_data["balance_currency"]
     amount = context.user_data["balance_amount"]
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    try:
+    def _save(cur):
         # ثبت درخواست در جدول balance_requests
         cur.execute(
             """
@@ -1976,15 +1712,15 @@ async def increase_balance_photo(update, context):
             """,
             (agent_id, amount, currency, photo_id),
         )
-        request_id = cur.lastrowid
-        conn.commit()
+        return cur.lastrowid
+
+    try:
+        request_id = await db_transaction(_save)
 
         # اطلاع‌رسانی به ادمین (در صورت وجود)
-        cur.execute("SELECT telegram_id FROM admins WHERE is_active = 1")
-        admins = cur.fetchall()
+        admins = await db_fetchall("SELECT telegram_id FROM admins WHERE is_active = 1")
         
-        cur.execute("SELECT name FROM agents WHERE id = ?", (agent_id,))
-        agent_name = cur.fetchone()[0]
+        agent_name = (await db_fetchone("SELECT name FROM agents WHERE id = ?", (agent_id,)))[0]
         
         admin_notif = (
             "🔔 *درخواست شارژ حساب جدید*\n\n"
@@ -2006,8 +1742,6 @@ async def increase_balance_photo(update, context):
                 except Exception as e:
                     logger.error(f"Failed to notify admin {admin_row[0]}: {e}")
 
-        conn.close()
-
         keyboard = [["🔙 بازگشت به منوی عامل"]]
         await update.message.reply_text(
             "✅ *درخواست شما با موفقیت ثبت شد.*\n\n"
@@ -2019,8 +1753,6 @@ async def increase_balance_photo(update, context):
         return ConversationHandler.END
 
     except Exception as e:
-        if conn:
-            conn.close()
         logger.exception("Error registering balance request")
         await update.message.reply_text("❌ خطا در ثبت درخواست. لطفاً بعداً تلاش کنید.")
         return ConversationHandler.END
@@ -2041,7 +1773,6 @@ async def increase_balance_photo(update, context):
         return ConversationHandler.END
 
     except Exception:
-        conn.close()
         logger.exception("Error increasing balance")
         await update.message.reply_text("❌ خطا در افزایش موجودی")
         return ConversationHandler.END
@@ -2079,7 +1810,7 @@ async def decrease_balance_currency(update, context):
         return DECREASE_BALANCE_CURRENCY
 
     agent_id = context.user_data["agent_id"]
-    balance = get_agent_balance(agent_id, currency)
+    balance = await run_db(get_agent_balance, agent_id, currency)
 
     if balance <= 0:
         keyboard = [["🔙 بازگشت"]]
@@ -2116,34 +1847,9 @@ async def decrease_balance_amount(update, context):
     agent_id = context.user_data["agent_id"]
     currency = context.user_data["balance_currency"]
 
-    # چک موجودی
-    balance = get_agent_balance(agent_id, currency)
-    if balance < amount:
-        await update.message.reply_text(
-            f"❌ موجودی شما کافی نیست.\n"
-            f"💵 موجودی فعلی: {balance:,.0f} {currency}\n"
-            f"💰 مبلغ درخواستی: {amount:,.0f} {currency}"
-        )
-        return DECREASE_BALANCE_AMOUNT
-
-    conn = get_db()
-    cur = conn.cursor()
-
     try:
-        # کاهش موجودی
-        cur.execute(
-            """
-            UPDATE balances
-            SET balance = balance - ?
-            WHERE agent_id = ? AND currency = ?
-        """,
-            (amount, agent_id, currency),
-        )
-
-        conn.commit()
-        conn.close()
-
-        new_balance = get_agent_balance(agent_id, currency)
+        # کاهش شرطی موجودی (فقط اگر موجودی کافی باشد)
+        new_balance = await run_db(ledger.decrease_balance, agent_id, currency, amount)
 
         keyboard = [["➖ کاهش موجودی"], ["🔙 بازگشت به منوی عامل"]]
 
@@ -2160,8 +1866,14 @@ async def decrease_balance_amount(update, context):
 
         return ConversationHandler.END
 
+    except ledger.InsufficientBalance as e:
+        await update.message.reply_text(
+            f"❌ موجودی شما کافی نیست.\n"
+            f"💵 موجودی فعلی: {e.balance:,.0f} {currency}\n"
+            f"💰 مبلغ درخواستی: {amount:,.0f} {currency}"
+        )
+        return DECREASE_BALANCE_AMOUNT
     except Exception:
-        conn.close()
         logger.exception("Error decreasing balance")
         await update.message.reply_text("❌ خطا در کاهش موجودی")
         return ConversationHandler.END
@@ -2172,10 +1884,7 @@ async def add_currency_start(update, context):
     """شروع اضافه کردن ارز جدید"""
     agent_id = context.user_data["agent_id"]
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
+    rows = await db_fetchall(
         """
         SELECT DISTINCT currency
         FROM balances
@@ -2183,8 +1892,7 @@ async def add_currency_start(update, context):
     """,
         (agent_id,),
     )
-    existing_currencies = [row[0] for row in cur.fetchall()]
-    conn.close()
+    existing_currencies = [row[0] for row in rows]
 
     keyboard = []
     if "AFN" not in existing_currencies:
@@ -2230,10 +1938,7 @@ async def add_currency_confirm(update, context):
 
     agent_id = context.user_data["agent_id"]
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    try:
+    def _add(cur):
         # چک کن که قبلاً اضافه نشده باشد
         cur.execute(
             """
@@ -2243,25 +1948,20 @@ async def add_currency_confirm(update, context):
             (agent_id, currency),
         )
         if cur.fetchone():
+            return False
+
+        # اضافه کردن ارز با موجودی صفر
+        ledger.open_balance(cur, agent_id, currency)
+        return True
+
+    try:
+        if not await db_transaction(_add):
             await update.message.reply_text(
                 f"❌ ارز {currency} قبلاً اضافه شده است."
             )
-            conn.close()
             await balance_management_menu(update, context)
             return
 
-        # اضافه کردن ارز با موجودی صفر
-        cur.execute(
-            """
-            INSERT INTO balances (agent_id, currency, balance)
-            VALUES (?, ?, 0)
-        """,
-            (agent_id, currency),
-        )
-
-        conn.commit()
-        conn.close()
-
         keyboard = [["➕ افزایش موجودی"], ["🔙 بازگشت به منوی عامل"]]
 
         await update.message.reply_text(
@@ -2275,7 +1975,6 @@ async def add_currency_confirm(update, context):
         return ConversationHandler.END
 
     except Exception:
-        conn.close()
         logger.exception("Error adding currency")
         await update.message.reply_text("❌ خطا در اضافه کردن ارز")
         return ConversationHandler.END
@@ -2330,9 +2029,6 @@ async def search_advanced_results(update, context, query=None):
     search_type = context.user_data.get("search_type", "")
     agent_id = context.user_data.get("agent_id")
     
-    conn = get_db()
-    cur = conn.cursor()
-    
     sql = """
         SELECT t.transaction_code, t.receiver_name, t.amount, t.currency, t.status, t.created_at
         FROM transactions t
@@ -2352,9 +2048,7 @@ async def search_advanced_results(update, context, query=None):
         
     sql += " ORDER BY t.created_at DESC LIMIT 10"
     
-    cur.execute(sql, params)
-    results = cur.fetchall()
-    conn.close()
+    results = await db_fetchall(sql, params)
     
     if not results:
         await update.message.reply_text("🔍 متأسفانه نتیجه‌ای یافت نشد.")
@@ -2382,9 +2076,7 @@ async def handle_receipt_callback(update, context):
     
     code = query.data.replace("get_receipt_", "")
     
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("""
+    row = await db_fetchone("""
         SELECT t.transaction_code, t.sender_name, t.receiver_name, t.receiver_tazkira, 
                t.amount, t.currency, t.created_at,
                a_sender.name as sender_agent_name, a_receiver.name as receiver_agent_name
@@ -2393,8 +2085,6 @@ async def handle_receipt_callback(update, context):
         JOIN agents a_receiver ON t.receiver_agent_id = a_receiver.id
         WHERE t.transaction_code = ?
     """, (code,))
-    row = cur.fetchone()
-    conn.close()
     
     if not row:
         await query.message.reply_text("❌ اطلاعات حواله یافت نشد.")
@@ -2413,18 +2103,183 @@ async def handle_receipt_callback(update, context):
     }
     
     try:
-        receipt_img = generate_receipt_image(receipt_data)
-        await context.bot.send_photo(
-            chat_id=update.effective_chat.id,
-            photo=receipt_img,
+        # رسید تغییر نمی‌کند؛ از file_id یا کش دیسک استفاده می‌شود
+        await send_receipt(
+            context.bot,
+            update.effective_chat.id,
+            receipt_data,
             caption=f"🧾 *رسید مجدد حواله {code}*",
-            parse_mode="Markdown"
         )
+    except ReceiptBusy:
+        await query.message.reply_text("⏳ سیستم در حال تولید رسیدهای دیگر است، لطفاً چند لحظه بعد دوباره تلاش کنید.")
     except Exception as e:
         logger.error(f"Error sending receipt: {e}")
         await query.message.reply_text("❌ خطا در تولید رسید.")
 
 
+# =======================
+# 🗂 رسیدهای گروهی
+# =======================
+
+
+async def _batch_back_to_menu(update, context):
+    context.user_data.pop("batch", None)
+    if context.user_data.get("role") == "admin":
+        from bot.handlers.admin import admin_menu
+
+        await admin_menu(update, context)
+    else:
+        await agent_menu(update, context)
+    return ConversationHandler.END
+
+
+def _parse_batch_date(text):
+    try:
+        return dt.strptime(text.strip(), "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+@require_any_auth
+async def batch_receipts_start(update, context):
+    """شروع دانلود رسیدهای یک بازه زمانی (ادمین ابتدا عامل را انتخاب می‌کند)"""
+    context.user_data["batch"] = {}
+    cancel_keyboard = ReplyKeyboardMarkup([["❌ لغو"]], resize_keyboard=True)
+
+    if context.user_data.get("role") == "admin":
+        await update.message.reply_text(
+            "🗂 *رسیدهای گروهی*\n\n🆔 ID عامل را وارد کنید:",
+            parse_mode="Markdown",
+            reply_markup=cancel_keyboard,
+        )
+        return BATCH_AGENT
+
+    context.user_data["batch"]["agent_id"] = context.user_data["agent_id"]
+    await update.message.reply_text(
+        "🗂 *رسیدهای گروهی*\n\n📅 تاریخ شروع را وارد کنید (مثال: 2024-01-31):",
+        parse_mode="Markdown",
+        reply_markup=cancel_keyboard,
+    )
+    return BATCH_DATE_FROM
+
+
+@require_any_auth
+async def batch_receipts_agent(update, context):
+    text = update.message.text.strip()
+    if text == "❌ لغو":
+        return await _batch_back_to_menu(update, context)
+
+    if not text.isdigit():
+        await update.message.reply_text("❌ ID عامل باید عدد باشد:")
+        return BATCH_AGENT
+
+    agent = await run_db(get_agent_by_id, int(text))
+    if not agent:
+        await update.message.reply_text("❌ عاملی با این ID یافت نشد. دوباره وارد کنید:")
+        return BATCH_AGENT
+
+    context.user_data["batch"]["agent_id"] = agent["id"]
+    await update.message.reply_text(
+        f"👤 عامل: {agent['name']}\n\n📅 تاریخ شروع را وارد کنید (مثال: 2024-01-31):"
+    )
+    return BATCH_DATE_FROM
+
+
+@require_any_auth
+async def batch_receipts_date_from(update, context):
+    text = update.message.text.strip()
+    if text == "❌ لغو":
+        return await _batch_back_to_menu(update, context)
+
+    date_from = _parse_batch_date(text)
+    if not date_from:
+        await update.message.reply_text("❌ تاریخ نامعتبر است. به شکل YYYY-MM-DD وارد کنید:")
+        return BATCH_DATE_FROM
+
+    context.user_data["batch"]["date_from"] = date_from
+    await update.message.reply_text("📅 تاریخ پایان را وارد کنید (مثال: 2024-02-29):")
+    return BATCH_DATE_TO
+
+
+@require_any_auth
+async def batch_receipts_date_to(update, context):
+    text = update.message.text.strip()
+    if text == "❌ لغو":
+        return await _batch_back_to_menu(update, context)
+
+    batch = context.user_data["batch"]
+    date_to = _parse_batch_date(text)
+    if not date_to:
+        await update.message.reply_text("❌ تاریخ نامعتبر است. به شکل YYYY-MM-DD وارد کنید:")
+        return BATCH_DATE_TO
+    if date_to < batch["date_from"]:
+        await update.message.reply_text("❌ تاریخ پایان نباید قبل از تاریخ شروع باشد:")
+        return BATCH_DATE_TO
+
+    count = await run_db(count_batch_transactions, batch["agent_id"], batch["date_from"], date_to)
+    if count == 0:
+        await update.message.reply_text("🔍 در این بازه حواله‌ای یافت نشد.")
+        return await _batch_back_to_menu(update, context)
+    if count > RECEIPT_BATCH_MAX:
+        await update.message.reply_text(
+            f"❌ در این بازه {count} حواله وجود دارد؛ حداکثر {RECEIPT_BATCH_MAX} حواله در یک فایل ممکن است.\n"
+            "📅 تاریخ پایان نزدیک‌تری وارد کنید:"
+        )
+        return BATCH_DATE_TO
+
+    batch["date_to"] = date_to
+    batch["count"] = count
+    await update.message.reply_text(
+        f"📦 تعداد {count} رسید یافت شد.\n\nفرمت فایل را انتخاب کنید:",
+        reply_markup=ReplyKeyboardMarkup([["📄 PDF", "🗜 ZIP"], ["❌ لغو"]], resize_keyboard=True),
+    )
+    return BATCH_FORMAT
+
+
+@require_any_auth
+async def batch_receipts_format(update, context):
+    text = update.message.text.strip()
+    if text == "❌ لغو":
+        return await _batch_back_to_menu(update, context)
+
+    if text == "📄 PDF":
+        fmt = "pdf"
+    elif text == "🗜 ZIP":
+        fmt = "zip"
+    else:
+        await update.message.reply_text("❌ فقط از دکمه‌ها استفاده کنید")
+        return BATCH_FORMAT
+
+    batch = context.user_data["batch"]
+    await update.message.reply_text(
+        f"⏳ در حال تولید {batch['count']} رسید...", reply_markup=ReplyKeyboardRemove()
+    )
+
+    try:
+        output, count = await build_receipt_batch(
+            batch["agent_id"], batch["date_from"], batch["date_to"], fmt
+        )
+        if output is None:
+            await update.message.reply_text("🔍 در این بازه حواله‌ای یافت نشد.")
+            return await _batch_back_to_menu(update, context)
+        with output:
+            await update.message.reply_document(
+                document=output,
+                filename=f"receipts_{batch['agent_id']}_{batch['date_from']}_{batch['date_to']}.{fmt}",
+                caption=(
+                    f"🗂 *رسیدهای گروهی*\n\n"
+                    f"📅 از {batch['date_from']} تا {batch['date_to']}\n"
+                    f"📦 تعداد رسید: {count}"
+                ),
+                parse_mode="Markdown",
+            )
+    except Exception:
+        logger.exception("Error creating receipt batch")
+        await update.message.reply_text("❌ خطا در تولید رسیدهای گروهی")
+
+    return await _batch_back_to_menu(update, context)
+
+
 @require_agent
 async def handle_pay_fast_callback(update, context):
     """هندلر دکمه شیشه‌ای پرداخت سریع"""
@@ -2452,7 +2307,7 @@ async def agent_logout(update, context):
     # استفاده از تابع unbind
     from bot.services.database import unbind_agent_telegram_id
 
-    unbind_agent_telegram_id(user_id)
+    await run_db(unbind_agent_telegram_id, user_id)
 
     # پاک کردن context
     context.user_data.clear()
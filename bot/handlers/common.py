@@ -1,10 +1,13 @@
-from telegram import ReplyKeyboardRemove
+from telegram import ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
 from bot.services.database import (
     get_admin_by_telegram_id,
     get_agent_by_telegram_id,
     unbind_admin_telegram_id,  # جدید
     unbind_agent_telegram_id,  # جدید
+    run_db,
 )
+from bot.services.export import parquet_available, EXPORT_EXTENSIONS
+from bot.services.jobs import report_jobs
 from bot.handlers.start import start
 
 
@@ -14,15 +17,15 @@ async def exit_menu(update, context):
     user_id = update.effective_user.id
 
     # 1. تشخیص نوع کاربر
-    admin = get_admin_by_telegram_id(user_id)
-    agent = get_agent_by_telegram_id(user_id)
+    admin = await run_db(get_admin_by_telegram_id, user_id)
+    agent = await run_db(get_agent_by_telegram_id, user_id)
 
     # 2. unbind صحیح
     if admin:
-        unbind_admin_telegram_id(user_id)  # فقط از ادمین
+        await run_db(unbind_admin_telegram_id, user_id)  # فقط از ادمین
         print(f"🔍 exit_menu: Admin {user_id} logged out")
     elif agent:
-        unbind_agent_telegram_id(user_id)  # فقط از عامل
+        await run_db(unbind_agent_telegram_id, user_id)  # فقط از عامل
         print(f"🔍 exit_menu: Agent {user_id} logged out")
     else:
         print(f"🔍 exit_menu: User {user_id} not found in any table")
@@ -37,3 +40,45 @@ async def exit_menu(update, context):
 
     # 5. نمایش منوی اصلی ورود
     await start(update, context)
+
+
+async def report_format_menu(update, context):
+    """انتخاب فرمت خروجی گزارش (اکسل کامل یا لیست حواله‌ها برای گزارش‌های بزرگ)"""
+    keyboard = [
+        [InlineKeyboardButton("📊 اکسل کامل (XLSX)", callback_data="report_fmt_xlsx")],
+        [InlineKeyboardButton("🗜 لیست حواله‌ها (CSV فشرده)", callback_data="report_fmt_csv")],
+    ]
+    if parquet_available():
+        keyboard.append([InlineKeyboardButton("🧱 لیست حواله‌ها (Parquet)", callback_data="report_fmt_parquet")])
+
+    await update.message.reply_text(
+        "📥 *دانلود گزارش*\n\nفرمت فایل را انتخاب کنید:\n"
+        "برای تاریخچه‌های بزرگ CSV یا Parquet سریع‌تر و کم‌حجم‌تر است.",
+        parse_mode="Markdown",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
+
+
+def name_export_parts(parts, fmt, filename, caption):
+    """نام و توضیح فایل‌های خروجی؛ اگر خروجی چند قسمت شده باشد شماره قسمت اضافه می‌شود"""
+    extension = EXPORT_EXTENSIONS[fmt]
+    if len(parts) == 1:
+        return [(parts[0], f"{filename}.{extension}", caption)]
+    return [
+        (
+            output,
+            f"{filename}_part{index}of{len(parts)}.{extension}",
+            f"{caption}\n🧩 قسمت {index} از {len(parts)}",
+        )
+        for index, output in enumerate(parts, start=1)
+    ]
+
+
+async def enqueue_report(update, kind, params):
+    """ثبت گزارش در صف و جواب فوری؛ فایل بعد از آماده شدن در همین چت ارسال می‌شود"""
+    message = update.effective_message
+    created = await report_jobs.submit(kind, params, update.effective_chat.id)
+    if created:
+        await message.reply_text("⏳ گزارش شما در صف آماده‌سازی قرار گرفت و پس از آماده شدن ارسال می‌شود.")
+    else:
+        await message.reply_text("⏳ همین گزارش در حال آماده‌سازی است؛ پس از آماده شدن برای شما هم ارسال می‌شود.")
@@ -2,12 +2,17 @@ from telegram import ReplyKeyboardMarkup
 from bot.services.database import (
     get_admin_by_telegram_id,
     get_agent_by_telegram_id,
+    run_db,
 )
 
 
 async def start(update, context):
     user_id = update.effective_user.id
 
+    # /start ورود نیمه‌کاره را رها می‌کند؛ هش پسورد در user_data نمی‌ماند
+    for key in ("login_agent_id", "password_hash", "admin"):
+        context.user_data.pop(key, None)
+
     # بررسی نقش از طریق سشن (برای تست با اکانت مشترک)
     role = context.user_data.get("role")
     
@@ -23,8 +28,8 @@ async def start(update, context):
         return
 
     # اگر در سشن نبود، از دیتابیس چک کن
-    admin = get_admin_by_telegram_id(user_id)
-    agent = get_agent_by_telegram_id(user_id)
+    admin = await run_db(get_admin_by_telegram_id, user_id)
+    agent = await run_db(get_agent_by_telegram_id, user_id)
 
     # 👑 ادمین لاگین شده
     if admin and admin["is_active"]:
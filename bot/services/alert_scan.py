@@ -0,0 +1,138 @@
+import logging
+
+from bot.services.database import run_db
+from bot.services.ledger import run_in_unit_of_work
+from bot.services.reporting import cached_read, collect_metrics, evaluate_health
+from bot.services.alerts import (
+    LOW_BALANCE,
+    ZERO_BALANCE,
+    INACTIVE_WITH_BALANCE,
+    HIGH_AMOUNT,
+    OLD_PENDING,
+    INACTIVE_AGENT,
+    HEALTH_PREFIX,
+    sync_time_alerts,
+    sync_health_alerts,
+    load_new_alerts,
+    mark_alerts_notified,
+)
+from config import ALERT_SCAN_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# اسکن دوره‌ای هشدارها
+# =========================
+# هر ALERT_SCAN_INTERVAL ثانیه (JobQueue تلگرام): قانون‌های زمانی و بررسی سلامت یکبار اجرا می‌شوند
+# و فقط هشدارهای تازه (notified = 0) در یک پیام خلاصه برای همه ادمین‌ها فرستاده می‌شوند؛
+# علامت notified فقط بعد از رسیدن خلاصه به دست دست‌کم یک ادمین زده می‌شود
+
+_SECTIONS = (
+    (HEALTH_PREFIX, "🏥 سلامت سیستم"),
+    (LOW_BALANCE, "🔴 موجودی کم"),
+    (ZERO_BALANCE, "🔴 عامل‌های بدون موجودی"),
+    (OLD_PENDING, "⏳ حواله‌های قدیمی در انتظار"),
+    (INACTIVE_WITH_BALANCE, "🟠 عامل‌های غیرفعال با موجودی"),
+    (INACTIVE_AGENT, "💤 عامل‌های بدون فعالیت"),
+    (HIGH_AMOUNT, "💎 حواله‌های با مبلغ بالا"),
+)
+_SECTION_LINES = 5  # بیشتر از این فقط شمرده می‌شود
+
+_scheduled = False
+
+
+def scan_scheduled():
+    """اگر اسکن دوره‌ای فعال است، صفحه هشدارها خودش قانون‌های زمانی را اجرا نمی‌کند"""
+    return _scheduled
+
+
+def _admin_chats(cur):
+    cur.execute("SELECT telegram_id FROM admins WHERE is_active = 1 AND telegram_id IS NOT NULL")
+    return [row[0] for row in cur.fetchall()]
+
+
+def _scan(cur, issue_keys):
+    sync_time_alerts(cur)
+    sync_health_alerts(cur, issue_keys)
+    return load_new_alerts(cur), _admin_chats(cur)
+
+
+def _section(rule):
+    return HEALTH_PREFIX if rule.startswith(HEALTH_PREFIX) else rule
+
+
+def _alert_line(row, issues):
+    _, rule, name, currency, balance, code, amount, tx_currency = row
+    if rule.startswith(HEALTH_PREFIX):
+        return issues.get(rule[len(HEALTH_PREFIX):])
+    if code:
+        return f"{code} | {amount or 0:,.0f} {tx_currency} | {name}"
+    if currency:
+        return f"{name}: {balance or 0:,.0f} {currency}"
+    return name
+
+
+def build_digest(rows, issues):
+    """متن پیام خلاصه هشدارهای تازه (بدون Markdown، چون نام‌ها از ورودی کاربر هستند)"""
+    grouped = {}
+    for row in rows:
+        line = _alert_line(row, issues)
+        if line:
+            grouped.setdefault(_section(row[1]), []).append(line)
+    if not grouped:
+        return None
+
+    text = f"🚨 هشدارهای جدید سیستم ({sum(len(lines) for lines in grouped.values())})\n"
+    for section, title in _SECTIONS:
+        lines = grouped.get(section)
+        if not lines:
+            continue
+        text += f"\n{title}:\n"
+        for line in lines[:_SECTION_LINES]:
+            text += f"   • {line}\n"
+        if len(lines) > _SECTION_LINES:
+            text += f"   … و {len(lines) - _SECTION_LINES} مورد دیگر\n"
+    text += "\nجزئیات: 🚨 هشدارها و اطلاعیه‌ها"
+    return text
+
+
+async def scan_alerts(context):
+    """کار JobQueue: یک اسکن و ارسال خلاصه هشدارهای تازه"""
+    metrics = await cached_read("metrics", collect_metrics)
+    _, issues = evaluate_health(metrics)
+    rows, chat_ids = await run_db(run_in_unit_of_work, _scan, list(issues))
+    if not rows or not chat_ids:
+        # بدون ادمین قابل ارسال، هشدارها برای اسکن بعدی تازه می‌مانند
+        return
+
+    text = build_digest(rows, issues)
+    # اگر متنی برای نمایش نیست (مثلا مسئله سلامت بدون شرح) فقط علامت می‌خورند
+    delivered = text is None
+    if text:
+        logger.info("Alert scan: %d new alert(s) for %d admin(s)", len(rows), len(chat_ids))
+        for chat_id in chat_ids:
+            try:
+                await context.bot.send_message(chat_id=chat_id, text=text)
+                delivered = True
+            except Exception:
+                logger.exception("Could not send alert digest to %s", chat_id)
+
+    if delivered:
+        await run_db(run_in_unit_of_work, mark_alerts_notified, rows[-1][0])
+
+
+def schedule_alert_scan(application):
+    """ثبت اسکن دوره‌ای روی JobQueue برنامه (نیاز به python-telegram-bot[job-queue])"""
+    global _scheduled
+    if ALERT_SCAN_INTERVAL <= 0:
+        return
+    if application.job_queue is None:
+        logger.warning("JobQueue is not available; install python-telegram-bot[job-queue] for alert scans")
+        return
+    application.job_queue.run_repeating(
+        scan_alerts,
+        interval=ALERT_SCAN_INTERVAL,
+        first=10,
+        name="alert_scan",
+    )
+    _scheduled = True
@@ -0,0 +1,230 @@
+import logging
+from datetime import datetime as dt, timedelta
+
+from config import (
+    ALERT_LOW_BALANCE_AFN,
+    ALERT_HIGH_AMOUNT,
+    ALERT_PENDING_DAYS,
+    ALERT_INACTIVE_DAYS,
+)
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# موتور هشدارها
+# =========================
+# هشدارهای فعال در جدول alerts نگهداری می‌شوند (مایگریشن ۱۱):
+# قانون‌های وابسته به موجودی، عامل و حواله با trigger در همان تراکنشِ تغییر به‌روز می‌شوند،
+# قانون‌های وابسته به زمان (در انتظار قدیمی، عدم فعالیت) با sync_time_alerts
+# صفحه هشدارها فقط همین جدول را می‌خواند
+
+LOW_BALANCE = "low_balance"
+ZERO_BALANCE = "zero_balance"
+INACTIVE_WITH_BALANCE = "inactive_with_balance"
+HIGH_AMOUNT = "high_amount"
+OLD_PENDING = "old_pending"
+INACTIVE_AGENT = "inactive_agent"
+# مسائل بررسی سلامت (reporting.evaluate_health) هم با پیشوند health_ در همین جدول ثبت می‌شوند
+HEALTH_PREFIX = "health_"
+
+# هر قانون: کوئری ردیف‌هایی که باید هشدار داشته باشند (agent_id, currency, transaction_id)
+# همان شرط‌های trigger ها؛ برای ساخت دوباره بعد از تغییر آستانه‌ها
+_STATE_RULES = {
+    LOW_BALANCE: """
+        SELECT a.id, b.currency, 0 FROM agents a
+        JOIN balances b ON b.agent_id = a.id
+        WHERE a.is_active = 1 AND b.currency = 'AFN' AND b.balance < :low_balance_afn
+    """,
+    ZERO_BALANCE: """
+        SELECT a.id, '', 0 FROM agents a
+        WHERE a.is_active = 1 AND NOT EXISTS (
+            SELECT 1 FROM balances z WHERE z.agent_id = a.id AND z.balance > 0
+        )
+    """,
+    INACTIVE_WITH_BALANCE: """
+        SELECT a.id, b.currency, 0 FROM agents a
+        JOIN balances b ON b.agent_id = a.id
+        WHERE a.is_active = 0 AND b.balance > 0
+    """,
+    HIGH_AMOUNT: """
+        SELECT COALESCE(agent_id, 0), '', id FROM transactions
+        WHERE status != 'cancelled' AND amount > :high_amount
+    """,
+}
+
+_TIME_RULES = {
+    OLD_PENDING: """
+        SELECT COALESCE(agent_id, 0), '', id FROM transactions
+        WHERE status = 'pending' AND created_at < :pending_before
+    """,
+    INACTIVE_AGENT: """
+        SELECT a.id, '', 0 FROM agents a
+        LEFT JOIN agent_activity x ON x.agent_id = a.id
+        WHERE a.is_active = 1 AND (x.last_activity IS NULL OR x.last_activity < :inactive_before)
+    """,
+}
+
+
+def _settings():
+    return {
+        "low_balance_afn": ALERT_LOW_BALANCE_AFN,
+        "high_amount": ALERT_HIGH_AMOUNT,
+    }
+
+
+def _sync_rule(cur, rule, matches, params):
+    """هشدارهایی که دیگر برقرار نیستند حذف و هشدارهای تازه اضافه می‌شوند (بقیه دست نمی‌خورند)"""
+    params = {**params, "rule": rule}
+    cur.execute(
+        f"""
+        DELETE FROM alerts
+        WHERE rule = :rule AND (agent_id, currency, transaction_id) NOT IN ({matches})
+        """,
+        params,
+    )
+    removed = cur.rowcount
+    cur.execute(
+        f"""
+        INSERT OR IGNORE INTO alerts (rule, agent_id, currency, transaction_id)
+        SELECT :rule, * FROM ({matches})
+        """,
+        params,
+    )
+    return removed, cur.rowcount
+
+
+def apply_alert_settings(cur):
+    """
+    نوشتن آستانه‌های config در alert_settings (هنگام شروع ربات)
+    اگر تغییر کرده باشند، هشدارهای وابسته به آستانه یکبار کامل دوباره ساخته می‌شوند
+    """
+    settings = _settings()
+    cur.execute("SELECT name, value FROM alert_settings")
+    if dict(cur.fetchall()) == settings:
+        return False
+
+    cur.executemany(
+        "INSERT OR REPLACE INTO alert_settings (name, value) VALUES (?, ?)",
+        settings.items(),
+    )
+    for rule, matches in _STATE_RULES.items():
+        removed, added = _sync_rule(cur, rule, matches, settings)
+        logger.info("Alert rule %s rebuilt: %d removed, %d added", rule, removed, added)
+    return True
+
+
+def sync_time_alerts(cur, now=None):
+    """به‌روزرسانی هشدارهای وابسته به زمان؛ خروجی تعداد هشدارهای تازه"""
+    now = now or dt.now()
+    params = {
+        "pending_before": (now - timedelta(days=ALERT_PENDING_DAYS)).strftime('%Y-%m-%d'),
+        "inactive_before": (now - timedelta(days=ALERT_INACTIVE_DAYS)).strftime('%Y-%m-%d'),
+    }
+    added = 0
+    for rule, matches in _TIME_RULES.items():
+        added += _sync_rule(cur, rule, matches, params)[1]
+    return added
+
+
+def load_alerts(cur):
+    """هشدارهای فعال برای صفحه هشدارها، به ترتیب و تعداد قبلی هر بخش"""
+    queries = {
+        LOW_BALANCE: """
+            SELECT a.id, a.name, a.province, b.balance, b.currency
+            FROM alerts al
+            JOIN agents a ON a.id = al.agent_id
+            JOIN balances b ON b.agent_id = al.agent_id AND b.currency = al.currency
+            WHERE al.rule = 'low_balance'
+            ORDER BY b.balance ASC
+            LIMIT 10
+        """,
+        ZERO_BALANCE: """
+            SELECT a.id, a.name, a.province
+            FROM alerts al
+            JOIN agents a ON a.id = al.agent_id
+            WHERE al.rule = 'zero_balance'
+            ORDER BY a.name
+        """,
+        OLD_PENDING: """
+            SELECT t.transaction_code, t.sender_name, t.receiver_name,
+                   t.amount, t.currency, t.created_at, a.name as agent_name
+            FROM alerts al
+            JOIN transactions t ON t.id = al.transaction_id
+            JOIN agents a ON t.agent_id = a.id
+            WHERE al.rule = 'old_pending'
+            ORDER BY t.created_at ASC
+            LIMIT 10
+        """,
+        INACTIVE_WITH_BALANCE: """
+            SELECT a.id, a.name, a.province, b.balance, b.currency
+            FROM alerts al
+            JOIN agents a ON a.id = al.agent_id
+            JOIN balances b ON b.agent_id = al.agent_id AND b.currency = al.currency
+            WHERE al.rule = 'inactive_with_balance'
+            ORDER BY b.balance DESC
+        """,
+        INACTIVE_AGENT: """
+            SELECT a.id, a.name, a.province, x.last_activity
+            FROM alerts al
+            JOIN agents a ON a.id = al.agent_id
+            LEFT JOIN agent_activity x ON x.agent_id = al.agent_id
+            WHERE al.rule = 'inactive_agent'
+            ORDER BY x.last_activity ASC
+            LIMIT 10
+        """,
+        HIGH_AMOUNT: """
+            SELECT t.transaction_code, t.sender_name, t.receiver_name,
+                   t.amount, t.currency, t.created_at, a.name as agent_name
+            FROM alerts al
+            JOIN transactions t ON t.id = al.transaction_id
+            JOIN agents a ON t.agent_id = a.id
+            WHERE al.rule = 'high_amount'
+            ORDER BY t.amount DESC
+            LIMIT 5
+        """,
+    }
+    result = {}
+    for rule, sql in queries.items():
+        cur.execute(sql)
+        result[rule] = cur.fetchall()
+    return result
+
+
+def sync_health_alerts(cur, issue_keys):
+    """ثبت مسائل فعلی بررسی سلامت به عنوان هشدار؛ مسائل حل شده حذف می‌شوند"""
+    rules = [HEALTH_PREFIX + key for key in issue_keys]
+    placeholders = ", ".join("?" for _ in rules)
+    cur.execute(
+        f"DELETE FROM alerts WHERE rule LIKE 'health!_%' ESCAPE '!' AND rule NOT IN ({placeholders})",
+        rules,
+    )
+    cur.executemany("INSERT OR IGNORE INTO alerts (rule) VALUES (?)", [(rule,) for rule in rules])
+
+
+def load_new_alerts(cur):
+    """
+    هشدارهایی که هنوز به ادمین‌ها اطلاع داده نشده‌اند، به ترتیب ثبت؛
+    علامت اطلاع داده شده بعد از ارسال با mark_alerts_notified زده می‌شود
+    """
+    cur.execute(
+        """
+        SELECT al.id, al.rule, a.name, al.currency, b.balance,
+               t.transaction_code, t.amount, t.currency
+        FROM alerts al
+        LEFT JOIN agents a ON a.id = al.agent_id
+        LEFT JOIN balances b ON b.agent_id = al.agent_id AND b.currency = al.currency
+        LEFT JOIN transactions t ON t.id = al.transaction_id
+        WHERE al.notified = 0
+        ORDER BY al.id
+        """
+    )
+    return cur.fetchall()
+
+
+def mark_alerts_notified(cur, max_id):
+    """هشدارهای تازه تا max_id (همان‌هایی که در خلاصه رفتند) اطلاع داده شده علامت می‌خورند"""
+    cur.execute(
+        "UPDATE alerts SET notified = 1 WHERE notified = 0 AND id <= ?",
+        (max_id,),
+    )
+    return cur.rowcount
@@ -1,18 +1,53 @@
-from bot.services.database import get_admin_by_telegram_id, get_agent_by_telegram_id
+from bot.services.database import (
+    get_admin_by_telegram_id,
+    get_agent_by_telegram_id,
+    get_agent_by_id,
+    run_db,
+)
+
+
+async def _session_agent_active(context):
+    """
+    نقش عامل در user_data ذخیره می‌شود و بعد از ری‌استارت هم می‌ماند؛
+    پس فعال بودن عامل با هر درخواست از کش هویت (get_agent_by_id) دوباره بررسی می‌شود
+    عامل غیرفعال یا حذف شده از نشست خارج می‌شود
+    """
+    agent = await run_db(get_agent_by_id, context.user_data.get("agent_id"))
+    if agent and agent["is_active"]:
+        return True
+    context.user_data.pop("role", None)
+    context.user_data.pop("agent_id", None)
+    return False
+
+
+async def _session_admin_active(update, context):
+    """
+    نقش ادمین هم بعد از ری‌استارت می‌ماند؛ پس با هر درخواست از کش هویت بررسی می‌شود
+    که این اکانت تلگرام هنوز به همان ادمین فعال وصل است (جدا یا جابجا نشده)
+    در غیر این صورت نشست ادمین پاک می‌شود
+    """
+    admin = await run_db(get_admin_by_telegram_id, update.effective_user.id)
+    if admin and admin["is_active"] and context.user_data.get("admin_id", admin["id"]) == admin["id"]:
+        context.user_data["admin_id"] = admin["id"]
+        return True
+    for key in ("role", "admin_id", "admin_username", "admin_data"):
+        context.user_data.pop(key, None)
+    return False
 
 
 def require_admin(func):
     async def wrapper(update, context, *args, **kwargs):
         user = update.effective_user
 
-        # 1. اول context رو چک کن
+        # 1. اول context رو چک کن (با بررسی دوباره اتصال تلگرام به همان ادمین)
         if "role" in context.user_data and context.user_data["role"] == "admin":
-            return await func(update, context, *args, **kwargs)
+            if await _session_admin_active(update, context):
+                return await func(update, context, *args, **kwargs)
 
         # 2. اگر context نداشت، دیتابیس رو چک کن
-        admin = get_admin_by_telegram_id(user.id)
+        admin = await run_db(get_admin_by_telegram_id, user.id)
 
-        if not admin:
+        if not admin or not admin["is_active"]:
             # 🔴 **ارسال پیام خطا با روش درست**
             if update.callback_query:
                 await update.callback_query.message.reply_text("⛔ دسترسی ادمین ندارید")
@@ -38,19 +73,26 @@ def require_any_auth(func):
         
         # چک کردن ادمین
         if "role" in context.user_data and context.user_data["role"] == "admin":
-            return await func(update, context, *args, **kwargs)
+            if await _session_admin_active(update, context):
+                return await func(update, context, *args, **kwargs)
             
-        admin = get_admin_by_telegram_id(user.id)
-        if admin:
+        admin = await run_db(get_admin_by_telegram_id, user.id)
+        if admin and admin["is_active"]:
             context.user_data["role"] = "admin"
             context.user_data["admin_id"] = admin["id"]
             return await func(update, context, *args, **kwargs)
             
         # چک کردن عامل
         if "role" in context.user_data and context.user_data["role"] == "agent":
-            return await func(update, context, *args, **kwargs)
+            if await _session_agent_active(context):
+                return await func(update, context, *args, **kwargs)
+            if update.callback_query:
+                await update.callback_query.message.reply_text("⛔ حساب شما مسدود است")
+            elif update.message:
+                await update.message.reply_text("⛔ حساب شما مسدود است")
+            return
             
-        agent = get_agent_by_telegram_id(user.id)
+        agent = await run_db(get_agent_by_telegram_id, user.id)
         if agent:
             if not agent["is_active"]:
                 if update.callback_query:
@@ -84,12 +126,15 @@ def require_agent(func):
             elif update.message:
                 await update.message.reply_text(text)
 
-        # 1. اول context رو چک کن
+        # 1. اول context رو چک کن (با بررسی دوباره فعال بودن عامل)
         if "role" in context.user_data and context.user_data["role"] == "agent":
-            return await func(update, context, *args, **kwargs)
+            if await _session_agent_active(context):
+                return await func(update, context, *args, **kwargs)
+            await send_message("⛔ حساب شما مسدود است")
+            return
 
         # 2. اگر context نداشت، دیتابیس رو چک کن
-        agent = get_agent_by_telegram_id(user.id)
+        agent = await run_db(get_agent_by_telegram_id, user.id)
 
         if not agent:
             await send_message("🔐 ابتدا وارد حساب عامل شوید")
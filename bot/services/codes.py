@@ -0,0 +1,62 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# پیشوند کدها
+HAWALA_PREFIX = "HWL"
+TRANSFER_PREFIX = "TRF"
+
+# حداقل تعداد رقم شماره ترتیبی (بدون رقم کنترل)؛ بعد از ۹۹۹۹۹۹ خودش بلندتر می‌شود
+SEQUENCE_DIGITS = 6
+
+
+def luhn_check_digit(digits):
+    """رقم کنترل Luhn برای یک رشته عددی"""
+    total = 0
+    for i, ch in enumerate(reversed(digits)):
+        d = int(ch)
+        if i % 2 == 0:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return str((10 - total % 10) % 10)
+
+
+def format_code(prefix, value):
+    """ساخت کد از پیشوند و شماره ترتیبی: HWL + شماره + رقم کنترل"""
+    digits = str(value).zfill(SEQUENCE_DIGITS)
+    return f"{prefix}{digits}{luhn_check_digit(digits)}"
+
+
+def next_code(cur, prefix):
+    """
+    کد یکتای بعدی (روی cursor تراکنش جاری)
+    باید داخل همان تراکنش BEGIN IMMEDIATE که حواله را ثبت می‌کند صدا زده شود؛
+    قفل نوشتن تضمین می‌کند هیچ دو تراکنشی یک شماره نگیرند و نیازی به تلاش دوباره نیست
+    """
+    cur.execute(
+        "UPDATE code_sequences SET last_value = last_value + 1 WHERE prefix = ?",
+        (prefix,),
+    )
+    if cur.rowcount == 0:
+        cur.execute(
+            "INSERT INTO code_sequences (prefix, last_value) VALUES (?, 1)",
+            (prefix,),
+        )
+    cur.execute("SELECT last_value FROM code_sequences WHERE prefix = ?", (prefix,))
+    return format_code(prefix, cur.fetchone()[0])
+
+
+def is_valid_code(code):
+    """
+    بررسی رقم کنترل برای کدهای جدید (اشتباه تایپی یا دیکته تلفنی)
+    کدهای قدیمی (HWL + ۶ رقم تصادفی، TRF + تاریخ) همیشه معتبر حساب می‌شوند
+    """
+    code = code.strip().upper()
+    prefix, digits = code[:3], code[3:]
+    if prefix not in (HAWALA_PREFIX, TRANSFER_PREFIX) or not digits.isdigit():
+        return False
+    if len(digits) <= SEQUENCE_DIGITS or (prefix == TRANSFER_PREFIX and len(digits) == 14):
+        return True
+    return luhn_check_digit(digits[:-1]) == digits[-1]
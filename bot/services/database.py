@@ -1,152 +1,403 @@
+import asyncio
+import functools
+import queue
 import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 
+from config import (
+    DB_PATH,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_JOURNAL_MODE,
+    DB_SYNCHRONOUS,
+    DB_MMAP_SIZE,
+    DB_CACHE_SIZE,
+    DB_TEMP_STORE,
+    DB_BUSY_TIMEOUT,
+    REPORT_WORKERS,
+    IDENTITY_CACHE_SIZE,
+    IDENTITY_CACHE_TTL,
+)
+from bot.services.migrations import apply_migrations
+from bot.services.cache import TTLCache, MISSING
 
-def get_db():
-    conn = sqlite3.connect("hawala.db")
-    conn.row_factory = sqlite3.Row  # ⭐⭐⭐ مهم
-    return conn
+logger = logging.getLogger(__name__)
 
 
-def init_db():
-    conn = get_db()
-    cur = conn.cursor()
-
-    # جدول ادمین
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS admins (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE,
-        password_hash TEXT,
-        telegram_id INTEGER UNIQUE,
-        is_active INTEGER DEFAULT 1
-    );
-
-        """
-    )
-
-    # جدول عامل‌ها
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS agents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            province TEXT,
-            phone TEXT UNIQUE,
-            tazkira TEXT UNIQUE,
-            telegram_id INTEGER UNIQUE,
-            password_hash TEXT,
-            is_active INTEGER DEFAULT 1,
-            -- 🔐 امنیت لاگین
-            failed_attempts INTEGER DEFAULT 0,
-            locked_at TEXT
-        )
-        """
-    )
-
-    # جدول بیلانس‌ها
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS balances (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            agent_id INTEGER,
-            currency TEXT,
-            balance REAL DEFAULT 0,
-            FOREIGN KEY(agent_id) REFERENCES agents(id),
-            UNIQUE(agent_id, currency)
-        )
-        """
-    )
-
-    # جدول حواله‌ها
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            transaction_code VARCHAR(10) UNIQUE,
-            agent_id INTEGER,
-            receiver_agent_id INTEGER,
-            sender_name TEXT,
-            receiver_name TEXT,
-            receiver_tazkira TEXT,
-            amount REAL,
-            currency TEXT,
-            commission REAL,
-            status TEXT DEFAULT 'pending',
-            notes TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            completed_at DATETIME,
-            FOREIGN KEY (agent_id) REFERENCES agents(id),
-            FOREIGN KEY (receiver_agent_id) REFERENCES agents(id)
-        )
+_JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+_SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+_TEMP_STORES = {"DEFAULT", "FILE", "MEMORY"}
+
+
+def _choice(value, allowed, name):
+    value = str(value).upper()
+    if value not in allowed:
+        raise ValueError(f"Invalid {name}: {value}")
+    return value
+
+
+def apply_storage_profile(conn):
+    """اعمال تنظیمات کارایی روی یک اتصال (pragmaهای اتصال‌محور)"""
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT)}")
+    conn.execute(f"PRAGMA synchronous = {_choice(DB_SYNCHRONOUS, _SYNCHRONOUS_MODES, 'synchronous')}")
+    conn.execute(f"PRAGMA cache_size = {int(DB_CACHE_SIZE)}")
+    conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+    conn.execute(f"PRAGMA temp_store = {_choice(DB_TEMP_STORE, _TEMP_STORES, 'temp_store')}")
+
+
+def apply_journal_mode(conn):
+    """حالت ژورنال در فایل دیتابیس ذخیره می‌شود، پس یکبار در شروع کافی است"""
+    mode = _choice(DB_JOURNAL_MODE, _JOURNAL_MODES, "journal_mode")
+    actual = conn.execute(f"PRAGMA journal_mode = {mode}").fetchone()[0]
+    if actual.upper() != mode:
+        logger.warning("journal_mode %s requested but database uses %s", mode, actual)
+    return actual
+
+
+class PoolTimeoutError(Exception):
+    """هیچ اتصال آزادی در زمان مقرر پیدا نشد"""
+
+
+class PooledConnection:
     """
-    )
-
-    # جدول درخواست‌های افزایش موجودی (شارژ حساب)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS balance_requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            agent_id INTEGER,
-            amount REAL,
-            currency TEXT,
-            receipt_photo_id TEXT,
-            status TEXT DEFAULT 'pending', -- pending, approved, rejected
-            admin_note TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            processed_at DATETIME,
-            FOREIGN KEY (agent_id) REFERENCES agents(id)
-        )
-        """
-    )
-
-    # پاکسازی ارزهای تکراری (در صورت وجود)
-    cur.execute(
-        """
-        DELETE FROM balances 
-        WHERE id NOT IN (
-            SELECT MIN(id) 
-            FROM balances 
-            GROUP BY agent_id, currency
+    اتصال امانت گرفته شده از استخر
+    close() اتصال را نمی‌بندد، بلکه به استخر برمی‌گرداند
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get("_conn")
+        if conn is None:
+            raise sqlite3.ProgrammingError("Connection already returned to pool")
+        return getattr(conn, name)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+    def __del__(self):
+        # شبکه ایمنی برای هندلرهایی که قبل از close() برمی‌گردند
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    استخر اتصال‌های ماندگار SQLite
+    اتصال‌ها یکبار باز می‌شوند و بین درخواست‌ها دوباره استفاده می‌شوند
+    """
+
+    def __init__(self, path, size=5, timeout=10.0):
+        self.path = path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "max_wait": 0.0,
+            "timeouts": 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            timeout=DB_BUSY_TIMEOUT / 1000,
         )
-        """
-    )
+        conn.row_factory = sqlite3.Row  # ⭐⭐⭐ مهم
+        apply_storage_profile(conn)
+        return conn
+
+    def acquire(self):
+        """امانت گرفتن یک اتصال (در صورت نیاز منتظر آزاد شدن می‌ماند)"""
+        started = time.perf_counter()
+        waited = False
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+
+            if can_create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                waited = True
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        f"No free database connection after {self.timeout}s"
+                    )
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["wait_time"] += elapsed
+                self._stats["max_wait"] = max(self._stats["max_wait"], elapsed)
+
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """برگرداندن اتصال به استخر (تراکنش نیمه‌کاره rollback می‌شود)"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # اتصال خراب است، کنار گذاشته می‌شود
+            logger.warning("Discarding broken database connection")
+            with self._lock:
+                self._created -= 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            return
+
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        pooled = self.acquire()
+        try:
+            yield pooled
+        finally:
+            pooled.close()
+
+    def stats(self):
+        """آمار استفاده از استخر"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = self.size
+            stats["open"] = self._created
+        stats["idle"] = self._idle.qsize()
+        stats["in_use"] = stats["open"] - stats["idle"]
+        stats["avg_wait"] = stats["wait_time"] / stats["waits"] if stats["waits"] else 0.0
+        return stats
+
+    def close_all(self):
+        """بستن همه اتصال‌های آزاد (هنگام خاموش شدن)"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+            conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # هر نخ run_db یک اتصال دارد و هر سازنده گزارش (jobs.py) هم یک اتصال جدا؛
+                # ساخت گزارش هیچ‌وقت اتصال هندلرها را نمی‌گیرد
+                _pool = ConnectionPool(DB_PATH, DB_POOL_SIZE + REPORT_WORKERS, DB_POOL_TIMEOUT)
+    return _pool
+
+
+def get_db():
+    """
+    امانت گرفتن اتصال از استخر
+    بعد از استفاده conn.close() آن را به استخر برمی‌گرداند
+    """
+    return get_pool().acquire()
+
+
+def db_connection():
+    """
+    Context manager برای امانت گرفتن اتصال:
+        with db_connection() as conn:
+            ...
+    """
+    return get_pool().connection()
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+# =========================
+# لایه async (اجرای کوئری‌ها خارج از event loop)
+# =========================
+
+# به اندازه استخر، تا هیچ نخی منتظر اتصال نماند
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+
+async def run_db(fn, *args, **kwargs):
+    """
+    اجرای یک تابع همگام دیتابیس در نخ‌های جدا:
+        agent = await run_db(get_agent_by_id, agent_id)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
 
-    conn.commit()
-    conn.close()
+
+def _fetchone(sql, params):
+    with db_connection() as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def _fetchall(sql, params):
+    with db_connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def _execute(sql, params):
+    with db_connection() as conn:
+        cur = conn.execute(sql, params)
+        conn.commit()
+        return cur.rowcount
+
+
+def _read(fn, args):
+    with db_connection() as conn:
+        return fn(conn.cursor(), *args)
+
+
+def _transaction(fn, args):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            result = fn(cur, *args)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return result
+
+
+async def db_fetchone(sql, params=()):
+    return await run_db(_fetchone, sql, params)
+
+
+async def db_fetchall(sql, params=()):
+    return await run_db(_fetchall, sql, params)
+
+
+async def db_execute(sql, params=()):
+    """اجرای یک دستور نوشتن و commit؛ تعداد ردیف‌های تغییر کرده برمی‌گردد"""
+    return await run_db(_execute, sql, params)
+
+
+async def db_read(fn, *args):
+    """اجرای چند کوئری خواندنی fn(cur, *args) روی یک اتصال"""
+    return await run_db(_read, fn, args)
+
+
+async def db_transaction(fn, *args):
+    """
+    اجرای fn(cur, *args) روی یک اتصال، همه در یک تراکنش
+    در صورت خطا rollback می‌شود
+    """
+    return await run_db(_transaction, fn, args)
+
+
+def shutdown_executor():
+    _executor.shutdown(wait=True)
+
+
+def init_db():
+    """اعمال حالت ژورنال و مایگریشن‌های اجرا نشده"""
+    with db_connection() as conn:
+        apply_journal_mode(conn)
+        apply_migrations(conn)
 
 
 # services/database.py
 def get_admin_by_username(username):
-    conn = get_db()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, password_hash, is_active, telegram_id FROM admins WHERE username = ?",
+            (username,),
+        )
+        return cur.fetchone()
+
+
+# =========================
+# کش هویت (ادمین/عامل)
+# =========================
+# telegram_id -> admin | telegram_id -> agent_id | agent_id -> ردیف عامل
+# هر تغییری روی اتصال تلگرام یا وضعیت عامل باید کش را باطل کند
+
+_admin_by_telegram = TTLCache("admin_by_telegram", IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL)
+_agent_id_by_telegram = TTLCache("agent_id_by_telegram", IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL)
+_agent_by_id = TTLCache("agent_by_id", IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL)
+
 
-    cur.execute(
-        "SELECT id, password_hash, is_active, telegram_id FROM admins WHERE username = ?",
-        (username,),
-    )
-    row = cur.fetchone()
-    conn.close()
+def invalidate_agent(agent_id=None, telegram_id=None):
+    if agent_id is not None:
+        _agent_by_id.invalidate(agent_id)
+    if telegram_id is not None:
+        _agent_id_by_telegram.invalidate(telegram_id)
 
-    return row
+
+def invalidate_admin(telegram_id):
+    _admin_by_telegram.invalidate(telegram_id)
+
+
+def identity_cache_stats():
+    return {
+        cache.name: cache.stats()
+        for cache in (_admin_by_telegram, _agent_id_by_telegram, _agent_by_id)
+    }
 
 
 def get_admin_by_telegram_id(telegram_id):
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        SELECT id, username, is_active
-        FROM admins
-        WHERE telegram_id = ?
-        """,
-        (telegram_id,),
-    )
+    admin = _admin_by_telegram.get(telegram_id)
+    if admin is MISSING:
+        admin = _load_admin_by_telegram_id(telegram_id)
+        _admin_by_telegram.set(telegram_id, admin)
+    # کپی، تا تغییر دیکشنری توسط فراخواننده کش را خراب نکند
+    return dict(admin) if admin else None
 
-    row = cur.fetchone()
-    conn.close()
+
+def _load_admin_by_telegram_id(telegram_id):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, username, is_active
+            FROM admins
+            WHERE telegram_id = ?
+            """,
+            (telegram_id,),
+        )
+        row = cur.fetchone()
 
     if not row:
         return None
@@ -159,179 +410,218 @@ def get_admin_by_telegram_id(telegram_id):
 
 
 def bind_admin_telegram_id(admin_id: int, telegram_id: int):
-    conn = get_db()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
 
-    # برای تست با یک اکانت تکی، آنبایند کردن را غیرفعال می‌کنیم
-    # cur.execute(
-    #     "UPDATE admins SET telegram_id = NULL WHERE telegram_id = ?",
-    #     (telegram_id,),
-    # )
+        # برای تست با یک اکانت تکی، آنبایند کردن را غیرفعال می‌کنیم
+        # cur.execute(
+        #     "UPDATE admins SET telegram_id = NULL WHERE telegram_id = ?",
+        #     (telegram_id,),
+        # )
 
-    # متصل کردن به ادمین جدید
-    cur.execute(
-        "UPDATE admins SET telegram_id = ? WHERE id = ?",
-        (telegram_id, admin_id),
-    )
+        # telegram_id قبلی این ادمین؛ کش آن هم باید پاک شود
+        cur.execute("SELECT telegram_id FROM admins WHERE id = ?", (admin_id,))
+        row = cur.fetchone()
+        old_telegram_id = row[0] if row else None
 
-    conn.commit()
-    conn.close()
+        # متصل کردن به ادمین جدید
+        cur.execute(
+            "UPDATE admins SET telegram_id = ? WHERE id = ?",
+            (telegram_id, admin_id),
+        )
+        conn.commit()
+    if old_telegram_id is not None and old_telegram_id != telegram_id:
+        invalidate_admin(old_telegram_id)
+    invalidate_admin(telegram_id)
 
 
 def get_agent_by_telegram_id(telegram_id):
-    conn = get_db()
-    cur = conn.cursor()
+    agent_id = _agent_id_by_telegram.get(telegram_id)
+    if agent_id is None:
+        return None
+    if agent_id is not MISSING:
+        agent = get_agent_by_id(agent_id)
+        # اگر در این فاصله telegram_id به عامل دیگری وصل شده، از دیتابیس بخوان
+        if agent and agent["telegram_id"] == telegram_id:
+            return agent
 
-    cur.execute("SELECT * FROM agents WHERE telegram_id = ?", (telegram_id,))
-    row = cur.fetchone()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM agents WHERE telegram_id = ?", (telegram_id,))
+        agent = cur.fetchone()
 
-    return row
+    _agent_id_by_telegram.set(telegram_id, agent["id"] if agent else None)
+    if agent:
+        _agent_by_id.set(agent["id"], agent)
+    return agent
 
 
 def get_agent_by_id(agent_id):
-    conn = get_db()
-    cur = conn.cursor()
+    agent = _agent_by_id.get(agent_id)
+    if agent is not MISSING:
+        return agent
 
-    cur.execute("SELECT * FROM agents WHERE id = ?", (agent_id,))
-    row = cur.fetchone()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM agents WHERE id = ?", (agent_id,))
+        agent = cur.fetchone()
 
-    return row
+    _agent_by_id.set(agent_id, agent)
+    return agent
 
 
 def get_agent_by_phone(phone):
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        "SELECT id, password_hash, telegram_id, is_active FROM agents WHERE phone = ?",
-        (phone,),
-    )
-    row = cur.fetchone()
-    conn.close()
-    return row
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, password_hash, telegram_id, is_active FROM agents WHERE phone = ?",
+            (phone,),
+        )
+        return cur.fetchone()
 
 
 def bind_agent_telegram_id(agent_id: int, telegram_id: int):
-    conn = get_db()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
 
-    # برای تست با یک اکانت تکی، آنبایند کردن را غیرفعال می‌کنیم
-    # cur.execute(
-    #     "UPDATE agents SET telegram_id = NULL WHERE telegram_id = ?",
-    #     (telegram_id,),
-    # )
+        # برای تست با یک اکانت تکی، آنبایند کردن را غیرفعال می‌کنیم
+        # cur.execute(
+        #     "UPDATE agents SET telegram_id = NULL WHERE telegram_id = ?",
+        #     (telegram_id,),
+        # )
 
-    # متصل کردن به عامل جدید
-    cur.execute(
-        "UPDATE agents SET telegram_id = ? WHERE id = ?",
-        (telegram_id, agent_id),
-    )
-
-    conn.commit()
-    conn.close()
+        # متصل کردن به عامل جدید
+        cur.execute(
+            "UPDATE agents SET telegram_id = ? WHERE id = ?",
+            (telegram_id, agent_id),
+        )
+        conn.commit()
+    invalidate_agent(agent_id, telegram_id)
 
 
 def increase_failed_attempts(agent_id):
     """
     افزایش شمارنده تلاش ناموفق
     """
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        UPDATE agents
-        SET failed_attempts = failed_attempts + 1
-        WHERE id = ?
-        """,
-        (agent_id,),
-    )
-
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        conn.execute(
+            """
+            UPDATE agents
+            SET failed_attempts = failed_attempts + 1
+            WHERE id = ?
+            """,
+            (agent_id,),
+        )
+        conn.commit()
 
 
 def reset_failed_attempts(agent_id):
     """
     ریست شمارنده بعد از لاگین موفق
     """
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        UPDATE agents
-        SET failed_attempts = 0,
-            locked_at = NULL
-        WHERE id = ?
-        """,
-        (agent_id,),
-    )
-
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        conn.execute(
+            """
+            UPDATE agents
+            SET failed_attempts = 0,
+                locked_at = NULL
+            WHERE id = ?
+            """,
+            (agent_id,),
+        )
+        conn.commit()
+    invalidate_agent(agent_id)
 
 
 def lock_agent(agent_id):
     """
     قفل کامل حساب عامل
     """
-    conn = get_db()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        conn.execute(
+            """
+            UPDATE agents
+            SET is_active = 0,
+                locked_at = ?
+            WHERE id = ?
+            """,
+            (datetime.utcnow().isoformat(), agent_id),
+        )
+        conn.commit()
+    invalidate_agent(agent_id)
 
-    cur.execute(
-        """
-        UPDATE agents
-        SET is_active = 0,
-            locked_at = ?
-        WHERE id = ?
-        """,
-        (datetime.utcnow().isoformat(), agent_id),
-    )
 
-    conn.commit()
-    conn.close()
+def toggle_agent_active(agent_id):
+    """
+    فعال/غیرفعال کردن عامل
+    خروجی: وضعیت جدید، یا None اگر عامل پیدا نشد
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        # تغییر در یک دستور، تا دو ادمین همزمان وضعیت را دوبار برنگردانند
+        cur.execute(
+            """
+            UPDATE agents
+            SET is_active = CASE WHEN is_active = 1 THEN 0 ELSE 1 END
+            WHERE id = ?
+            """,
+            (agent_id,),
+        )
+        if cur.rowcount == 0:
+            return None
+        cur.execute("SELECT is_active FROM agents WHERE id = ?", (agent_id,))
+        new_status = cur.fetchone()[0]
+        conn.commit()
+    invalidate_agent(agent_id)
+    return new_status
+
+
+def _agent_ids_for_telegram(cur, telegram_id):
+    cur.execute("SELECT id FROM agents WHERE telegram_id = ?", (telegram_id,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def _invalidate_unbound_agents(agent_ids, telegram_id):
+    invalidate_agent(telegram_id=telegram_id)
+    for agent_id in agent_ids:
+        invalidate_agent(agent_id)
 
 
 def unbind_telegram_id(telegram_id: int):
     """
     قطع اتصال telegram_id از ادمین یا عامل (برای logout)
     """
-    conn = get_db()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
 
-    # حذف از ادمین
-    cur.execute(
-        "UPDATE admins SET telegram_id = NULL WHERE telegram_id = ?",
-        (telegram_id,),
-    )
-
-    # حذف از عامل
-    cur.execute(
-        "UPDATE agents SET telegram_id = NULL WHERE telegram_id = ?",
-        (telegram_id,),
-    )
+        # حذف از ادمین
+        cur.execute(
+            "UPDATE admins SET telegram_id = NULL WHERE telegram_id = ?",
+            (telegram_id,),
+        )
 
-    conn.commit()
-    conn.close()
+        # حذف از عامل
+        agent_ids = _agent_ids_for_telegram(cur, telegram_id)
+        cur.execute(
+            "UPDATE agents SET telegram_id = NULL WHERE telegram_id = ?",
+            (telegram_id,),
+        )
+        conn.commit()
+    invalidate_admin(telegram_id)
+    _invalidate_unbound_agents(agent_ids, telegram_id)
 
 
 def unbind_admin_telegram_id(telegram_id: int):
     """
     قطع اتصال telegram_id فقط از ادمین
     """
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        "UPDATE admins SET telegram_id = NULL WHERE telegram_id = ?",
-        (telegram_id,),
-    )
-
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        conn.execute(
+            "UPDATE admins SET telegram_id = NULL WHERE telegram_id = ?",
+            (telegram_id,),
+        )
+        conn.commit()
+    invalidate_admin(telegram_id)
     print(f"✅ Admin telegram_id {telegram_id} unbound")  # برای دیباگ
 
 
@@ -339,36 +629,31 @@ def unbind_agent_telegram_id(telegram_id: int):
     """
     قطع اتصال telegram_id فقط از عامل
     """
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        "UPDATE agents SET telegram_id = NULL WHERE telegram_id = ?",
-        (telegram_id,),
-    )
-
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        agent_ids = _agent_ids_for_telegram(conn.cursor(), telegram_id)
+        conn.execute(
+            "UPDATE agents SET telegram_id = NULL WHERE telegram_id = ?",
+            (telegram_id,),
+        )
+        conn.commit()
+    _invalidate_unbound_agents(agent_ids, telegram_id)
     print(f"✅ Agent telegram_id {telegram_id} unbound")  # برای دیباگ
 
 
 # توابع مربوط به transactions
 def get_agent_balance(agent_id, currency="AFN"):
     """دریافت موجودی عامل"""
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        SELECT balance 
-        FROM balances 
-        WHERE agent_id = ? AND currency = ?
-    """,
-        (agent_id, currency),
-    )
-
-    row = cur.fetchone()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT balance 
+            FROM balances 
+            WHERE agent_id = ? AND currency = ?
+        """,
+            (agent_id, currency),
+        )
+        row = cur.fetchone()
 
     return row[0] if row else 0.0
 
@@ -384,40 +669,10 @@ def update_agent_balance(agent_id, amount, currency="AFN"):
     بروزرسانی موجودی عامل
     amount: مقدار مثبت برای افزایش، منفی برای کاهش
     """
-    conn = get_db()
-    cur = conn.cursor()
+    # موجودی‌ها فقط از طریق دفتر کل تغییر می‌کنند (ledger خودش database را import می‌کند)
+    from bot.services import ledger
 
-    # اول مطمئن شو رکورد وجود داره
-    cur.execute(
-        """
-        SELECT id FROM balances 
-        WHERE agent_id = ? AND currency = ?
-    """,
-        (agent_id, currency),
-    )
-
-    if not cur.fetchone():
-        # اگر رکورد وجود نداشت، ایجاد کن
-        cur.execute(
-            """
-            INSERT INTO balances (agent_id, currency, balance)
-            VALUES (?, ?, ?)
-        """,
-            (agent_id, currency, 0.0),
-        )
-
-    # حالا موجودی رو بروز کن
-    cur.execute(
-        """
-        UPDATE balances 
-        SET balance = balance + ?
-        WHERE agent_id = ? AND currency = ?
-    """,
-        (amount, agent_id, currency),
-    )
-
-    conn.commit()
-    conn.close()
+    return ledger.adjust_balance(agent_id, currency, amount)
 
 
 def create_transaction(transaction_data):
@@ -425,122 +680,106 @@ def create_transaction(transaction_data):
     ایجاد حواله جدید
     transaction_data: دیکشنری با کلیدهای مورد نیاز
     """
-    conn = get_db()
-    cur = conn.cursor()
-
-    try:
-        cur.execute(
-            """
-            INSERT INTO transactions 
-            (transaction_code, agent_id, receiver_agent_id, sender_name, 
-             receiver_name, receiver_tazkira, amount, currency, commission, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-            (
-                transaction_data["transaction_code"],
-                transaction_data["agent_id"],
-                transaction_data["receiver_agent_id"],
-                transaction_data.get("sender_name", "مشتری حضوری"),
-                transaction_data["receiver_name"],
-                transaction_data["receiver_tazkira"],
-                transaction_data["amount"],
-                transaction_data["currency"],
-                transaction_data["commission"],
-                transaction_data.get("status", "pending"),
-            ),
-        )
-
-        transaction_id = cur.lastrowid
-        conn.commit()
-
-        return transaction_id
-
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            cur.execute(
+                """
+                INSERT INTO transactions 
+                (transaction_code, agent_id, receiver_agent_id, sender_name, 
+                 receiver_name, receiver_tazkira, amount, currency, commission, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+                (
+                    transaction_data["transaction_code"],
+                    transaction_data["agent_id"],
+                    transaction_data["receiver_agent_id"],
+                    transaction_data.get("sender_name", "مشتری حضوری"),
+                    transaction_data["receiver_name"],
+                    transaction_data["receiver_tazkira"],
+                    transaction_data["amount"],
+                    transaction_data["currency"],
+                    transaction_data["commission"],
+                    transaction_data.get("status", "pending"),
+                ),
+            )
+
+            transaction_id = cur.lastrowid
+            conn.commit()
+
+            return transaction_id
+
+        except Exception as e:
+            conn.rollback()
+            raise e
 
 
 def get_agent_transactions(agent_id, limit=20):
     """
     دریافت حواله‌های یک عامل
     """
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        SELECT 
-            t.id,
-            t.transaction_code,
-            t.receiver_name,
-            t.amount,
-            t.currency,
-            t.commission,
-            t.status,
-            t.created_at,
-            a.name as receiver_agent_name,
-            a.province as receiver_province
-        FROM transactions t
-        LEFT JOIN agents a ON t.receiver_agent_id = a.id
-        WHERE t.agent_id = ?
-        ORDER BY t.created_at DESC
-        LIMIT ?
-    """,
-        (agent_id, limit),
-    )
-
-    rows = cur.fetchall()
-    conn.close()
-
-    return rows
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT 
+                t.id,
+                t.transaction_code,
+                t.receiver_name,
+                t.amount,
+                t.currency,
+                t.commission,
+                t.status,
+                t.created_at,
+                a.name as receiver_agent_name,
+                a.province as receiver_province
+            FROM transactions t
+            LEFT JOIN agents a ON t.receiver_agent_id = a.id
+            WHERE t.agent_id = ?
+            ORDER BY t.created_at DESC
+            LIMIT ?
+        """,
+            (agent_id, limit),
+        )
+        return cur.fetchall()
 
 
 def get_transaction_by_code(transaction_code):
     """
     دریافت حواله با کد
     """
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        SELECT 
-            t.*,
-            a1.name as sender_agent_name,
-            a2.name as receiver_agent_name,
-            a2.province as receiver_province
-        FROM transactions t
-        LEFT JOIN agents a1 ON t.agent_id = a1.id
-        LEFT JOIN agents a2 ON t.receiver_agent_id = a2.id
-        WHERE t.transaction_code = ?
-    """,
-        (transaction_code,),
-    )
-
-    row = cur.fetchone()
-    conn.close()
-
-    return row
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT 
+                t.*,
+                a1.name as sender_agent_name,
+                a2.name as receiver_agent_name,
+                a2.province as receiver_province
+            FROM transactions t
+            LEFT JOIN agents a1 ON t.agent_id = a1.id
+            LEFT JOIN agents a2 ON t.receiver_agent_id = a2.id
+            WHERE t.transaction_code = ?
+        """,
+            (transaction_code,),
+        )
+        return cur.fetchone()
 
 
 def update_transaction_status(transaction_id, status):
     """
     بروزرسانی وضعیت حواله
     """
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        UPDATE transactions 
-        SET status = ?, 
-            completed_at = CASE WHEN ? = 'completed' THEN CURRENT_TIMESTAMP ELSE NULL END
-        WHERE id = ?
-    """,
-        (status, status, transaction_id),
-    )
-
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        conn.execute(
+            """
+            UPDATE transactions 
+            SET status = ?, 
+                completed_at = CASE WHEN ? = 'completed' THEN CURRENT_TIMESTAMP ELSE NULL END
+            WHERE id = ?
+        """,
+            (status, status, transaction_id),
+        )
+        conn.commit()
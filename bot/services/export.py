@@ -0,0 +1,374 @@
+import csv
+import gzip
+import importlib.util
+import io
+import logging
+import tempfile
+from datetime import datetime as dt
+from functools import lru_cache
+
+from bot.services.database import db_connection
+from config import EXPORT_CHUNK_SIZE, EXPORT_MAX_FILE_BYTES
+
+# openpyxl و pyarrow سنگین هستند؛ فقط هنگام ساخت فایل (در کارگرهای گزارش) import می‌شوند
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# خروجی اکسل جریانی
+# =========================
+# openpyxl در حالت write_only هر ردیف را مستقیم در فایل موقت شیت می‌نویسد؛
+# ردیف‌ها هم با fetchmany از cursor خوانده می‌شوند، پس حافظه به تعداد حواله‌ها بستگی ندارد
+# شیت‌ها مستقل از هم نوشته می‌شوند: شیت خلاصه اول ساخته و در پایان پر می‌شود
+
+
+def _new_workbook():
+    from openpyxl import Workbook
+
+    return Workbook(write_only=True)
+
+
+def _sheet(workbook, title, header):
+    sheet = workbook.create_sheet(title)
+    sheet.append(header)
+    return sheet
+
+
+def _stream_rows(cur, workbook, title, header, on_row=None, chunk_size=None, skip_empty=False):
+    """
+    نوشتن نتیجه cursor در یک شیت، chunk_size ردیف در هر بار
+    on_row(row) می‌تواند ردیف را تغییر دهد یا آمار جمع کند
+    skip_empty: اگر نتیجه خالی باشد شیت ساخته نمی‌شود
+    """
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    sheet = None if skip_empty else _sheet(workbook, title, header)
+    count = 0
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        if sheet is None:
+            sheet = _sheet(workbook, title, header)
+        for row in rows:
+            row = tuple(row)
+            sheet.append(on_row(row) if on_row else row)
+        count += len(rows)
+    return count
+
+
+def _save(workbook):
+    output = tempfile.TemporaryFile()
+    try:
+        workbook.save(output)
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) else 0
+
+
+# =========================
+# گزارش عامل
+# =========================
+
+
+AGENT_TRANSACTION_COLUMNS = [
+    'کد حواله', 'نام فرستنده', 'نام گیرنده', 'تذکره گیرنده',
+    'مبلغ', 'ارز', 'کارمزد', 'وضعیت', 'تاریخ ثبت', 'تاریخ تکمیل',
+    'عامل مقصد', 'ولایت مقصد'
+]
+
+
+def build_agent_report(agent_id, chunk_size=None):
+    """
+    گزارش اکسل عامل (اطلاعات، حواله‌ها، موجودی‌ها، خلاصه) در یک فایل موقت
+    خروجی: (فایل، نام عامل، ولایت، تعداد حواله‌ها)
+    """
+    workbook = _new_workbook()
+    stats = {"count": 0, "pending": 0, "completed": 0, "cancelled": 0, "amount": 0, "commission": 0}
+
+    def _collect(row):
+        stats[row[7]] = stats.get(row[7], 0) + 1
+        stats["amount"] += _number(row[4])
+        stats["commission"] += _number(row[6])
+        return row
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT name, province FROM agents WHERE id = ?", (agent_id,))
+        agent_info = cur.fetchone()
+        agent_name, agent_province = tuple(agent_info) if agent_info else ("نامشخص", "نامشخص")
+
+        info_sheet = _sheet(workbook, 'اطلاعات عامل', ['نام عامل', 'ولایت', 'تاریخ گزارش', 'تعداد کل حواله‌ها'])
+
+        cur.execute(
+            """
+            SELECT
+                t.transaction_code,
+                t.sender_name,
+                t.receiver_name,
+                t.receiver_tazkira,
+                t.amount,
+                t.currency,
+                t.commission,
+                t.status,
+                t.created_at,
+                t.completed_at,
+                a.name as receiver_agent_name,
+                a.province as receiver_province
+            FROM transactions t
+            LEFT JOIN agents a ON t.receiver_agent_id = a.id
+            WHERE t.agent_id = ?
+            ORDER BY t.created_at DESC
+            """,
+            (agent_id,),
+        )
+        stats["count"] = _stream_rows(
+            cur, workbook, 'حواله‌ها', AGENT_TRANSACTION_COLUMNS,
+            on_row=_collect, chunk_size=chunk_size, skip_empty=True,
+        )
+
+        cur.execute(
+            "SELECT currency, SUM(balance) FROM balances WHERE agent_id = ? GROUP BY currency ORDER BY currency",
+            (agent_id,),
+        )
+        _stream_rows(cur, workbook, 'موجودی‌ها', ['ارز', 'موجودی'], chunk_size=chunk_size, skip_empty=True)
+
+    info_sheet.append([agent_name, agent_province, dt.now().strftime('%Y-%m-%d %H:%M:%S'), stats["count"]])
+
+    if stats["count"]:
+        summary = _sheet(workbook, 'خلاصه آمار', ['نوع آمار', 'مقدار'])
+        summary.append(['تعداد کل حواله‌ها', stats["count"]])
+        summary.append(['حواله‌های در انتظار', stats["pending"]])
+        summary.append(['حواله‌های تکمیل شده', stats["completed"]])
+        summary.append(['حواله‌های لغو شده', stats["cancelled"]])
+        summary.append(['مجموع مبلغ حواله‌ها', f"{stats['amount']:,.0f}"])
+        summary.append(['مجموع کارمزد دریافتی', f"{stats['commission']:,.0f}"])
+
+    return _save(workbook), agent_name, agent_province, stats["count"]
+
+
+# =========================
+# گزارش ادمین
+# =========================
+
+
+def build_admin_report(chunk_size=None):
+    """گزارش اکسل کامل ادمین (خلاصه، عامل‌ها، آمار روزانه، ولایت‌ها) در یک فایل موقت"""
+    workbook = _new_workbook()
+    totals = {"rows": 0, "active": 0, "transactions": 0, "amount": 0, "commission": 0}
+
+    def _agent_row(row):
+        totals["active"] += 1 if row[4] == 1 else 0
+        totals["transactions"] += _number(row[7])
+        totals["amount"] += _number(row[8])
+        totals["commission"] += _number(row[9])
+        return row[:4] + ('فعال' if row[4] == 1 else 'غیرفعال',) + row[5:]
+
+    summary = _sheet(workbook, 'خلاصه سیستم', ['بخش', 'مقدار'])
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT a.id, a.name, a.province, a.phone, a.is_active,
+                   b.balance, b.currency,
+                   COUNT(t.id) as transaction_count,
+                   SUM(t.amount) as total_amount,
+                   SUM(t.commission) as total_commission
+            FROM agents a
+            LEFT JOIN balances b ON a.id = b.agent_id
+            LEFT JOIN transactions t ON a.id = t.agent_id AND t.status != 'cancelled'
+            GROUP BY a.id, b.currency
+            ORDER BY a.id
+        """)
+        totals["rows"] = _stream_rows(
+            cur, workbook, 'عامل‌ها',
+            ['کد عامل', 'نام', 'ولایت', 'تلفن', 'وضعیت', 'موجودی', 'ارز',
+             'تعداد حواله', 'مجموع مبلغ', 'مجموع کارمزد'],
+            on_row=_agent_row, chunk_size=chunk_size,
+        )
+
+        cur.execute("""
+            SELECT DATE(created_at) as date, COUNT(*) as count,
+                   SUM(amount) as total_amount, SUM(commission) as total_commission
+            FROM transactions
+            WHERE status != 'cancelled'
+            GROUP BY DATE(created_at)
+            ORDER BY date DESC
+            LIMIT 30
+        """)
+        _stream_rows(cur, workbook, 'آمار روزانه', ['تاریخ', 'تعداد حواله', 'مبلغ کل', 'کارمزد کل'], chunk_size=chunk_size)
+
+        cur.execute("""
+            SELECT a.province, COUNT(t.id) as transaction_count,
+                   SUM(t.amount) as total_amount, SUM(t.commission) as total_commission
+            FROM agents a
+            LEFT JOIN transactions t ON a.id = t.agent_id AND t.status != 'cancelled'
+            WHERE a.is_active = 1
+            GROUP BY a.province
+            ORDER BY total_amount DESC
+        """)
+        _stream_rows(cur, workbook, 'آمار ولایت‌ها', ['ولایت', 'تعداد حواله', 'مبلغ کل', 'کارمزد کل'], chunk_size=chunk_size)
+
+    summary.append(['کل عامل‌ها', totals["rows"]])
+    summary.append(['عامل‌های فعال', totals["active"]])
+    summary.append(['کل حواله‌ها', totals["transactions"]])
+    summary.append(['مجموع مبلغ', f"{totals['amount']:,.0f} افغانی"])
+    summary.append(['مجموع کارمزد', f"{totals['commission']:,.0f} افغانی"])
+
+    return _save(workbook)
+
+
+# =========================
+# خروجی CSV فشرده و Parquet برای لیست حواله‌ها
+# =========================
+# برای گزارش‌های خیلی بزرگ (مثلاً حواله‌های یک سال کل سیستم) که XLSX کند و بزرگ است
+# خروجی بیشتر از EXPORT_MAX_FILE_BYTES به چند فایل تقسیم می‌شود (سقف آپلود تلگرام)
+
+EXPORT_FORMATS = ("xlsx", "csv", "parquet")
+
+EXPORT_EXTENSIONS = {"xlsx": "xlsx", "csv": "csv.gz", "parquet": "parquet"}
+
+TRANSACTION_EXPORT_COLUMNS = ['عامل مبدأ', 'ولایت مبدأ'] + AGENT_TRANSACTION_COLUMNS
+
+
+@lru_cache(maxsize=1)
+def parquet_available():
+    # Parquet اختیاری است؛ وجود pyarrow بدون import کردن آن بررسی می‌شود
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def file_size(output):
+    position = output.tell()
+    output.seek(0, io.SEEK_END)
+    size = output.tell()
+    output.seek(position)
+    return size
+
+
+def _execute_transactions(cur, agent_id=None):
+    """همه حواله‌ها (ادمین) یا حواله‌های ارسالی یک عامل"""
+    sql = """
+        SELECT
+            s.name, s.province,
+            t.transaction_code, t.sender_name, t.receiver_name, t.receiver_tazkira,
+            t.amount, t.currency, t.commission, t.status, t.created_at, t.completed_at,
+            r.name, r.province
+        FROM transactions t
+        LEFT JOIN agents s ON t.agent_id = s.id
+        LEFT JOIN agents r ON t.receiver_agent_id = r.id
+    """
+    params = ()
+    if agent_id is not None:
+        sql += " WHERE t.agent_id = ?"
+        params = (agent_id,)
+    cur.execute(sql + " ORDER BY t.created_at DESC", params)
+    return cur
+
+
+class _CsvPart:
+    """یک فایل csv.gz موقت؛ BOM برای باز شدن درست متن فارسی در اکسل"""
+
+    def __init__(self):
+        self.output = tempfile.TemporaryFile()
+        self._text = io.TextIOWrapper(
+            gzip.GzipFile(fileobj=self.output, mode="wb"), encoding="utf-8-sig", newline=""
+        )
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(TRANSACTION_EXPORT_COLUMNS)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def size(self):
+        # حجم فشرده نوشته شده تا اینجا (چند کیلوبایت بافر gzip هنوز نوشته نشده)
+        return self.output.tell()
+
+    def close(self):
+        self._text.close()
+        return self.output
+
+
+class _ParquetPart:
+    """یک فایل Parquet موقت؛ هر chunk یک row group"""
+
+    def __init__(self):
+        import pyarrow
+        import pyarrow.parquet
+
+        self._pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [(name, pyarrow.float64() if name in ('مبلغ', 'کارمزد') else pyarrow.string())
+             for name in TRANSACTION_EXPORT_COLUMNS]
+        )
+        self.output = tempfile.TemporaryFile()
+        self._writer = pyarrow.parquet.ParquetWriter(self.output, self.schema, compression="zstd")
+
+    def write(self, rows):
+        pyarrow = self._pyarrow
+        columns = [
+            pyarrow.array([row[index] for row in rows], type=field.type)
+            for index, field in enumerate(self.schema)
+        ]
+        self._writer.write_table(pyarrow.Table.from_arrays(columns, schema=self.schema))
+
+    def size(self):
+        return self.output.tell()
+
+    def close(self):
+        self._writer.close()
+        return self.output
+
+
+def export_transactions(fmt, agent_id=None, max_bytes=None, chunk_size=None):
+    """
+    خروجی لیست حواله‌ها به صورت csv (gzip) یا parquet، مستقیم از cursor
+    خروجی: لیست فایل‌های موقت (اگر حجم از max_bytes بیشتر شود چند فایل)
+    """
+    if fmt == "csv":
+        part_class = _CsvPart
+    elif fmt == "parquet":
+        if not parquet_available():
+            raise RuntimeError("Parquet export needs pyarrow")
+        part_class = _ParquetPart
+    else:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    max_bytes = max_bytes or EXPORT_MAX_FILE_BYTES
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    parts = []
+    part = None
+    try:
+        with db_connection() as conn:
+            cur = _execute_transactions(conn.cursor(), agent_id)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                if part is None:
+                    part = part_class()
+                part.write([tuple(row) for row in rows])
+                if part.size() >= max_bytes:
+                    parts.append(part.close())
+                    part = None
+
+        if part is None and not parts:
+            # بدون حواله: یک فایل فقط با سرستون‌ها
+            part = part_class()
+        if part is not None:
+            parts.append(part.close())
+    except BaseException:
+        if part is not None:
+            part.output.close()
+        for output in parts:
+            output.close()
+        raise
+
+    for output in parts:
+        output.seek(0)
+    logger.info("Exported transactions as %s in %d part(s)", fmt, len(parts))
+    return parts
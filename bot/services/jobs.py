@@ -0,0 +1,266 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from bot.services.database import db_connection, run_db
+from bot.services.ledger import run_in_unit_of_work
+from config import REPORT_WORKERS, REPORT_JOB_RETENTION_DAYS
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# صف گزارش‌های سنگین
+# =========================
+# هندلر فقط کار را در جدول report_jobs ثبت می‌کند و فوراً جواب می‌دهد؛
+# REPORT_WORKERS کارگر فایل را می‌سازند و برای همه گیرندگان کار می‌فرستند
+# درخواست یکسان (همان نوع و پارامترها) تا وقتی کار قبلی در صف یا در حال ساخت است،
+# کار جدید نمی‌سازد و فقط گیرنده اضافه می‌کند
+
+# نوع کار -> تابع همگام builder(**params) که لیست (فایل، نام فایل، توضیح) برمی‌گرداند
+REPORT_BUILDERS = {}
+
+# کارهایی که درخواست تکراری به آن‌ها اضافه می‌شود
+_JOINABLE = ("pending", "running")
+
+
+class ReportFailed(Exception):
+    """خطایی که متن آن مستقیم به کاربر نشان داده می‌شود (مثلاً فایل بیش از حد بزرگ)"""
+
+
+def report_job(kind):
+    """ثبت سازنده یک نوع گزارش؛ باید قبل از شروع صف import شده باشد"""
+
+    def decorator(fn):
+        if kind in REPORT_BUILDERS:
+            raise ValueError(f"Report job {kind} registered twice")
+        REPORT_BUILDERS[kind] = fn
+        return fn
+
+    return decorator
+
+
+def _dedup_key(kind, params):
+    return f"{kind}:{params}"
+
+
+# =========================
+# دسترسی به جدول‌ها
+# =========================
+
+
+def _submit(cur, kind, params, chat_id):
+    """خروجی: (شناسه کار، آیا کار جدید ساخته شد)"""
+    dedup_key = _dedup_key(kind, params)
+    placeholders = ", ".join("?" for _ in _JOINABLE)
+    cur.execute(
+        f"""
+        SELECT id FROM report_jobs
+        WHERE dedup_key = ? AND status IN ({placeholders})
+        ORDER BY id LIMIT 1
+        """,
+        (dedup_key, *_JOINABLE),
+    )
+    row = cur.fetchone()
+    created = row is None
+    if created:
+        cur.execute(
+            "INSERT INTO report_jobs (kind, params, dedup_key) VALUES (?, ?, ?)",
+            (kind, params, dedup_key),
+        )
+        job_id = cur.lastrowid
+    else:
+        job_id = row[0]
+    cur.execute(
+        "INSERT OR IGNORE INTO report_job_recipients (job_id, chat_id) VALUES (?, ?)",
+        (job_id, chat_id),
+    )
+    return job_id, created
+
+
+def _claim(cur, job_id):
+    """شروع ساخت؛ None یعنی کار قبلاً توسط کارگر دیگری برداشته شده"""
+    cur.execute(
+        """
+        UPDATE report_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'pending'
+        """,
+        (job_id,),
+    )
+    if cur.rowcount == 0:
+        return None
+    cur.execute("SELECT kind, params FROM report_jobs WHERE id = ?", (job_id,))
+    return cur.fetchone()
+
+
+def _close_recipients(cur, job_id):
+    """
+    پایان ساخت و برداشتن گیرندگان در یک تراکنش؛
+    بعد از این درخواست یکسان کار تازه می‌سازد و گیرنده‌ای جا نمی‌ماند
+    """
+    cur.execute("UPDATE report_jobs SET status = 'sending' WHERE id = ?", (job_id,))
+    cur.execute("SELECT chat_id FROM report_job_recipients WHERE job_id = ?", (job_id,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def _finish(job_id, status, error=None):
+    with db_connection() as conn:
+        conn.execute(
+            """
+            UPDATE report_jobs SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            (status, error, job_id),
+        )
+        conn.commit()
+
+
+def _recover():
+    """
+    کارهای نیمه‌تمام قبل از ری‌استارت دوباره در صف قرار می‌گیرند
+    (ممکن است گیرنده‌ای که قبلاً فایل را گرفته، دوباره آن را بگیرد)
+    و کارهای تمام شده قدیمی پاک می‌شوند
+    """
+    with db_connection() as conn:
+        conn.execute(
+            "UPDATE report_jobs SET status = 'pending' WHERE status IN ('running', 'sending')"
+        )
+        old = "status IN ('done', 'failed') AND finished_at < datetime('now', ?)"
+        window = f"-{REPORT_JOB_RETENTION_DAYS} days"
+        conn.execute(
+            f"DELETE FROM report_job_recipients WHERE job_id IN (SELECT id FROM report_jobs WHERE {old})",
+            (window,),
+        )
+        conn.execute(f"DELETE FROM report_jobs WHERE {old}", (window,))
+        conn.commit()
+        rows = conn.execute("SELECT id FROM report_jobs WHERE status = 'pending' ORDER BY id").fetchall()
+    return [row[0] for row in rows]
+
+
+# =========================
+# اجرای کارها
+# =========================
+
+
+class ReportJobQueue:
+    def __init__(self, workers=REPORT_WORKERS):
+        # هر سازنده در حین ساخت یک اتصال از استخر دیتابیس نگه می‌دارد؛
+        # استخر برای این سازنده‌ها جدا از نخ‌های run_db جا دارد (database.get_pool)
+        self.workers = max(1, workers)
+        self._bot = None
+        self._queue = None
+        self._tasks = []
+        self._executor = None
+
+    async def start(self, application):
+        """post_init: بازیابی کارهای ناتمام و شروع کارگرها"""
+        self._bot = application.bot
+        self._queue = asyncio.Queue()
+        # سازنده‌ها نخ‌های خودشان را دارند تا گزارش طولانی نخ‌های مشترک run_db را اشغال نکند
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="report")
+        pending = await run_db(_recover)
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        if pending:
+            logger.info("Resuming %d report job(s)", len(pending))
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, application=None):
+        """post_shutdown: کارهای در حال اجرا بعد از ری‌استارت از نو ساخته می‌شوند"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            # منتظر گزارش در حال ساخت نمی‌مانیم؛ بعد از ری‌استارت از نو ساخته می‌شود
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def submit(self, kind, params, chat_id):
+        """ثبت گزارش برای ارسال به chat_id؛ خروجی True اگر کار جدید ساخته شد"""
+        if kind not in REPORT_BUILDERS:
+            raise ValueError(f"Unknown report job: {kind}")
+        params = json.dumps(params, sort_keys=True)
+        job_id, created = await run_db(run_in_unit_of_work, _submit, kind, params, chat_id)
+        if created:
+            self._queue.put_nowait(job_id)
+        return created
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                logger.exception("Report job %s crashed", job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id):
+        job = await run_db(run_in_unit_of_work, _claim, job_id)
+        if job is None:
+            return
+        kind, params = job
+
+        loop = asyncio.get_running_loop()
+        builder = REPORT_BUILDERS[kind]
+        try:
+            parts = await loop.run_in_executor(self._executor, lambda: builder(**json.loads(params)))
+        except ReportFailed as e:
+            await self._fail(job_id, str(e), str(e))
+            return
+        except Exception as e:
+            logger.exception("Report job %s (%s) failed", job_id, kind)
+            await self._fail(job_id, repr(e), "❌ خطا در ایجاد گزارش، لطفاً دوباره تلاش کنید.")
+            return
+
+        try:
+            chat_ids = await run_db(run_in_unit_of_work, _close_recipients, job_id)
+            await self._deliver(chat_ids, parts)
+            await run_db(_finish, job_id, "done")
+        except Exception as e:
+            # کار در وضعیت 'sending' نمی‌ماند
+            logger.exception("Report job %s (%s) could not be delivered", job_id, kind)
+            await run_db(_finish, job_id, "failed", repr(e))
+            return
+        finally:
+            for output, _, _ in parts:
+                output.close()
+        logger.info("Report job %s (%s) delivered to %d chat(s)", job_id, kind, len(chat_ids))
+
+    async def _deliver(self, chat_ids, parts):
+        for output, filename, caption in parts:
+            # اولین ارسال آپلود می‌کند؛ بقیه گیرندگان همان file_id را می‌گیرند
+            document = output
+            for chat_id in chat_ids:
+                if document is output:
+                    output.seek(0)
+                try:
+                    message = await self._bot.send_document(
+                        chat_id=chat_id,
+                        document=document,
+                        filename=filename,
+                        caption=caption,
+                        parse_mode="Markdown",
+                    )
+                except Exception:
+                    logger.exception("Could not deliver report %s to %s", filename, chat_id)
+                    continue
+                if message.document:
+                    document = message.document.file_id
+
+    async def _fail(self, job_id, error, user_message):
+        try:
+            chat_ids = await run_db(run_in_unit_of_work, _close_recipients, job_id)
+            for chat_id in chat_ids:
+                try:
+                    await self._bot.send_message(chat_id=chat_id, text=user_message)
+                except Exception:
+                    logger.exception("Could not notify %s about failed report", chat_id)
+        except Exception:
+            # کار در وضعیت 'running' نمی‌ماند؛ وگرنه درخواست‌های یکسان بعدی به آن اضافه می‌شوند
+            logger.exception("Could not notify recipients of failed report job %s", job_id)
+        await run_db(_finish, job_id, "failed", error)
+
+
+report_jobs = ReportJobQueue()
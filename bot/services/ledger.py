@@ -0,0 +1,542 @@
+import sqlite3
+import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+from bot.services.database import db_connection
+from bot.services.codes import next_code, HAWALA_PREFIX, TRANSFER_PREFIX
+from config import LEDGER_MAX_RETRIES, LEDGER_RETRY_DELAY
+
+logger = logging.getLogger(__name__)
+
+
+# =========================
+# خطاهای دفتر کل
+# =========================
+
+
+class LedgerError(Exception):
+    """خطای عملیات مالی (تراکنش rollback شده است)"""
+
+
+class InsufficientBalance(LedgerError):
+    def __init__(self, agent_id, currency, balance, amount):
+        super().__init__(f"Agent {agent_id} has {balance} {currency}, needs {amount}")
+        self.agent_id = agent_id
+        self.currency = currency
+        self.balance = balance
+        self.amount = amount
+
+
+class TransactionNotFound(LedgerError):
+    """حواله/درخواست پیدا نشد یا دیگر در وضعیت pending نیست"""
+
+    def __init__(self, key, status=None):
+        super().__init__(f"{key} not found or not pending (status={status})")
+        self.key = key
+        self.status = status
+
+
+# =========================
+# واحد کار (Unit of Work)
+# =========================
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+@contextmanager
+def unit_of_work():
+    """
+    یک تراکنش نوشتنی با BEGIN IMMEDIATE
+    قفل نوشتن از اول گرفته می‌شود، پس بین خواندن و نوشتن کسی موجودی را تغییر نمی‌دهد
+    """
+    with db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn.cursor()
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def run_in_unit_of_work(fn, *args, **kwargs):
+    """اجرای fn(cur, ...) در یک واحد کار؛ در صورت قفل بودن دیتابیس دوباره تلاش می‌کند"""
+    attempt = 0
+    while True:
+        try:
+            with unit_of_work() as cur:
+                return fn(cur, *args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e) or attempt >= LEDGER_MAX_RETRIES:
+                raise
+            attempt += 1
+            logger.warning("Database busy, retrying ledger operation (%d/%d)", attempt, LEDGER_MAX_RETRIES)
+            time.sleep(LEDGER_RETRY_DELAY * attempt)
+
+
+def ledger_operation(fn):
+    """تبدیل تابع fn(cur, ...) به عملیاتی که خودش واحد کار را باز می‌کند"""
+
+    def wrapper(*args, **kwargs):
+        return run_in_unit_of_work(fn, *args, **kwargs)
+
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+# =========================
+# دفتر روزنامه و موجودی‌ها
+# =========================
+# ledger_entries منبع اصلی است و balances فقط نمای محاسبه‌شده آن است؛
+# هر دو در همان تراکنش تغییر می‌کنند.
+
+CASH_ACCOUNT = None  # agent_id خالی = صندوق بیرونی (مشتری‌ها و مدیریت مرکزی)
+EPSILON = 1e-6
+
+
+def _balance(cur, agent_id, currency):
+    cur.execute(
+        "SELECT balance FROM balances WHERE agent_id = ? AND currency = ?",
+        (agent_id, currency),
+    )
+    row = cur.fetchone()
+    return row[0] if row else 0.0
+
+
+def _credit(cur, agent_id, currency, amount):
+    """افزایش موجودی (رکورد موجودی در صورت نبود ساخته می‌شود)"""
+    # بدون ON CONFLICT؛ دیتابیس‌های قدیمی روی balances قید UNIQUE ندارند
+    cur.execute(
+        """
+        UPDATE balances
+        SET balance = balance + ?
+        WHERE agent_id = ? AND currency = ?
+        """,
+        (amount, agent_id, currency),
+    )
+    if cur.rowcount == 0:
+        cur.execute(
+            "INSERT INTO balances (agent_id, currency, balance) VALUES (?, ?, ?)",
+            (agent_id, currency, amount),
+        )
+    return _balance(cur, agent_id, currency)
+
+
+def _debit(cur, agent_id, currency, amount):
+    """کاهش موجودی فقط وقتی موجودی کافی است (UPDATE شرطی)"""
+    cur.execute(
+        """
+        UPDATE balances
+        SET balance = balance - ?
+        WHERE agent_id = ? AND currency = ? AND balance >= ?
+        """,
+        (amount, agent_id, currency, amount),
+    )
+    if cur.rowcount == 0:
+        raise InsufficientBalance(agent_id, currency, _balance(cur, agent_id, currency), amount)
+    return _balance(cur, agent_id, currency)
+
+
+def _post(cur, entry_type, legs, transaction_code=None, balance_request_id=None):
+    """
+    ثبت یک سند دوطرفه در ledger_entries
+    legs: لیست (agent_id, currency, amount)؛ مثبت = بستانکار، منفی = بدهکار
+    باقیمانده هر ارز به حساب صندوق بیرونی زده می‌شود تا جمع سند صفر شود
+    """
+    totals = {}
+    for _, currency, amount in legs:
+        totals[currency] = totals.get(currency, 0) + amount
+    legs = list(legs) + [
+        (CASH_ACCOUNT, currency, -total)
+        for currency, total in totals.items()
+        if abs(total) > EPSILON
+    ]
+
+    cur.executemany(
+        """
+        INSERT INTO ledger_entries
+        (agent_id, currency, debit, credit, entry_type, transaction_code, balance_request_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                agent_id,
+                currency,
+                -amount if amount < 0 else 0,
+                amount if amount > 0 else 0,
+                entry_type,
+                transaction_code,
+                balance_request_id,
+            )
+            for agent_id, currency, amount in legs
+            if abs(amount) > EPSILON
+        ],
+    )
+
+
+def open_balance(cur, agent_id, currency, amount=0):
+    """
+    ساخت حساب ارزی عامل با موجودی اولیه (روی cursor تراکنش جاری)
+    موجودی اولیه به عنوان سند افتتاحیه ثبت می‌شود
+    """
+    cur.execute(
+        "INSERT INTO balances (agent_id, currency, balance) VALUES (?, ?, ?)",
+        (agent_id, currency, amount),
+    )
+    _post(cur, "opening", [(agent_id, currency, amount)])
+
+
+# =========================
+# عملیات حواله
+# =========================
+
+
+@ledger_operation
+def create_hawala(
+    cur,
+    agent_id,
+    receiver_agent_id,
+    sender_name,
+    receiver_name,
+    receiver_tazkira,
+    amount,
+    currency,
+    commission,
+):
+    """
+    ثبت حواله و افزایش موجودی عامل مبدأ (پول نقد گرفته)
+    خروجی: (transaction_code, new_balance)
+    """
+    transaction_code = next_code(cur, HAWALA_PREFIX)
+    cur.execute(
+        """
+        INSERT INTO transactions
+        (transaction_code, agent_id, receiver_agent_id, sender_name,
+         receiver_name, receiver_tazkira, amount, currency, commission, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending')
+        """,
+        (
+            transaction_code,
+            agent_id,
+            receiver_agent_id,
+            sender_name,
+            receiver_name,
+            receiver_tazkira,
+            amount,
+            currency,
+            commission,
+        ),
+    )
+    _post(cur, "hawala_created", [(agent_id, currency, amount)], transaction_code)
+    return transaction_code, _credit(cur, agent_id, currency, amount)
+
+
+@ledger_operation
+def pay_hawala(cur, transaction_code, receiver_agent_id):
+    """
+    پرداخت حواله توسط عامل مقصد
+    خروجی: (amount, currency, new_balance)
+    """
+    cur.execute(
+        """
+        SELECT amount, currency
+        FROM transactions
+        WHERE transaction_code = ? AND receiver_agent_id = ? AND status = 'pending'
+        """,
+        (transaction_code, receiver_agent_id),
+    )
+    row = cur.fetchone()
+    if not row:
+        raise TransactionNotFound(transaction_code)
+
+    amount, currency = row
+    new_balance = _debit(cur, receiver_agent_id, currency, amount)
+    _post(cur, "hawala_paid", [(receiver_agent_id, currency, -amount)], transaction_code)
+
+    cur.execute(
+        """
+        UPDATE transactions
+        SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+        WHERE transaction_code = ? AND status = 'pending'
+        """,
+        (transaction_code,),
+    )
+    return amount, currency, new_balance
+
+
+@ledger_operation
+def cancel_hawala(cur, transaction_code, agent_id):
+    """
+    لغو حواله در انتظار توسط عامل مبدأ (پول به مشتری برمی‌گردد)
+    خروجی: (amount, currency, new_balance)
+    """
+    cur.execute(
+        """
+        SELECT amount, currency
+        FROM transactions
+        WHERE transaction_code = ? AND agent_id = ? AND status = 'pending'
+        """,
+        (transaction_code, agent_id),
+    )
+    row = cur.fetchone()
+    if not row:
+        raise TransactionNotFound(transaction_code)
+
+    amount, currency = row
+    new_balance = _debit(cur, agent_id, currency, amount)
+    _post(cur, "hawala_cancelled", [(agent_id, currency, -amount)], transaction_code)
+
+    cur.execute(
+        """
+        UPDATE transactions
+        SET status = 'cancelled'
+        WHERE transaction_code = ? AND status = 'pending'
+        """,
+        (transaction_code,),
+    )
+    return amount, currency, new_balance
+
+
+@ledger_operation
+def edit_hawala_amount(cur, transaction_code, agent_id, new_amount, commission_rate=0.01):
+    """
+    تغییر مبلغ حواله در انتظار و اصلاح موجودی عامل مبدأ به اندازه تفاوت
+    خروجی: (old_amount, currency, new_commission, new_balance)
+    """
+    cur.execute(
+        """
+        SELECT amount, currency
+        FROM transactions
+        WHERE transaction_code = ? AND agent_id = ? AND status = 'pending'
+        """,
+        (transaction_code, agent_id),
+    )
+    row = cur.fetchone()
+    if not row:
+        raise TransactionNotFound(transaction_code)
+
+    old_amount, currency = row
+    diff = new_amount - old_amount
+
+    if diff > 0:
+        # پول بیشتر گرفته
+        new_balance = _credit(cur, agent_id, currency, diff)
+    elif diff < 0:
+        # باید پول برگرداند
+        new_balance = _debit(cur, agent_id, currency, -diff)
+    else:
+        new_balance = _balance(cur, agent_id, currency)
+    _post(cur, "hawala_amended", [(agent_id, currency, diff)], transaction_code)
+
+    new_commission = new_amount * commission_rate
+    cur.execute(
+        """
+        UPDATE transactions
+        SET amount = ?, commission = ?
+        WHERE transaction_code = ? AND status = 'pending'
+        """,
+        (new_amount, new_commission, transaction_code),
+    )
+    return old_amount, currency, new_commission, new_balance
+
+
+# =========================
+# عملیات موجودی
+# =========================
+
+
+@ledger_operation
+def decrease_balance(cur, agent_id, currency, amount):
+    """کاهش موجودی توسط خود عامل؛ موجودی جدید برمی‌گردد"""
+    new_balance = _debit(cur, agent_id, currency, amount)
+    _post(cur, "withdrawal", [(agent_id, currency, -amount)])
+    return new_balance
+
+
+@ledger_operation
+def adjust_balance(cur, agent_id, currency, amount):
+    """اصلاح دستی موجودی (مثبت یا منفی، بدون چک موجودی)؛ موجودی جدید برمی‌گردد"""
+    new_balance = _credit(cur, agent_id, currency, amount)
+    _post(cur, "adjustment", [(agent_id, currency, amount)])
+    return new_balance
+
+
+@ledger_operation
+def transfer_funds(cur, from_agent_id, to_agent_id, currency, amount, from_name, to_name):
+    """
+    انتقال وجه بین دو عامل و ثبت آن به عنوان حواله داخلی تکمیل شده
+    خروجی: (transaction_code, from_balance, to_balance)
+    """
+    transaction_code = next_code(cur, TRANSFER_PREFIX)
+    from_balance = _debit(cur, from_agent_id, currency, amount)
+    to_balance = _credit(cur, to_agent_id, currency, amount)
+    _post(
+        cur,
+        "transfer",
+        [(from_agent_id, currency, -amount), (to_agent_id, currency, amount)],
+        transaction_code,
+    )
+
+    cur.execute(
+        """
+        INSERT INTO transactions (
+            transaction_code, sender_name, receiver_name, amount,
+            currency, commission, status, agent_id, created_at
+        ) VALUES (?, ?, ?, ?, ?, 0, 'completed', ?, ?)
+        """,
+        (
+            transaction_code,
+            from_name,
+            to_name,
+            amount,
+            currency,
+            from_agent_id,
+            datetime.now(),
+        ),
+    )
+    return transaction_code, from_balance, to_balance
+
+
+@ledger_operation
+def process_balance_request(cur, request_id, approve):
+    """
+    تأیید یا رد درخواست شارژ حساب
+    خروجی: (agent_id, amount, currency, agent_telegram_id)
+    """
+    cur.execute(
+        "SELECT agent_id, amount, currency, status FROM balance_requests WHERE id = ?",
+        (request_id,),
+    )
+    row = cur.fetchone()
+    if not row:
+        raise TransactionNotFound(request_id)
+
+    agent_id, amount, currency, status = row
+    if status != "pending":
+        raise TransactionNotFound(request_id, status)
+
+    cur.execute(
+        """
+        UPDATE balance_requests
+        SET status = ?, processed_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'pending'
+        """,
+        ("approved" if approve else "rejected", request_id),
+    )
+
+    if approve:
+        _credit(cur, agent_id, currency, amount)
+        _post(cur, "deposit", [(agent_id, currency, amount)], balance_request_id=request_id)
+
+    cur.execute("SELECT telegram_id FROM agents WHERE id = ?", (agent_id,))
+    agent = cur.fetchone()
+    return agent_id, amount, currency, agent[0] if agent else None
+
+
+# =========================
+# بازسازی و کنترل موجودی‌ها
+# =========================
+
+_LEDGER_TOTALS = """
+    SELECT agent_id, currency, SUM(credit) - SUM(debit) AS total
+    FROM ledger_entries
+    WHERE agent_id IS NOT NULL
+    GROUP BY agent_id, currency
+"""
+
+
+def _mismatches(cur):
+    """ردیف‌های (agent_id, currency, balance, ledger_total) که با دفتر نمی‌خوانند"""
+    cur.execute(
+        f"""
+        SELECT b.agent_id, b.currency, b.balance, COALESCE(l.total, 0)
+        FROM balances b
+        LEFT JOIN ({_LEDGER_TOTALS}) l
+            ON l.agent_id = b.agent_id AND l.currency = b.currency
+        WHERE ABS(b.balance - COALESCE(l.total, 0)) > ?
+        UNION ALL
+        SELECT l.agent_id, l.currency, NULL, l.total
+        FROM ({_LEDGER_TOTALS}) l
+        WHERE ABS(l.total) > ?
+          AND NOT EXISTS (
+              SELECT 1 FROM balances b
+              WHERE b.agent_id = l.agent_id AND b.currency = l.currency
+          )
+        """,
+        (EPSILON, EPSILON),
+    )
+    return cur.fetchall()
+
+
+def verify_ledger():
+    """
+    کنترل دفتر کل
+    خروجی: (mismatches, unbalanced)؛ unbalanced ارزهایی است که جمع سندهایشان صفر نیست
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        mismatches = _mismatches(cur)
+        cur.execute(
+            """
+            SELECT currency, SUM(credit) - SUM(debit)
+            FROM ledger_entries
+            GROUP BY currency
+            HAVING ABS(SUM(credit) - SUM(debit)) > ?
+            """,
+            (EPSILON,),
+        )
+        unbalanced = cur.fetchall()
+    return mismatches, unbalanced
+
+
+@ledger_operation
+def rebuild_balances(cur):
+    """بازسازی balances از روی ledger_entries؛ تعداد ردیف‌های اصلاح شده برمی‌گردد"""
+    mismatches = _mismatches(cur)
+    for agent_id, currency, balance, total in mismatches:
+        if balance is None:
+            cur.execute(
+                "INSERT INTO balances (agent_id, currency, balance) VALUES (?, ?, ?)",
+                (agent_id, currency, total),
+            )
+        else:
+            cur.execute(
+                "UPDATE balances SET balance = ? WHERE agent_id = ? AND currency = ?",
+                (total, agent_id, currency),
+            )
+        logger.warning("Balance of agent %s %s: %s -> %s", agent_id, currency, balance, total)
+    return len(mismatches)
+
+
+def main(argv=None):
+    import argparse
+
+    from bot.services.database import init_db
+
+    parser = argparse.ArgumentParser(description="کنترل و بازسازی موجودی‌ها از دفتر کل")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    args = parser.parse_args(argv)
+
+    init_db()
+
+    if args.command == "rebuild":
+        print(f"✅ {rebuild_balances()} موجودی اصلاح شد")
+
+    mismatches, unbalanced = verify_ledger()
+    for agent_id, currency, balance, total in mismatches:
+        print(f"❌ عامل {agent_id} ({currency}): موجودی {balance} ، دفتر {total}")
+    for currency, total in unbalanced:
+        print(f"❌ جمع سندهای {currency} صفر نیست: {total}")
+    if not mismatches and not unbalanced:
+        print("✅ موجودی‌ها با دفتر کل مطابقت دارند")
+    return 1 if mismatches or unbalanced else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
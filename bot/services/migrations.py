@@ -0,0 +1,712 @@
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# لیست مرتب مایگریشن‌ها: (نسخه، نام، تابع)
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """ثبت یک مایگریشن؛ نسخه‌ها باید صعودی و یکتا باشند"""
+
+    def decorator(fn):
+        if MIGRATIONS and version <= MIGRATIONS[-1][0]:
+            raise ValueError(f"Migration {version} registered out of order")
+        MIGRATIONS.append((version, name, fn))
+        return fn
+
+    return decorator
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn):
+    """آخرین نسخه اعمال شده (۰ یعنی دیتابیس خالی یا قدیمی)"""
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def apply_migrations(conn):
+    """
+    اجرای مایگریشن‌های اعمال نشده، هر کدام در یک تراکنش جدا
+    اگر اسکیما به‌روز باشد فقط یک کوئری اجرا می‌شود
+    """
+    if current_version(conn) >= latest_version():
+        return 0
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    conn.commit()
+
+    applied = 0
+    for version, name, fn in MIGRATIONS:
+        # قفل نوشتن قبل از بررسی، تا دو پروسه همزمان یک مایگریشن را دوبار اجرا نکنند
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            done = conn.execute(
+                "SELECT 1 FROM schema_version WHERE version = ?", (version,)
+            ).fetchone()
+            if done:
+                conn.rollback()
+                continue
+
+            fn(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, name) VALUES (?, ?)",
+                (version, name),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception("Migration %s (%s) failed", version, name)
+            raise
+
+        applied += 1
+        logger.info("Applied migration %s: %s", version, name)
+
+    return applied
+
+
+# =========================
+# مایگریشن‌ها
+# =========================
+
+
+@migration(1, "baseline_tables")
+def _baseline_tables(conn):
+    cur = conn.cursor()
+
+    # جدول ادمین
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password_hash TEXT,
+            telegram_id INTEGER UNIQUE,
+            is_active INTEGER DEFAULT 1
+        )
+        """
+    )
+
+    # جدول عامل‌ها
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS agents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            province TEXT,
+            phone TEXT UNIQUE,
+            tazkira TEXT UNIQUE,
+            telegram_id INTEGER UNIQUE,
+            password_hash TEXT,
+            is_active INTEGER DEFAULT 1,
+            -- 🔐 امنیت لاگین
+            failed_attempts INTEGER DEFAULT 0,
+            locked_at TEXT
+        )
+        """
+    )
+
+    # جدول بیلانس‌ها
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS balances (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            agent_id INTEGER,
+            currency TEXT,
+            balance REAL DEFAULT 0,
+            FOREIGN KEY(agent_id) REFERENCES agents(id),
+            UNIQUE(agent_id, currency)
+        )
+        """
+    )
+
+    # جدول حواله‌ها
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_code VARCHAR(10) UNIQUE,
+            agent_id INTEGER,
+            receiver_agent_id INTEGER,
+            sender_name TEXT,
+            receiver_name TEXT,
+            receiver_tazkira TEXT,
+            amount REAL,
+            currency TEXT,
+            commission REAL,
+            status TEXT DEFAULT 'pending',
+            notes TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            completed_at DATETIME,
+            FOREIGN KEY (agent_id) REFERENCES agents(id),
+            FOREIGN KEY (receiver_agent_id) REFERENCES agents(id)
+        )
+        """
+    )
+
+    # جدول درخواست‌های افزایش موجودی (شارژ حساب)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS balance_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            agent_id INTEGER,
+            amount REAL,
+            currency TEXT,
+            receipt_photo_id TEXT,
+            status TEXT DEFAULT 'pending', -- pending, approved, rejected
+            admin_note TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            processed_at DATETIME,
+            FOREIGN KEY (agent_id) REFERENCES agents(id)
+        )
+        """
+    )
+
+
+@migration(2, "dedupe_balances")
+def _dedupe_balances(conn):
+    # پاکسازی ارزهای تکراری دیتابیس‌های قدیمی (فقط یکبار)
+    conn.execute(
+        """
+        DELETE FROM balances
+        WHERE id NOT IN (
+            SELECT MIN(id)
+            FROM balances
+            GROUP BY agent_id, currency
+        )
+        """
+    )
+
+
+@migration(3, "hot_path_indexes")
+def _hot_path_indexes(conn):
+    # ایندکس‌های مسیرهای پرتکرار
+    # دیتابیس‌هایی که قبلاً با PRAGMA user_version = 1 ساخته شده‌اند هم امن هستند (IF NOT EXISTS)
+    statements = [
+        # agent_menu و list_payable_transactions: گیرنده + وضعیت
+        """
+        CREATE INDEX IF NOT EXISTS idx_transactions_receiver_status
+        ON transactions (receiver_agent_id, status, created_at)
+        """,
+        # list_my_transactions و get_agent_transactions: عامل + مرتب‌سازی زمانی
+        """
+        CREATE INDEX IF NOT EXISTS idx_transactions_agent_created
+        ON transactions (agent_id, created_at)
+        """,
+        # manage_pending_transactions_start: عامل + وضعیت + زمان
+        """
+        CREATE INDEX IF NOT EXISTS idx_transactions_agent_status
+        ON transactions (agent_id, status, created_at)
+        """,
+        # هشدارها و بررسی سلامت: وضعیت + زمان
+        """
+        CREATE INDEX IF NOT EXISTS idx_transactions_status_created
+        ON transactions (status, created_at)
+        """,
+        # پنجره‌های زمانی داشبورد و پنل سود
+        """
+        CREATE INDEX IF NOT EXISTS idx_transactions_created
+        ON transactions (created_at)
+        """,
+        # list_balance_requests: وضعیت + زمان
+        """
+        CREATE INDEX IF NOT EXISTS idx_balance_requests_status_created
+        ON balance_requests (status, created_at)
+        """,
+        # هشدار موجودی کم: ارز + مبلغ (پوششی)
+        """
+        CREATE INDEX IF NOT EXISTS idx_balances_currency_balance
+        ON balances (currency, balance, agent_id)
+        """,
+    ]
+    for statement in statements:
+        conn.execute(statement)
+    conn.execute("ANALYZE")
+
+
+@migration(4, "ledger_entries")
+def _ledger_entries(conn):
+    # دفتر روزنامه دوطرفه (فقط اضافه می‌شود، هرگز ویرایش یا حذف نمی‌شود)
+    # agent_id خالی = حساب صندوق بیرونی (پول نقد مشتری‌ها و مدیریت مرکزی)
+    # credit = افزایش موجودی عامل، debit = کاهش موجودی عامل
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ledger_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            agent_id INTEGER,
+            currency TEXT NOT NULL,
+            debit REAL NOT NULL DEFAULT 0,
+            credit REAL NOT NULL DEFAULT 0,
+            entry_type TEXT NOT NULL,
+            transaction_code TEXT,
+            balance_request_id INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (agent_id) REFERENCES agents(id),
+            FOREIGN KEY (balance_request_id) REFERENCES balance_requests(id)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_ledger_entries_agent_currency
+        ON ledger_entries (agent_id, currency, id)
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_ledger_entries_transaction_code
+        ON ledger_entries (transaction_code)
+        """
+    )
+
+    # موجودی‌های فعلی به عنوان سند افتتاحیه (طرف مقابل: صندوق بیرونی)
+    conn.execute(
+        """
+        INSERT INTO ledger_entries (agent_id, currency, debit, credit, entry_type)
+        SELECT agent_id, currency,
+               CASE WHEN balance < 0 THEN -balance ELSE 0 END,
+               CASE WHEN balance > 0 THEN balance ELSE 0 END,
+               'opening'
+        FROM balances
+        WHERE balance != 0
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO ledger_entries (agent_id, currency, debit, credit, entry_type)
+        SELECT NULL, currency,
+               CASE WHEN SUM(balance) > 0 THEN SUM(balance) ELSE 0 END,
+               CASE WHEN SUM(balance) < 0 THEN -SUM(balance) ELSE 0 END,
+               'opening'
+        FROM balances
+        GROUP BY currency
+        HAVING SUM(balance) != 0
+        """
+    )
+
+
+@migration(5, "code_sequences")
+def _code_sequences(conn):
+    # شمارنده کد حواله‌ها (HWL) و انتقال‌ها (TRF)؛
+    # کدهای جدید ۷ رقمی هستند و با کدهای قدیمی (۶ رقمی / ۱۴ رقمی) برخورد ندارند
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS code_sequences (
+            prefix TEXT PRIMARY KEY,
+            last_value INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO code_sequences (prefix, last_value) VALUES ('HWL', 0), ('TRF', 0)"
+    )
+
+
+@migration(6, "persistence")
+def _persistence(conn):
+    # داده‌های ربات تلگرام (user_data و وضعیت مکالمه‌ها) برای ماندن بعد از ری‌استارت
+    # kind: "user" یا "conversation:<نام مکالمه>"، data: JSON
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS persistence (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (kind, key)
+        )
+        """
+    )
+
+
+@migration(7, "receipt_files")
+def _receipt_files(conn):
+    # file_id تلگرام برای رسیدهایی که یکبار آپلود شده‌اند (ارسال دوباره بدون آپلود)
+    # receipt_key = کد حواله + هش فیلدهای رسید
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS receipt_files (
+            receipt_key TEXT PRIMARY KEY,
+            transaction_code TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+@migration(8, "report_jobs")
+def _report_jobs(conn):
+    # صف گزارش‌های سنگین؛ بعد از ری‌استارت کارهای نیمه‌تمام دوباره اجرا می‌شوند
+    # dedup_key = نوع + پارامترها؛ درخواست تکراری فقط به گیرندگان کار موجود اضافه می‌شود
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS report_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            dedup_key TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            started_at DATETIME,
+            finished_at DATETIME
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_report_jobs_dedup_status
+        ON report_jobs (dedup_key, status)
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS report_job_recipients (
+            job_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            PRIMARY KEY (job_id, chat_id)
+        )
+        """
+    )
+
+
+@migration(9, "daily_stats")
+def _daily_stats(conn):
+    # جمع روزانه حواله‌ها برای داشبورد و پنل سود (به جای اسکن کل جدول transactions)
+    # با trigger در همان تراکنشِ ثبت یا تغییر حواله به‌روز می‌شود، پس از هیچ مسیری جا نمی‌ماند
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT NOT NULL,
+            agent_id INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            status TEXT NOT NULL,
+            tx_count INTEGER NOT NULL DEFAULT 0,
+            amount REAL NOT NULL DEFAULT 0,
+            commission REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, agent_id, currency, status)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_daily_stats_agent
+        ON daily_stats (agent_id, status)
+        """
+    )
+
+    key = "date({row}.created_at), COALESCE({row}.agent_id, 0), COALESCE({row}.currency, ''), COALESCE({row}.status, '')"
+    where = (
+        "day = date(OLD.created_at) AND agent_id = COALESCE(OLD.agent_id, 0) "
+        "AND currency = COALESCE(OLD.currency, '') AND status = COALESCE(OLD.status, '')"
+    )
+    add_new = f"""
+        INSERT INTO daily_stats (day, agent_id, currency, status, tx_count, amount, commission)
+        VALUES ({key.format(row="NEW")}, 1, COALESCE(NEW.amount, 0), COALESCE(NEW.commission, 0))
+        ON CONFLICT (day, agent_id, currency, status) DO UPDATE SET
+            tx_count = tx_count + 1,
+            amount = amount + excluded.amount,
+            commission = commission + excluded.commission;
+    """
+    remove_old = f"""
+        UPDATE daily_stats SET
+            tx_count = tx_count - 1,
+            amount = amount - COALESCE(OLD.amount, 0),
+            commission = commission - COALESCE(OLD.commission, 0)
+        WHERE {where};
+        DELETE FROM daily_stats WHERE {where} AND tx_count <= 0;
+    """
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_daily_stats_insert
+        AFTER INSERT ON transactions
+        BEGIN
+            {add_new}
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_daily_stats_update
+        AFTER UPDATE OF agent_id, currency, status, amount, commission, created_at ON transactions
+        BEGIN
+            {remove_old}
+            {add_new}
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_daily_stats_delete
+        AFTER DELETE ON transactions
+        BEGIN
+            {remove_old}
+        END
+        """
+    )
+
+    # پر کردن از حواله‌های موجود
+    conn.execute("DELETE FROM daily_stats")
+    conn.execute(
+        f"""
+        INSERT INTO daily_stats (day, agent_id, currency, status, tx_count, amount, commission)
+        SELECT {key.format(row="transactions")},
+               COUNT(*), COALESCE(SUM(amount), 0), COALESCE(SUM(commission), 0)
+        FROM transactions
+        GROUP BY 1, 2, 3, 4
+        """
+    )
+
+
+@migration(10, "data_version")
+def _data_version(conn):
+    # شمارنده نسخه داده‌های گزارش‌ها؛ با هر نوشتن روی حواله‌ها، موجودی‌ها یا عامل‌ها یکی زیاد می‌شود
+    # کش گزارش‌های ادمین تا وقتی این عدد عوض نشده، نتیجه قبلی را برمی‌گرداند
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    conn.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+
+    bump = "UPDATE data_version SET version = version + 1 WHERE id = 1;"
+    watched = (
+        ("transactions", "INSERT", ""),
+        ("transactions", "UPDATE", ""),
+        ("transactions", "DELETE", ""),
+        ("balances", "INSERT", ""),
+        ("balances", "UPDATE", "OF balance"),
+        ("balances", "DELETE", ""),
+        ("agents", "INSERT", ""),
+        # ورود/خروج عامل (telegram_id، تلاش‌های ناموفق) روی گزارش‌ها اثری ندارد
+        ("agents", "UPDATE", "OF name, province, is_active"),
+        ("agents", "DELETE", ""),
+    )
+    for table, event, columns in watched:
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_data_version_{table}_{event.lower()}
+            AFTER {event} {columns} ON {table}
+            BEGIN
+                {bump}
+            END
+            """
+        )
+
+
+@migration(11, "alerts")
+def _alerts(conn):
+    # هشدارهای فعال سیستم؛ با trigger در همان تراکنشِ تغییر موجودی، عامل یا حواله به‌روز می‌شوند
+    # (صفحه هشدارها فقط این جدول را می‌خواند). کلید هر هشدار: قانون + عامل + ارز + حواله
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            rule TEXT NOT NULL,
+            agent_id INTEGER NOT NULL DEFAULT 0,
+            currency TEXT NOT NULL DEFAULT '',
+            transaction_id INTEGER NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (rule, agent_id, currency, transaction_id)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_alerts_agent
+        ON alerts (agent_id)
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_alerts_transaction
+        ON alerts (transaction_id)
+        """
+    )
+    # آستانه‌های قانون‌ها؛ هنگام شروع ربات از config نوشته می‌شوند (bot.services.alerts)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS alert_settings (
+            name TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        )
+        """
+    )
+    # آخرین حواله هر عامل (برای هشدار عدم فعالیت بدون GROUP BY روی کل حواله‌ها)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS agent_activity (
+            agent_id INTEGER PRIMARY KEY,
+            last_activity DATETIME
+        )
+        """
+    )
+
+    setting = "(SELECT value FROM alert_settings WHERE name = '{}')"
+
+    # قانون‌های وابسته به عامل و موجودی‌هایش: (قانون، ارز، join، شرط)
+    agent_rules = (
+        (
+            "low_balance",
+            "b.currency",
+            "JOIN balances b ON b.agent_id = a.id",
+            f"a.is_active = 1 AND b.currency = 'AFN' AND b.balance < {setting.format('low_balance_afn')}",
+        ),
+        (
+            "zero_balance",
+            "''",
+            "",
+            "a.is_active = 1 AND NOT EXISTS "
+            "(SELECT 1 FROM balances z WHERE z.agent_id = a.id AND z.balance > 0)",
+        ),
+        (
+            "inactive_with_balance",
+            "b.currency",
+            "JOIN balances b ON b.agent_id = a.id",
+            "a.is_active = 0 AND b.balance > 0",
+        ),
+    )
+
+    def refresh_agent(agent):
+        statements = []
+        for rule, currency, join, condition in agent_rules:
+            matches = f"SELECT {currency} FROM agents a {join} WHERE a.id = {agent} AND {condition}"
+            statements.append(
+                f"DELETE FROM alerts WHERE rule = '{rule}' AND agent_id = {agent} "
+                f"AND currency NOT IN ({matches});"
+            )
+            statements.append(
+                f"INSERT OR IGNORE INTO alerts (rule, agent_id, currency) "
+                f"SELECT '{rule}', a.id, {currency} FROM agents a {join} "
+                f"WHERE a.id = {agent} AND {condition};"
+            )
+        # عامل غیرفعال شده دیگر هشدار عدم فعالیت ندارد
+        statements.append(
+            f"DELETE FROM alerts WHERE rule = 'inactive_agent' AND agent_id = {agent} "
+            f"AND NOT EXISTS (SELECT 1 FROM agents WHERE id = {agent} AND is_active = 1);"
+        )
+        return "\n".join(statements)
+
+    agent_triggers = (
+        ("balances", "INSERT", "", refresh_agent("NEW.agent_id")),
+        ("balances", "UPDATE", "OF balance, agent_id, currency",
+         refresh_agent("OLD.agent_id") + "\n" + refresh_agent("NEW.agent_id")),
+        ("balances", "DELETE", "", refresh_agent("OLD.agent_id")),
+        ("agents", "INSERT", "", refresh_agent("NEW.id")),
+        ("agents", "UPDATE", "OF is_active", refresh_agent("NEW.id")),
+        ("agents", "DELETE", "", "DELETE FROM alerts WHERE agent_id = OLD.id;"),
+    )
+    for table, event, columns, body in agent_triggers:
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_alerts_{table}_{event.lower()}
+            AFTER {event} {columns} ON {table}
+            BEGIN
+                {body}
+            END
+            """
+        )
+
+    # قانون‌های حواله: مبلغ بالا (با trigger) و در انتظار قدیمی (فقط حذف با trigger؛
+    # اضافه شدن وابسته به زمان است و در bot.services.alerts.sync_time_alerts انجام می‌شود)
+    high_amount = f"NEW.status != 'cancelled' AND NEW.amount > {setting.format('high_amount')}"
+    add_high_amount = f"""
+        INSERT OR IGNORE INTO alerts (rule, agent_id, transaction_id)
+        SELECT 'high_amount', COALESCE(NEW.agent_id, 0), NEW.id WHERE {high_amount};
+    """
+    touch_activity = """
+        INSERT OR REPLACE INTO agent_activity (agent_id, last_activity)
+        SELECT {agent}, (SELECT MAX(created_at) FROM transactions WHERE agent_id = {agent})
+        WHERE {agent} IS NOT NULL{when};
+    """
+    moved = " AND (OLD.agent_id IS NOT NEW.agent_id OR OLD.created_at IS NOT NEW.created_at)"
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_alerts_transactions_insert
+        AFTER INSERT ON transactions
+        BEGIN
+            {add_high_amount}
+            {touch_activity.format(agent="NEW.agent_id", when="")}
+            DELETE FROM alerts WHERE rule = 'inactive_agent' AND agent_id = NEW.agent_id;
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_alerts_transactions_update
+        AFTER UPDATE OF status, amount, agent_id, created_at ON transactions
+        BEGIN
+            DELETE FROM alerts WHERE transaction_id = NEW.id AND rule = 'high_amount'
+                AND NOT COALESCE({high_amount} AND agent_id = COALESCE(NEW.agent_id, 0), 0);
+            DELETE FROM alerts WHERE transaction_id = NEW.id AND rule = 'old_pending'
+                AND NOT COALESCE(NEW.status = 'pending' AND agent_id = COALESCE(NEW.agent_id, 0), 0);
+            {add_high_amount}
+            {touch_activity.format(agent="OLD.agent_id", when=moved)}
+            {touch_activity.format(agent="NEW.agent_id", when=moved)}
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_alerts_transactions_delete
+        AFTER DELETE ON transactions
+        BEGIN
+            DELETE FROM alerts WHERE transaction_id = OLD.id;
+            {touch_activity.format(agent="OLD.agent_id", when="")}
+        END
+        """
+    )
+
+    # پر کردن آخرین فعالیت از حواله‌های موجود؛ خود هشدارها بعد از نوشتن آستانه‌ها ساخته می‌شوند
+    conn.execute("DELETE FROM agent_activity")
+    conn.execute(
+        """
+        INSERT INTO agent_activity (agent_id, last_activity)
+        SELECT agent_id, MAX(created_at) FROM transactions
+        WHERE agent_id IS NOT NULL
+        GROUP BY agent_id
+        """
+    )
+
+
+@migration(12, "alerts_notified")
+def _alerts_notified(conn):
+    # اسکن زمان‌بندی شده فقط هشدارهای اطلاع داده نشده را برای ادمین‌ها می‌فرستد
+    conn.execute("ALTER TABLE alerts ADD COLUMN notified INTEGER NOT NULL DEFAULT 0")
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_alerts_unnotified
+        ON alerts (id) WHERE notified = 0
+        """
+    )
+
+
+@migration(13, "drop_persisted_password_hashes")
+def _drop_persisted_password_hashes(conn):
+    # نسخه‌های قبلی هش پسورد عامل جدید را در user_data["password"] نگه می‌داشتند و روی دیسک می‌رفت
+    conn.execute(
+        """
+        UPDATE persistence SET data = json_remove(data, '$.password')
+        WHERE kind = 'user' AND json_extract(data, '$.password') IS NOT NULL
+        """
+    )
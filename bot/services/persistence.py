@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from datetime import date, datetime
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from bot.services.database import db_connection, run_db
+from config import PERSISTENCE_FLUSH_DELAY, PERSISTENCE_UPDATE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+USER_KIND = "user"
+
+# کلیدهایی از user_data که هرگز روی دیسک نوشته نمی‌شوند:
+# پسورد خام هنگام ساخت عامل و داده‌های موقت ورود (هش پسورد عامل/ادمین)
+TRANSIENT_KEYS = {"temp_password", "password_hash", "admin", "login_agent_id"}
+
+
+def _conversation_kind(name):
+    return f"conversation:{name}"
+
+
+def _json_default(value):
+    if isinstance(value, sqlite3.Row):
+        return dict(zip(value.keys(), value))
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+
+
+def _load_rows(kind):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT key, data FROM persistence WHERE kind = ?", (kind,))
+        return cur.fetchall()
+
+
+def _write_rows(batch):
+    """نوشتن یکجای تغییرات در یک تراکنش؛ data خالی یعنی حذف"""
+    upserts = [(kind, key, data) for (kind, key), data in batch.items() if data is not None]
+    deletes = [(kind, key) for (kind, key), data in batch.items() if data is None]
+
+    with db_connection() as conn:
+        if upserts:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO persistence (kind, key, data, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                """,
+                upserts,
+            )
+        if deletes:
+            conn.executemany("DELETE FROM persistence WHERE kind = ? AND key = ?", deletes)
+        conn.commit()
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    ذخیره user_data و وضعیت ConversationHandler ها در جدول persistence
+    تغییرات در حافظه جمع می‌شوند و حداکثر هر PERSISTENCE_FLUSH_DELAY ثانیه
+    یکبار (در یک تراکنش) نوشته می‌شوند؛ در خاموش شدن ربات همه چیز flush می‌شود
+    chat_data و bot_data در این ربات استفاده نمی‌شوند و ذخیره نمی‌شوند
+    """
+
+    def __init__(self, flush_delay=PERSISTENCE_FLUSH_DELAY, update_interval=PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.flush_delay = flush_delay
+        # (kind, key) -> JSON یا None (حذف) که هنوز نوشته نشده
+        self._pending = {}
+        # آخرین JSON نوشته شده برای هر کلید؛ داده‌های بدون تغییر دوباره نوشته نمی‌شوند
+        self._written = {}
+        self._flush_task = None
+        self._write_lock = asyncio.Lock()
+
+    # =========================
+    # بارگذاری
+    # =========================
+
+    async def get_user_data(self):
+        rows = await run_db(_load_rows, USER_KIND)
+        user_data = {}
+        for key, data in rows:
+            self._written[(USER_KIND, key)] = data
+            user_data[int(key)] = json.loads(data)
+        logger.info("Restored user_data for %d users", len(user_data))
+        return user_data
+
+    async def get_conversations(self, name):
+        kind = _conversation_kind(name)
+        rows = await run_db(_load_rows, kind)
+        conversations = {}
+        for key, data in rows:
+            self._written[(kind, key)] = data
+            conversations[tuple(json.loads(key))] = json.loads(data)
+        return conversations
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # =========================
+    # ثبت تغییرات
+    # =========================
+
+    async def update_user_data(self, user_id, data):
+        data = {key: value for key, value in data.items() if key not in TRANSIENT_KEYS}
+        if not data:
+            self._mark(USER_KIND, str(user_id), None)
+            return
+        try:
+            text = _dumps(data)
+        except (TypeError, ValueError):
+            text = _dumps(self._serializable_part(user_id, data))
+        self._mark(USER_KIND, str(user_id), text)
+
+    async def update_conversation(self, name, key, new_state):
+        text = None if new_state is None else _dumps(new_state)
+        self._mark(_conversation_kind(name), _dumps(list(key)), text)
+
+    async def drop_user_data(self, user_id):
+        self._mark(USER_KIND, str(user_id), None)
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    @staticmethod
+    def _serializable_part(user_id, data):
+        """کلیدهایی که قابل تبدیل به JSON نیستند ذخیره نمی‌شوند"""
+        result = {}
+        for key, value in data.items():
+            try:
+                _dumps(value)
+            except (TypeError, ValueError):
+                logger.warning("user_data[%r] of user %s is not JSON serializable, not persisted", key, user_id)
+                continue
+            result[key] = value
+        return result
+
+    def _mark(self, kind, key, text):
+        if self._written.get((kind, key)) == text:
+            self._pending.pop((kind, key), None)
+            return
+        self._pending[(kind, key)] = text
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    # =========================
+    # نوشتن در دیتابیس
+    # =========================
+
+    async def _delayed_flush(self):
+        # تغییرات چند ثانیه جمع می‌شوند تا همه با یک تراکنش نوشته شوند
+        await asyncio.sleep(self.flush_delay)
+        await self._write_pending()
+
+    async def _write_pending(self):
+        async with self._write_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await run_db(_write_rows, batch)
+            except Exception:
+                logger.exception("Failed to persist %d entries, will retry", len(batch))
+                # تغییرات جدیدتر روی تغییرات ناموفق اولویت دارند
+                batch.update(self._pending)
+                self._pending = batch
+                self._flush_task = asyncio.create_task(self._delayed_flush())
+                return
+            self._written.update(batch)
+            for key, text in batch.items():
+                if text is None:
+                    self._written.pop(key, None)
+
+    async def flush(self):
+        # اول نوشتن (اگر نوشتن قبلی در جریان است منتظر می‌ماند)، بعد لغو تایمر باقیمانده
+        await self._write_pending()
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
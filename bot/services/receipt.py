@@ -1,15 +1,52 @@
 
+import asyncio
 import io
 import logging
-from PIL import Image, ImageDraw, ImageFont
-from arabic_reshaper import reshape
-from bidi.algorithm import get_display
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import os
 
+from config import (
+    RECEIPT_WORKERS,
+    RECEIPT_QUEUE_SIZE,
+    RECEIPT_TIMEOUT,
+    RECEIPT_FORMAT,
+    RECEIPT_MAX_BYTES,
+)
+
 logger = logging.getLogger(__name__)
 
+# Pillow، arabic_reshaper و bidi سنگین هستند و فقط در پروسه‌های رسید لازم‌اند؛
+# در اولین استفاده import می‌شوند تا شروع ربات سریع بماند
+
+# تنظیمات قالب رسید
+WIDTH = 600
+HEIGHT = 800
+BACKGROUND_COLOR = (255, 255, 255)
+PRIMARY_COLOR = (41, 128, 185)  # آبی حرفه‌ای
+TEXT_COLOR = (44, 62, 80)
+ROW_TOP = 150
+ROW_HEIGHT = 60  # ۵۰ ارتفاع خط + ۱۰ فاصله
+
+FIELDS = [
+    ("کد حواله:", "transaction_code"),
+    ("فرستنده:", "sender_name"),
+    ("گیرنده:", "receiver_name"),
+    ("تذکره گیرنده:", "receiver_tazkira"),
+    ("مبلغ:", "amount"),
+    ("عامل مبدأ:", "sender_agent"),
+    ("عامل مقصد:", "receiver_agent"),
+    ("تاریخ ثبت:", "created_at"),
+]
+
+
+@lru_cache(maxsize=None)
 def get_font(size=24):
-    """انتخاب فونت مناسب برای فارسی در ویندوز یا لینوکس"""
+    """انتخاب فونت مناسب برای فارسی در ویندوز یا لینوکس (هر اندازه فقط یکبار بارگذاری می‌شود)"""
+    from PIL import ImageFont
+
     font_paths = [
         "C:\\Windows\\Fonts\\tahoma.ttf",
         "C:\\Windows\\Fonts\\arial.ttf",
@@ -28,75 +65,212 @@ def format_farsi(text):
     """اصلاح نمایش متن فارسی برای Pillow"""
     if not text:
         return ""
+    from arabic_reshaper import reshape
+    from bidi.algorithm import get_display
+
     reshaped_text = reshape(str(text))
     bidi_text = get_display(reshaped_text)
     return bidi_text
 
-def generate_receipt_image(transaction_data):
+
+@lru_cache(maxsize=1)
+def _base_image():
     """
-    تولید تصویر رسید حواله
-    transaction_data: dict containing code, sender, receiver, amount, currency, etc.
+    بخش ثابت رسید (کادر، هدر، برچسب‌ها، خطوط و فوتر) فقط یکبار در هر پروسه رسم می‌شود
+    هر رسید یک کپی از آن می‌گیرد و فقط مقدارها را رویش می‌نویسد
     """
-    # تنظیمات ابعاد رسید
-    width = 600
-    height = 800
-    background_color = (255, 255, 255)
-    primary_color = (41, 128, 185)  # آبی حرفه‌ای
-    text_color = (44, 62, 80)
-    
-    # ایجاد تصویر خام
-    img = Image.new('RGB', (width, height), color=background_color)
+    from PIL import Image, ImageDraw
+
+    img = Image.new('RGB', (WIDTH, HEIGHT), color=BACKGROUND_COLOR)
     draw = ImageDraw.Draw(img)
-    
-    # فونت‌ها
-    font_header = get_font(40)
-    font_body = get_font(24)
-    font_footer = get_font(18)
-    
+
     # کشیدن کادر دور رسید
-    draw.rectangle([10, 10, width-10, height-10], outline=primary_color, width=3)
-    
+    draw.rectangle([10, 10, WIDTH-10, HEIGHT-10], outline=PRIMARY_COLOR, width=3)
+
     # هدر
     header_text = format_farsi("رسید حواله سیستم هوشمند")
-    draw.text((width//2, 60), header_text, fill=primary_color, font=font_header, anchor="mm")
-    
-    draw.line([50, 100, width-50, 100], fill=primary_color, width=2)
-    
-    # محتوا
-    y_offset = 150
-    line_height = 50
-    
-    fields = [
-        ("کد حواله:", transaction_data.get('transaction_code', '')),
-        ("فرستنده:", transaction_data.get('sender_name', '')),
-        ("گیرنده:", transaction_data.get('receiver_name', '')),
-        ("تذکره گیرنده:", transaction_data.get('receiver_tazkira', '')),
-        ("مبلغ:", f"{transaction_data.get('amount', 0):,.0f} {transaction_data.get('currency', '')}"),
-        ("عامل مبدأ:", transaction_data.get('sender_agent', '')),
-        ("عامل مقصد:", transaction_data.get('receiver_agent', '')),
-        ("تاریخ ثبت:", transaction_data.get('created_at', '')),
-    ]
-    
-    for label, value in fields:
-        # برچسب (راست‌چین)
-        label_farsi = format_farsi(label)
-        draw.text((width-60, y_offset), label_farsi, fill=text_color, font=font_body, anchor="rm")
-        
-        # مقدار (چپ‌چین یا وسط‌چین برای فارسی بهتر است راست‌چین باشد ولی در ستون مقابل)
-        value_farsi = format_farsi(value)
-        draw.text((60, y_offset), value_farsi, fill=text_color, font=font_body, anchor="lm")
-        
-        y_offset += line_height
-        draw.line([50, y_offset-10, width-50, y_offset-10], fill=(236, 240, 241), width=1)
-        y_offset += 10
-
-    # فوتر و بارکد (شبیه‌سازی شده با کد)
+    draw.text((WIDTH//2, 60), header_text, fill=PRIMARY_COLOR, font=get_font(40), anchor="mm")
+
+    draw.line([50, 100, WIDTH-50, 100], fill=PRIMARY_COLOR, width=2)
+
+    # برچسب‌ها (راست‌چین) و خط جداکننده هر ردیف
+    for index, (label, _) in enumerate(FIELDS):
+        y_offset = ROW_TOP + index * ROW_HEIGHT
+        draw.text((WIDTH-60, y_offset), format_farsi(label), fill=TEXT_COLOR, font=get_font(24), anchor="rm")
+        draw.line([50, y_offset+40, WIDTH-50, y_offset+40], fill=(236, 240, 241), width=1)
+
+    # فوتر
     footer_text = format_farsi("این رسید به صورت سیستمی صادر شده است.")
-    draw.text((width//2, height-80), footer_text, fill=(127, 140, 141), font=font_footer, anchor="mm")
-    
+    draw.text((WIDTH//2, HEIGHT-80), footer_text, fill=(127, 140, 141), font=get_font(18), anchor="mm")
+
+    return img
+
+
+def generate_receipt_image(transaction_data, fmt=None):
+    """
+    تولید تصویر رسید حواله
+    transaction_data: dict containing code, sender, receiver, amount, currency, etc.
+    fmt: فرمت خروجی (پیش‌فرض RECEIPT_FORMAT)
+    """
+    from PIL import ImageDraw
+
+    img = _base_image().copy()
+    draw = ImageDraw.Draw(img)
+    font_body = get_font(24)
+
+    for index, (_, key) in enumerate(FIELDS):
+        if key == "amount":
+            value = f"{transaction_data.get('amount', 0):,.0f} {transaction_data.get('currency', '')}"
+        else:
+            value = transaction_data.get(key, '')
+
+        # مقدار (در ستون مقابل برچسب)
+        y_offset = ROW_TOP + index * ROW_HEIGHT
+        draw.text((60, y_offset), format_farsi(value), fill=TEXT_COLOR, font=font_body, anchor="lm")
+
     # خروجی به صورت بایت
-    img_byte_arr = io.BytesIO()
-    img.save(img_byte_arr, format='PNG')
-    img_byte_arr.seek(0)
-    
+    img_byte_arr = io.BytesIO(encode_receipt(img, fmt))
+    img_byte_arr.name = f"receipt.{receipt_extension(fmt)}"
     return img_byte_arr
+
+
+# =========================
+# فشرده‌سازی خروجی
+# =========================
+# رسید تقریباً سفید با چند رنگ است؛ PNG پالتی یا WebP چند برابر کوچک‌تر از PNG معمولی است
+# هر فرمت از کیفیت بالا شروع می‌کند و تا جا شدن در RECEIPT_MAX_BYTES پایین می‌آید
+
+RECEIPT_EXTENSIONS = {"png": "png", "webp": "webp", "jpeg": "jpg"}
+
+_ENCODE_STEPS = {
+    # تعداد رنگ پالت
+    "png": [64, 32, 16],
+    # کیفیت
+    "webp": [80, 65, 50, 35],
+    "jpeg": [85, 70, 55, 40],
+}
+
+
+def receipt_extension(fmt=None):
+    return RECEIPT_EXTENSIONS[(fmt or RECEIPT_FORMAT).lower()]
+
+
+def _encode(img, fmt, step):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    if fmt == "png":
+        img.quantize(colors=step, method=Image.Quantize.FASTOCTREE).save(
+            buffer, format="PNG", optimize=True
+        )
+    elif fmt == "webp":
+        img.save(buffer, format="WEBP", quality=step, method=4)
+    else:
+        img.save(buffer, format="JPEG", quality=step, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def encode_receipt(img, fmt=None, max_bytes=None):
+    """تبدیل تصویر رسید به bytes با فرمت انتخابی و سقف حجم (0 = بدون سقف)"""
+    fmt = (fmt or RECEIPT_FORMAT).lower()
+    max_bytes = RECEIPT_MAX_BYTES if max_bytes is None else max_bytes
+    if fmt not in _ENCODE_STEPS:
+        raise ValueError(f"Unsupported receipt format: {fmt}")
+
+    data = None
+    for step in _ENCODE_STEPS[fmt]:
+        data = _encode(img, fmt, step)
+        if not max_bytes or len(data) <= max_bytes:
+            return data
+
+    logger.warning("Receipt is %d bytes as %s, over the %d byte budget", len(data), fmt, max_bytes)
+    return data
+
+
+# =========================
+# رندر رسید در process pool
+# =========================
+# رسم با Pillow و reshape/bidi کار CPU است؛ روی event loop اجرا شود همه پیام‌ها منتظر می‌مانند
+
+
+class ReceiptBusy(Exception):
+    """صف رسیدها پر است؛ کاربر باید کمی بعد دوباره تلاش کند"""
+
+
+_pool = None
+_slots = None
+_workers = None
+
+
+def _render_receipt_bytes(transaction_data, fmt=None):
+    # در پروسه کارگر اجرا می‌شود؛ bytes برمی‌گرداند چون BytesIO بین پروسه‌ها منتقل نمی‌شود
+    return generate_receipt_image(transaction_data, fmt).getvalue()
+
+
+def _warm_up_worker():
+    # فونت‌ها و تصویر پایه قبل از اولین رسید آماده می‌شوند
+    _base_image()
+
+
+def get_receipt_pool():
+    global _pool
+    if _pool is None:
+        # spawn به جای fork: پروسه اصلی thread های دیتابیس دارد
+        _pool = ProcessPoolExecutor(
+            max_workers=RECEIPT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_up_worker,
+        )
+    return _pool
+
+
+def _release_worker_when_done(loop):
+    """
+    جای کارگر تا تمام شدن واقعی رندر در پروسه گرفته می‌ماند، نه تا timeout؛
+    کارگری که هنوز رندر می‌کند رسید تازه نمی‌گیرد
+    """
+    def release(_future):
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(_workers.release)
+    return release
+
+
+async def render_receipt(transaction_data, fmt=None, wait=False):
+    """
+    تولید رسید بیرون از event loop
+    حداکثر RECEIPT_WORKERS رسید در حال رندر و RECEIPT_QUEUE_SIZE رسید در صف؛
+    بیشتر از آن ReceiptBusy (یا با wait=True منتظر ماندن برای جای خالی)،
+    و رندری که بعد از گرفتن کارگر بیشتر از RECEIPT_TIMEOUT ثانیه طول بکشد TimeoutError
+    """
+    global _slots, _workers
+    if _slots is None:
+        _slots = asyncio.Semaphore(RECEIPT_WORKERS + RECEIPT_QUEUE_SIZE)
+        _workers = asyncio.Semaphore(RECEIPT_WORKERS)
+    if _slots.locked() and not wait:
+        raise ReceiptBusy()
+
+    async with _slots:
+        loop = asyncio.get_running_loop()
+        # انتظار در صف جزو RECEIPT_TIMEOUT نیست
+        await _workers.acquire()
+        try:
+            try:
+                future = get_receipt_pool().submit(_render_receipt_bytes, transaction_data, fmt)
+            except BaseException:
+                _workers.release()
+                raise
+            future.add_done_callback(_release_worker_when_done(loop))
+            data = await asyncio.wait_for(asyncio.wrap_future(future), RECEIPT_TIMEOUT)
+        except BrokenProcessPool:
+            # یک کارگر از کار افتاده؛ pool دفعه بعد از نو ساخته می‌شود
+            logger.error("Receipt process pool is broken, recreating")
+            shutdown_receipt_pool(wait=False)
+            raise
+    return io.BytesIO(data)
+
+
+def shutdown_receipt_pool(wait=True):
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=wait, cancel_futures=True)
+        _pool = None
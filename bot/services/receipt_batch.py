@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import tempfile
+import zipfile
+from collections import deque
+
+from bot.services.database import db_connection, run_db
+from bot.services.receipt import render_receipt, receipt_extension, WIDTH, HEIGHT
+from config import RECEIPT_WORKERS, RECEIPT_BATCH_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+BATCH_FORMATS = ("pdf", "zip")
+
+# شمارش و خواندن صفحه‌ها باید از همین FROM استفاده کنند تا تعداد با رسیدهای ساخته شده یکی باشد؛
+# انتقال‌ها (TRF) عامل گیرنده ندارند، پس گیرنده با LEFT JOIN خوانده می‌شود
+_BATCH_FROM = """
+    transactions t
+    JOIN agents a_sender ON t.agent_id = a_sender.id
+    LEFT JOIN agents a_receiver ON t.receiver_agent_id = a_receiver.id
+"""
+
+# حواله‌هایی که عامل فرستنده یا گیرنده آن است، در بازه [date_from, date_to] (هر دو شامل)
+_BATCH_FILTER = """
+    (t.agent_id = ? OR t.receiver_agent_id = ?)
+    AND t.created_at >= ? AND t.created_at < date(?, '+1 day')
+"""
+
+
+def count_batch_transactions(agent_id, date_from, date_to):
+    with db_connection() as conn:
+        row = conn.execute(
+            f"SELECT COUNT(*) FROM {_BATCH_FROM} WHERE {_BATCH_FILTER}",
+            (agent_id, agent_id, date_from, date_to),
+        ).fetchone()
+    return row[0]
+
+
+def _fetch_page(agent_id, date_from, date_to, after_id, limit):
+    with db_connection() as conn:
+        return conn.execute(
+            f"""
+            SELECT t.id, t.transaction_code, t.sender_name, t.receiver_name, t.receiver_tazkira,
+                   t.amount, t.currency, t.created_at,
+                   a_sender.name, COALESCE(a_receiver.name, '')
+            FROM {_BATCH_FROM}
+            WHERE {_BATCH_FILTER} AND t.id > ?
+            ORDER BY t.id
+            LIMIT ?
+            """,
+            (agent_id, agent_id, date_from, date_to, after_id, limit),
+        ).fetchall()
+
+
+async def iter_receipt_data(agent_id, date_from, date_to, page_size=RECEIPT_BATCH_PAGE_SIZE):
+    """خواندن صفحه به صفحه (بر اساس id) تا کل بازه یکجا در حافظه نباشد"""
+    after_id = 0
+    while True:
+        rows = await run_db(_fetch_page, agent_id, date_from, date_to, after_id, page_size)
+        for row in rows:
+            yield {
+                'transaction_code': row[1],
+                'sender_name': row[2],
+                'receiver_name': row[3],
+                'receiver_tazkira': row[4],
+                'amount': row[5],
+                'currency': row[6],
+                'sender_agent': row[8],
+                'receiver_agent': row[9],
+                'created_at': row[7],
+            }
+        if len(rows) < page_size:
+            return
+        after_id = rows[-1][0]
+
+
+# =========================
+# نویسنده‌های فایل خروجی
+# =========================
+
+
+class PdfStreamWriter:
+    """
+    PDF چندصفحه‌ای که صفحه به صفحه روی فایل نوشته می‌شود (هر صفحه یک تصویر JPEG)
+    Pillow برای PDF چندصفحه‌ای همه تصاویر را همزمان در حافظه می‌خواهد
+    """
+
+    # شیء ۱ کاتالوگ و شیء ۲ فهرست صفحات است؛ هر دو در پایان نوشته می‌شوند
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self._offsets = {}
+        self._pages = []
+        self._next_object = 3
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _object(self, number, header, stream=None):
+        self._offsets[number] = self._file.tell()
+        self._file.write(f"{number} 0 obj\n{header}".encode())
+        if stream is not None:
+            self._file.write(b"\nstream\n")
+            self._file.write(stream)
+            self._file.write(b"\nendstream")
+        self._file.write(b"\nendobj\n")
+
+    def add_jpeg_page(self, jpeg, width=WIDTH, height=HEIGHT):
+        image, content, page = range(self._next_object, self._next_object + 3)
+        self._next_object += 3
+
+        self._object(
+            image,
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode /Length {len(jpeg)} >>",
+            jpeg,
+        )
+        draw = f"q {width} 0 0 {height} 0 0 cm /Im0 Do Q".encode()
+        self._object(content, f"<< /Length {len(draw)} >>", draw)
+        self._object(
+            page,
+            f"<< /Type /Page /Parent {self.PAGES} 0 R /MediaBox [0 0 {width} {height}] "
+            f"/Resources << /XObject << /Im0 {image} 0 R >> >> /Contents {content} 0 R >>",
+        )
+        self._pages.append(page)
+
+    def close(self):
+        kids = " ".join(f"{page} 0 R" for page in self._pages)
+        self._object(self.PAGES, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>")
+        self._object(self.CATALOG, f"<< /Type /Catalog /Pages {self.PAGES} 0 R >>")
+
+        xref = self._file.tell()
+        size = self._next_object
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        lines += [f"{self._offsets[number]:010d} 00000 n \n" for number in range(1, size)]
+        lines.append(f"trailer\n<< /Size {size} /Root {self.CATALOG} 0 R >>\nstartxref\n{xref}\n%%EOF\n")
+        self._file.write("".join(lines).encode())
+
+
+class ZipStreamWriter:
+    """هر رسید یک فایل در ZIP؛ تصاویر از قبل فشرده‌اند پس بدون فشرده‌سازی ذخیره می‌شوند"""
+
+    def __init__(self, fileobj):
+        self._zip = zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_STORED)
+        self._extension = receipt_extension()
+
+    def add(self, transaction_code, data):
+        self._zip.writestr(f"{transaction_code}.{self._extension}", data)
+
+    def close(self):
+        self._zip.close()
+
+
+# =========================
+# ساخت فایل گروهی
+# =========================
+
+
+async def build_receipt_batch(agent_id, date_from, date_to, fmt):
+    """
+    ساخت یک فایل PDF یا ZIP از رسیدهای بازه؛ خروجی (فایل موقت، تعداد رسید)
+    اگر هیچ رسیدی ساخته نشود، فایلی برنمی‌گردد: (None, 0)
+    رسیدها موازی در process pool رندر می‌شوند ولی حداکثر RECEIPT_WORKERS رسید
+    همزمان در حافظه است و هر رسید بلافاصله به ترتیب در فایل موقت نوشته می‌شود
+    """
+    if fmt not in BATCH_FORMATS:
+        raise ValueError(f"Unsupported batch format: {fmt}")
+
+    output = tempfile.TemporaryFile()
+    if fmt == "pdf":
+        # PDF فقط JPEG را بدون decode کردن جاسازی می‌کند
+        writer, image_format = PdfStreamWriter(output), "jpeg"
+    else:
+        writer, image_format = ZipStreamWriter(output), None
+
+    def _add(code, data):
+        if fmt == "pdf":
+            writer.add_jpeg_page(data)
+        else:
+            writer.add(code, data)
+
+    window = deque()
+    count = 0
+    try:
+        async for receipt_data in iter_receipt_data(agent_id, date_from, date_to):
+            task = asyncio.ensure_future(render_receipt(receipt_data, fmt=image_format, wait=True))
+            window.append((receipt_data['transaction_code'], task))
+            if len(window) >= RECEIPT_WORKERS:
+                code, task = window.popleft()
+                _add(code, (await task).getvalue())
+                count += 1
+
+        while window:
+            code, task = window.popleft()
+            _add(code, (await task).getvalue())
+            count += 1
+
+        writer.close()
+    except BaseException:
+        for _, task in window:
+            task.cancel()
+        output.close()
+        raise
+
+    if count == 0:
+        output.close()
+        return None, 0
+
+    output.seek(0)
+    logger.info("Built %s receipt batch for agent %s: %d receipts", fmt, agent_id, count)
+    return output, count
@@ -0,0 +1,152 @@
+import hashlib
+import io
+import json
+import logging
+import os
+
+from telegram.error import BadRequest
+
+from bot.services.database import db_connection, run_db
+from bot.services.receipt import render_receipt, receipt_extension, RECEIPT_EXTENSIONS
+from config import RECEIPT_CACHE_DIR, RECEIPT_CACHE_MAX_BYTES, RECEIPT_FORMAT
+
+logger = logging.getLogger(__name__)
+
+
+def receipt_key(receipt_data):
+    """کلید رسید: کد حواله + هش همه فیلدها و فرمت خروجی (اگر چیزی عوض شود، رسید جدید ساخته می‌شود)"""
+    fields = json.dumps(
+        [receipt_data, RECEIPT_FORMAT], sort_keys=True, ensure_ascii=False, default=str
+    )
+    digest = hashlib.sha256(fields.encode()).hexdigest()[:16]
+    return f"{receipt_data.get('transaction_code', '')}-{digest}"
+
+
+# =========================
+# کش فایل روی دیسک
+# =========================
+
+
+def _cache_path(key):
+    return os.path.join(RECEIPT_CACHE_DIR, f"{key}.{receipt_extension()}")
+
+
+def _read_cached(key):
+    path = _cache_path(key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # زمان تغییر = آخرین استفاده؛ حذف از قدیمی‌ترین شروع می‌شود
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return data
+
+
+def _write_cached(key, data):
+    os.makedirs(RECEIPT_CACHE_DIR, exist_ok=True)
+    path = _cache_path(key)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    _evict()
+
+
+def _evict():
+    """حذف قدیمی‌ترین رسیدها تا حجم کش زیر RECEIPT_CACHE_MAX_BYTES بیاید"""
+    extensions = tuple(f".{ext}" for ext in RECEIPT_EXTENSIONS.values())
+    entries = []
+    total = 0
+    with os.scandir(RECEIPT_CACHE_DIR) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(extensions):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+    if total <= RECEIPT_CACHE_MAX_BYTES:
+        return
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= RECEIPT_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+# =========================
+# file_id تلگرام
+# =========================
+
+
+def _get_file_id(key):
+    with db_connection() as conn:
+        row = conn.execute(
+            "SELECT file_id FROM receipt_files WHERE receipt_key = ?", (key,)
+        ).fetchone()
+    return row[0] if row else None
+
+
+def _save_file_id(key, transaction_code, file_id):
+    with db_connection() as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO receipt_files (receipt_key, transaction_code, file_id)
+            VALUES (?, ?, ?)
+            """,
+            (key, transaction_code, file_id),
+        )
+        conn.commit()
+
+
+def _forget_file_id(key):
+    with db_connection() as conn:
+        conn.execute("DELETE FROM receipt_files WHERE receipt_key = ?", (key,))
+        conn.commit()
+
+
+async def send_receipt(bot, chat_id, receipt_data, caption, parse_mode="Markdown"):
+    """
+    ارسال رسید با کمترین هزینه:
+    ۱. file_id ذخیره شده (بدون آپلود)  ۲. فایل کش شده روی دیسک  ۳. رندر جدید
+    """
+    key = receipt_key(receipt_data)
+
+    file_id = await run_db(_get_file_id, key)
+    if file_id:
+        try:
+            return await bot.send_photo(
+                chat_id=chat_id, photo=file_id, caption=caption, parse_mode=parse_mode
+            )
+        except BadRequest as e:
+            # مثلاً توکن ربات عوض شده و file_id دیگر معتبر نیست
+            logger.warning("Cached receipt file_id rejected for %s: %s", key, e)
+            await run_db(_forget_file_id, key)
+
+    data = await run_db(_read_cached, key)
+    if data is None:
+        data = (await render_receipt(receipt_data)).getvalue()
+        try:
+            await run_db(_write_cached, key, data)
+        except OSError as e:
+            logger.warning("Could not write receipt cache %s: %s", key, e)
+
+    photo = io.BytesIO(data)
+    photo.name = f"receipt.{receipt_extension()}"
+    message = await bot.send_photo(
+        chat_id=chat_id, photo=photo, caption=caption, parse_mode=parse_mode
+    )
+    if message.photo:
+        # بزرگ‌ترین سایز؛ file_id برای همه چت‌های همین ربات معتبر است
+        await run_db(
+            _save_file_id, key, receipt_data.get("transaction_code", ""), message.photo[-1].file_id
+        )
+    return message
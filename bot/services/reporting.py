@@ -0,0 +1,228 @@
+import logging
+from datetime import datetime as dt, timedelta
+
+from bot.services.cache import TTLCache, MISSING
+from bot.services.database import db_read
+from config import REPORT_CACHE_SIZE, REPORT_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# آمار مشترک گزارش‌های ادمین
+# =========================
+# گزارش مالی، داشبورد آماری و بررسی سلامت همه از collect_metrics استفاده می‌کنند:
+# یک بار خواندن daily_stats (گروه‌بندی بر اساس عامل، با جمع‌های شرطی برای همه معیارها)
+# به علاوه جدول‌های کوچک agents و balances؛ بقیه در پایتون جمع زده می‌شود
+
+
+def _empty_activity():
+    return {
+        "total": 0,
+        "pending": 0,
+        "completed": 0,
+        "count": 0,  # حواله‌های غیرلغو شده
+        "amount": 0,
+        "commission": 0,
+        "count_7d": 0,
+        "amount_7d": 0,
+        "count_30d": 0,
+        "amount_30d": 0,
+        "old_pending": 0,
+    }
+
+
+def collect_metrics(cur, now=None, old_pending_days=3):
+    """
+    همه معیارهای گزارش‌های ادمین در یک دیکشنری:
+    totals: جمع کل حواله‌ها (همان کلیدهای _empty_activity)
+    agents: لیست عامل‌ها با فعالیت هر کدام (id, name, province, is_active + کلیدهای فعالیت)
+    active_agents / total_agents / zero_balance_agents / total_afn / province_stats
+    """
+    now = now or dt.now()
+    seven_days_ago = (now - timedelta(days=7)).strftime('%Y-%m-%d')
+    thirty_days_ago = (now - timedelta(days=30)).strftime('%Y-%m-%d')
+    old_pending_before = (now - timedelta(days=old_pending_days)).strftime('%Y-%m-%d')
+
+    cur.execute(
+        """
+        SELECT agent_id,
+               SUM(tx_count),
+               SUM(CASE WHEN status = 'pending' THEN tx_count ELSE 0 END),
+               SUM(CASE WHEN status = 'completed' THEN tx_count ELSE 0 END),
+               SUM(CASE WHEN status != 'cancelled' THEN tx_count ELSE 0 END),
+               SUM(CASE WHEN status != 'cancelled' THEN amount ELSE 0 END),
+               SUM(CASE WHEN status != 'cancelled' THEN commission ELSE 0 END),
+               SUM(CASE WHEN day >= :week THEN tx_count ELSE 0 END),
+               SUM(CASE WHEN day >= :week AND status != 'cancelled' THEN amount ELSE 0 END),
+               SUM(CASE WHEN day >= :month THEN tx_count ELSE 0 END),
+               SUM(CASE WHEN day >= :month AND status != 'cancelled' THEN amount ELSE 0 END),
+               SUM(CASE WHEN day < :old AND status = 'pending' THEN tx_count ELSE 0 END)
+        FROM daily_stats
+        GROUP BY agent_id
+        """,
+        {"week": seven_days_ago, "month": thirty_days_ago, "old": old_pending_before},
+    )
+    keys = list(_empty_activity())
+    activity = {row[0]: dict(zip(keys, row[1:])) for row in cur.fetchall()}
+
+    totals = _empty_activity()
+    for values in activity.values():
+        for key in keys:
+            totals[key] += values[key]
+
+    cur.execute("SELECT id, name, province, is_active FROM agents ORDER BY id")
+    agents = []
+    for agent_id, name, province, is_active in cur.fetchall():
+        agent = {"id": agent_id, "name": name, "province": province, "is_active": is_active}
+        agent.update(activity.get(agent_id) or _empty_activity())
+        agents.append(agent)
+
+    cur.execute("SELECT agent_id, currency, balance FROM balances")
+    balances = cur.fetchall()
+
+    return {
+        "totals": totals,
+        "agents": agents,
+        "total_agents": len(agents),
+        "active_agents": sum(1 for agent in agents if agent["is_active"] == 1),
+        "zero_balance_agents": _zero_balance_agents(agents, balances),
+        "total_afn": sum(balance or 0 for _, currency, balance in balances if currency == 'AFN'),
+        "province_stats": _province_stats(agents, balances),
+    }
+
+
+def _zero_balance_agents(agents, balances):
+    """تعداد عامل‌های فعالی که در هیچ ارزی موجودی مثبت ندارند"""
+    funded = {agent_id for agent_id, _, balance in balances if balance and balance > 0}
+    return sum(1 for agent in agents if agent["is_active"] == 1 and agent["id"] not in funded)
+
+
+def _province_stats(agents, balances):
+    """
+    (ولایت، تعداد، مجموع موجودی) برای عامل‌های فعال، مرتب بر اساس تعداد
+    مثل JOIN قبلی، هر ردیف موجودی یکبار شمرده می‌شود و عامل بدون موجودی یکبار
+    """
+    rows_by_agent = {}
+    for agent_id, _, balance in balances:
+        rows_by_agent.setdefault(agent_id, []).append(balance)
+
+    stats = {}
+    for agent in agents:
+        if agent["is_active"] != 1:
+            continue
+        agent_balances = rows_by_agent.get(agent["id"], [None])
+        count, total = stats.get(agent["province"], (0, None))
+        for balance in agent_balances:
+            count += 1
+            if balance is not None:
+                total = (total or 0) + balance
+        stats[agent["province"]] = (count, total)
+
+    result = [(province, count, total) for province, (count, total) in stats.items()]
+    result.sort(key=lambda row: row[1], reverse=True)
+    return result
+
+
+def active_agents_by(metrics, key, reverse=True, positive_only=False):
+    """عامل‌های فعال مرتب بر اساس یکی از کلیدهای فعالیت (مثلاً count یا commission)"""
+    agents = [
+        agent for agent in metrics["agents"]
+        if agent["is_active"] == 1 and (not positive_only or agent[key] > 0)
+    ]
+    agents.sort(key=lambda agent: agent[key], reverse=reverse)
+    return agents
+
+
+def evaluate_health(metrics):
+    """
+    بررسی‌های سلامت سیستم روی خروجی collect_metrics
+    خروجی: (لیست وضعیت‌های سالم، دیکشنری مسائل {کلید: متن})؛
+    کلید ثابت است تا اسکن زمان‌بندی شده فقط مسائل تازه را اطلاع دهد
+    """
+    health_status = []
+    issues = {}
+
+    # بررسی ۱: تعداد کل عامل‌ها
+    active_agents = metrics["active_agents"]
+
+    if active_agents == 0:
+        issues["active_agents"] = "❌ هیچ عامل فعلی وجود ندارد"
+    elif active_agents < 3:
+        issues["active_agents"] = f"⚠️ تعداد عامل‌های فعال کم است: {active_agents}"
+    else:
+        health_status.append(f"✅ عامل‌های فعال: {active_agents}")
+
+    # بررسی ۲: موجودی کل سیستم
+    total_afn = metrics["total_afn"]
+
+    if total_afn == 0:
+        issues["total_afn"] = "❌ هیچ موجودی در سیستم ثبت نشده"
+    elif total_afn < 10000:
+        issues["total_afn"] = f"⚠️ موجودی کل سیستم کم است: {total_afn:,.0f} افغانی"
+    else:
+        health_status.append(f"✅ موجودی کل سیستم: {total_afn:,.0f} افغانی")
+
+    # بررسی ۳: حواله‌های در انتظار
+    pending_count = metrics["totals"]["pending"]
+
+    if pending_count > 100:
+        issues["pending"] = f"⚠️ حواله‌های در انتظار زیاد است: {pending_count}"
+    else:
+        health_status.append(f"✅ حواله‌های در انتظار: {pending_count}")
+
+    # بررسی ۴: حواله‌های قدیمی (بیش از ۳ روز)
+    old_pending = metrics["totals"]["old_pending"]
+
+    if old_pending > 10:
+        issues["old_pending"] = f"⚠️ حواله‌های قدیمی در انتظار: {old_pending}"
+    else:
+        health_status.append(f"✅ حواله‌های قدیمی: {old_pending}")
+
+    # بررسی ۵: عامل‌های با موجودی صفر
+    zero_balance_count = metrics["zero_balance_agents"]
+
+    if zero_balance_count > active_agents * 0.5:  # بیش از نصف عامل‌ها موجودی صفر دارند
+        issues["zero_balance"] = f"⚠️ درصد بالایی از عامل‌ها موجودی صفر دارند: {zero_balance_count}/{active_agents}"
+    else:
+        health_status.append(f"✅ عامل‌های با موجودی صفر: {zero_balance_count}")
+    return health_status, issues
+
+
+# =========================
+# کش نتیجه گزارش‌ها
+# =========================
+# کلید = (نام گزارش، نسخه داده، تاریخ امروز)؛ data_version با trigger در همان تراکنشِ
+# هر نوشتن روی حواله‌ها/موجودی‌ها/عامل‌ها زیاد می‌شود، پس بعد از هر تغییر کلید عوض می‌شود
+# تاریخ در کلید است تا بازه‌های «امروز/۷ روز/۳۰ روز» بعد از نیمه‌شب دوباره حساب شوند
+
+_report_cache = TTLCache("admin_reports", REPORT_CACHE_SIZE, REPORT_CACHE_TTL)
+
+
+def data_version(cur):
+    cur.execute("SELECT version FROM data_version WHERE id = 1")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def _cached(cur, name, fn):
+    # نسخه قبل از محاسبه خوانده می‌شود؛ اگر وسط کار نوشتنی انجام شود،
+    # نتیجه تازه‌تر از کلید است و درخواست بعدی دوباره محاسبه می‌کند
+    key = (name, data_version(cur), dt.now().strftime('%Y-%m-%d'))
+    result = _report_cache.get(key)
+    if result is MISSING:
+        result = fn(cur)
+        _report_cache.set(key, result)
+    return result
+
+
+async def cached_read(name, fn):
+    """
+    مثل db_read(fn) ولی نتیجه تا تغییر بعدی داده‌ها کش می‌شود:
+        metrics = await cached_read("metrics", collect_metrics)
+    نتیجه بین درخواست‌ها مشترک است و نباید تغییر داده شود
+    """
+    return await db_read(_cached, name, fn)
+
+
+def report_cache_stats():
+    return _report_cache.stats()
@@ -1,5 +1,5 @@
 # bot/services/security.py
-from bot.services.database import get_db
+from bot.services.database import db_connection
 import bcrypt
 
 
@@ -17,11 +17,9 @@ def verify_password(password: str, hashed: str) -> bool:
 
 # 🔐 چک فعال بودن عامل
 def check_agent_active(agent_id: int) -> bool:
-    conn = get_db()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT is_active FROM agents WHERE id = ?", (agent_id,))
+        row = cur.fetchone()
 
-    cur.execute("SELECT is_active FROM agents WHERE id = ?", (agent_id,))
-    row = cur.fetchone()
-
-    conn.close()
     return bool(row and row[0] == 1)
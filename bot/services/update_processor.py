@@ -0,0 +1,64 @@
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    پردازش همزمان آپدیت‌های کاربران مختلف
+    آپدیت‌های یک کاربر به ترتیب رسیدن و یکی‌یکی اجرا می‌شوند،
+    تا مراحل ConversationHandler و context.user_data به هم نریزند
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # کلید کاربر -> [قفل، تعداد آپدیت‌های منتظر یا در حال اجرا]
+        self._locks = {}
+
+    @staticmethod
+    def _user_key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        key = self._user_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+
+        try:
+            # اول قفل کاربر، بعد ظرفیت سراسری؛
+            # آپدیت‌های پشت سر هم یک کاربر جای بقیه را در سمافور نمی‌گیرند
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._locks:
+            logger.info("Shutting down with %d users still in progress", len(self._locks))
+
+    def active_users(self):
+        return len(self._locks)
@@ -7,3 +7,66 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
 ADMIN_IDS = [6458047080]  # آیدی تلگرام ادمین(ها)
+
+# ⚙️ تنظیمات دیتابیس
+DB_PATH = os.getenv("DB_PATH", "hawala.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))  # نخ‌های run_db؛ استخر = این + REPORT_WORKERS اتصال
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # ثانیه انتظار برای اتصال آزاد
+
+# 🗄 پروفایل ذخیره‌سازی SQLite (روی هر اتصال اعمال می‌شود)
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")  # WAL: گزارش‌ها نوشتن‌ها را قفل نمی‌کنند
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))  # بایت
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-20000"))  # منفی = کیلوبایت
+DB_TEMP_STORE = os.getenv("DB_TEMP_STORE", "MEMORY")
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", "5000"))  # میلی‌ثانیه
+
+# ⚡ پردازش همزمان آپدیت‌ها (آپدیت‌های هر کاربر همیشه به ترتیب اجرا می‌شوند)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+
+# 💰 دفتر کل: تلاش دوباره وقتی دیتابیس قفل است (database is locked)
+LEDGER_MAX_RETRIES = int(os.getenv("LEDGER_MAX_RETRIES", "3"))
+LEDGER_RETRY_DELAY = float(os.getenv("LEDGER_RETRY_DELAY", "0.05"))  # ثانیه، با هر تلاش بیشتر می‌شود
+
+# 🪪 کش هویت کاربران (ادمین/عامل بر اساس telegram_id و شناسه عامل)
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "2048"))  # 0 = غیرفعال
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "60"))  # ثانیه
+
+# 📈 کش نتیجه گزارش‌های ادمین (داشبورد، گزارش مالی، پنل سود، مالی مرکزی)
+# تا وقتی داده‌ای تغییر نکرده (data_version) و TTL نگذشته، بروزرسانی از حافظه جواب داده می‌شود
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "32"))  # 0 = غیرفعال
+REPORT_CACHE_TTL = float(os.getenv("REPORT_CACHE_TTL", "300"))  # ثانیه
+
+# 💾 ذخیره user_data و مکالمه‌ها در دیتابیس (بعد از ری‌استارت از دست نمی‌روند)
+PERSISTENCE_FLUSH_DELAY = float(os.getenv("PERSISTENCE_FLUSH_DELAY", "5"))  # ثانیه؛ حداکثر یک نوشتن در این بازه
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "30"))  # ثانیه؛ جمع‌آوری user_data توسط PTB
+
+# 🧾 تولید رسید تصویری در پروسه‌های جداگانه
+RECEIPT_WORKERS = int(os.getenv("RECEIPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+RECEIPT_QUEUE_SIZE = int(os.getenv("RECEIPT_QUEUE_SIZE", "32"))  # رسیدهای منتظر؛ بیشتر از این رد می‌شود
+RECEIPT_TIMEOUT = float(os.getenv("RECEIPT_TIMEOUT", "15"))  # ثانیه
+RECEIPT_FORMAT = os.getenv("RECEIPT_FORMAT", "png").lower()  # png (پالتی)، webp یا jpeg
+RECEIPT_MAX_BYTES = int(os.getenv("RECEIPT_MAX_BYTES", "60000"))  # سقف حجم هر رسید؛ 0 = بدون سقف
+
+# 🗂 کش رسیدها: فایل رسید روی دیسک + file_id تلگرام در دیتابیس
+RECEIPT_CACHE_DIR = os.getenv("RECEIPT_CACHE_DIR", "receipt_cache")
+RECEIPT_CACHE_MAX_BYTES = int(os.getenv("RECEIPT_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))  # بایت
+
+# 📦 خروجی گروهی رسیدها (ZIP یا PDF چندصفحه‌ای)
+RECEIPT_BATCH_MAX = int(os.getenv("RECEIPT_BATCH_MAX", "300"))  # حداکثر حواله در یک فایل
+RECEIPT_BATCH_PAGE_SIZE = int(os.getenv("RECEIPT_BATCH_PAGE_SIZE", "50"))  # ردیف‌های هر بار خواندن از دیتابیس
+
+# 📥 خروجی اکسل جریانی
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))  # ردیف‌های هر بار خواندن از cursor
+EXPORT_MAX_FILE_BYTES = int(os.getenv("EXPORT_MAX_FILE_BYTES", str(45 * 1024 * 1024)))  # بیشتر از این چند فایل می‌شود (سقف تلگرام ۵۰ مگابایت)
+
+# 🧵 صف گزارش‌های سنگین (ساخت در پس‌زمینه و ارسال بعد از آماده شدن)
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))  # گزارش‌های همزمان در حال ساخت
+REPORT_JOB_RETENTION_DAYS = int(os.getenv("REPORT_JOB_RETENTION_DAYS", "7"))  # نگهداری سابقه کارهای تمام شده
+
+# 🚨 آستانه‌های هشدار (با تغییر، هشدارها هنگام شروع ربات دوباره ساخته می‌شوند)
+ALERT_LOW_BALANCE_AFN = float(os.getenv("ALERT_LOW_BALANCE_AFN", "1000"))  # موجودی کم (افغانی)
+ALERT_HIGH_AMOUNT = float(os.getenv("ALERT_HIGH_AMOUNT", "10000"))  # حواله با مبلغ بالا
+ALERT_PENDING_DAYS = int(os.getenv("ALERT_PENDING_DAYS", "7"))  # حواله در انتظار قدیمی (روز)
+ALERT_INACTIVE_DAYS = int(os.getenv("ALERT_INACTIVE_DAYS", "30"))  # عامل بدون فعالیت (روز)
+ALERT_SCAN_INTERVAL = int(os.getenv("ALERT_SCAN_INTERVAL", "600"))  # ثانیه؛ اسکن دوره‌ای و ارسال خلاصه به ادمین‌ها (0 = غیرفعال)
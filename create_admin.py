@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
-import sqlite3
 import bcrypt
 
+from bot.services.database import get_db
+
 
 def hash_password(password: str) -> str:
     salt = bcrypt.gensalt(rounds=12)
@@ -15,7 +16,7 @@ def create_admin_once():
     password = "admin123"  # بعداً عوضش کن
     password_hash = hash_password(password)
 
-    conn = sqlite3.connect("hawala.db")
+    conn = get_db()
     cursor = conn.cursor()
 
     # بررسی وجود ادمین
@@ -1,19 +1,45 @@
 from telegram.ext import Application
-from bot.services.database import init_db
+import logging
+
+from bot.services.database import init_db, get_pool, shutdown_executor, identity_cache_stats
+from bot.services.update_processor import PerUserUpdateProcessor
+from bot.services.persistence import SQLitePersistence
+from bot.services.receipt import shutdown_receipt_pool
+from bot.services.jobs import report_jobs
+from bot.services.ledger import run_in_unit_of_work
+from bot.services.alerts import apply_alert_settings
+from bot.services.alert_scan import schedule_alert_scan
 from routes import register_routes
-from config import BOT_TOKEN
+from config import BOT_TOKEN, MAX_CONCURRENT_UPDATES
 
 
 def main():
     init_db()
+    run_in_unit_of_work(apply_alert_settings)
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .persistence(SQLitePersistence())
+        .post_init(report_jobs.start)
+        .post_shutdown(report_jobs.stop)
+        .build()
+    )
 
     register_routes(app)
+    schedule_alert_scan(app)
 
     print("🤖 Hawala Bot is running ...")
     app.run_polling()
 
+    # بستن پروسه‌های رسید، اتصال‌های دیتابیس و ثبت آمار استخر
+    shutdown_receipt_pool()
+    shutdown_executor()
+    logging.getLogger(__name__).info("DB pool stats: %s", get_pool().stats())
+    logging.getLogger(__name__).info("Identity cache stats: %s", identity_cache_stats())
+    get_pool().close_all()
+
 
 if __name__ == "__main__":
     main()
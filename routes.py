@@ -45,6 +45,7 @@ from bot.handlers.admin import (
 from bot.handlers.admin_dashboard import (
     dashboard_stats,
     download_admin_excel_report,
+    download_admin_transactions_export,
     admin_profit_panel,
 )
 
@@ -101,6 +102,7 @@ from bot.handlers.agent import (
     balance_and_report_menu,
     show_full_report,
     download_excel_report,
+    download_transactions_export,
     balance_management_menu,
     increase_balance_start,
     increase_balance_currency,
@@ -116,6 +118,11 @@ from bot.handlers.agent import (
     search_advanced_results,
     handle_receipt_callback,
     handle_pay_fast_callback,
+    batch_receipts_start,
+    batch_receipts_agent,
+    batch_receipts_date_from,
+    batch_receipts_date_to,
+    batch_receipts_format,
     # حالت‌های Conversation عامل
     SEND_RECEIVER_AGENT,
     SEND_RECEIVER_NAME,
@@ -142,6 +149,10 @@ from bot.handlers.agent import (
     SEARCH_TYPE,
     SEARCH_QUERY,
     SEARCH_DATE_RANGE,
+    BATCH_AGENT,
+    BATCH_DATE_FROM,
+    BATCH_DATE_TO,
+    BATCH_FORMAT,
 )
 
 # admin login
@@ -155,43 +166,81 @@ from bot.handlers.admin_login import (
 
 
 # common
-from bot.handlers.common import exit_menu
+from bot.handlers.common import exit_menu, report_format_menu
 from bot.handlers.start import start
 
 # errors
 from bot.services.errors import global_error_handler
+from bot.services.database import run_db, get_admin_by_telegram_id, get_agent_by_telegram_id
 
 
 def register_routes(app):
 
     # ========= COMMON DISPATCHERS =========
-    async def smart_excel_report_dispatcher(update, context):
-        """توزیع‌کننده هوشمند گزارش اکسل بر اساس نقش کاربر"""
+    async def _resolve_role(update, context):
         role = context.user_data.get("role")
         
-        # اگر نقش در سشن نیست، از دیتابیس چک کن
+        # اگر نقش در سشن نیست، از دیتابیس چک کن (در نخ‌های دیتابیس، نه روی event loop)
         if not role:
-            from bot.services.database import get_admin_by_telegram_id, get_agent_by_telegram_id
             user_id = update.effective_user.id
-            if get_admin_by_telegram_id(user_id):
+            admin = await run_db(get_admin_by_telegram_id, user_id)
+            if admin:
                 role = "admin"
                 context.user_data["role"] = "admin"
-            elif get_agent_by_telegram_id(user_id):
-                role = "agent"
-                context.user_data["role"] = "agent"
+                context.user_data["admin_id"] = admin["id"]
+            else:
+                agent = await run_db(get_agent_by_telegram_id, user_id)
+                if agent and agent["is_active"]:
+                    role = "agent"
+                    context.user_data["role"] = "agent"
+                    context.user_data["agent_id"] = agent["id"]
+        return role
+
+    async def smart_excel_report_dispatcher(update, context):
+        """انتخاب فرمت گزارش؛ ساخت فایل بعد از انتخاب و بر اساس نقش کاربر انجام می‌شود"""
+        if await _resolve_role(update, context) in ("admin", "agent"):
+            return await report_format_menu(update, context)
+        await update.message.reply_text("🔐 لطفاً ابتدا وارد حساب کاربری خود شوید.")
+
+    async def report_format_dispatcher(update, context):
+        """توزیع‌کننده هوشمند گزارش (XLSX / CSV / Parquet) بر اساس نقش کاربر"""
+        query = update.callback_query
+        await query.answer()
+        fmt = query.data.replace("report_fmt_", "")
+        role = await _resolve_role(update, context)
 
         if role == "admin":
-            return await download_admin_excel_report(update, context)
+            if fmt == "xlsx":
+                return await download_admin_excel_report(update, context)
+            return await download_admin_transactions_export(update, context, fmt)
         elif role == "agent":
-            return await download_excel_report(update, context)
+            if fmt == "xlsx":
+                return await download_excel_report(update, context)
+            return await download_transactions_export(update, context, fmt)
         else:
-            await update.message.reply_text("🔐 لطفاً ابتدا وارد حساب کاربری خود شوید.")
+            await query.message.reply_text("🔐 لطفاً ابتدا وارد حساب کاربری خود شوید.")
 
     # ========= START =========
     app.add_handler(CommandHandler("start", start))
     
     # هندلر مشترک برای دانلود گزارش اکسل (باید قبل از بقیه باشد)
     app.add_handler(MessageHandler(filters.Regex("^📥 دانلود گزارش اکسل$"), smart_excel_report_dispatcher))
+    app.add_handler(CallbackQueryHandler(report_format_dispatcher, pattern="^report_fmt_(xlsx|csv|parquet)$"))
+
+    # رسیدهای گروهی (مشترک ادمین و عامل؛ ادمین ابتدا ID عامل را وارد می‌کند)
+    batch_receipts_conv = ConversationHandler(
+        name="batch_receipts",
+        persistent=True,
+        entry_points=[MessageHandler(filters.Regex("^🗂 دانلود رسیدهای گروهی$"), batch_receipts_start)],
+        states={
+            BATCH_AGENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, batch_receipts_agent)],
+            BATCH_DATE_FROM: [MessageHandler(filters.TEXT & ~filters.COMMAND, batch_receipts_date_from)],
+            BATCH_DATE_TO: [MessageHandler(filters.TEXT & ~filters.COMMAND, batch_receipts_date_to)],
+            BATCH_FORMAT: [MessageHandler(filters.TEXT & ~filters.COMMAND, batch_receipts_format)],
+        },
+        fallbacks=[CommandHandler("start", start)],
+    )
+    app.add_handler(batch_receipts_conv)
 
     # ========= ADMIN ACTIONS =========
     # این بخش باید قبل از AGENT ACTIONS باشد تا تداخل دکمه‌ها (مثل "📥 دانلود گزارش اکسل") پیش نیاید
@@ -205,6 +254,8 @@ def register_routes(app):
 
     # جستجوی حواله‌ها (ادمین)
     admin_search_tx_conv = ConversationHandler(
+        name="admin_search_tx",
+        persistent=True,
         entry_points=[
             MessageHandler(filters.Regex("^🔎 جستجوی حواله‌ها$"), admin_search_tx_start),
             MessageHandler(filters.Regex("^🔍 جستجوی جدید$"), admin_search_tx_start),
@@ -222,6 +273,8 @@ def register_routes(app):
     
     # ورود ادمین (انتقال به ابتدای هندلرها برای اولویت بالاتر)
     admin_login_conv = ConversationHandler(
+        name="admin_login",
+        persistent=True,
         entry_points=[
             MessageHandler(filters.Regex("^👑 ورود ادمین$"), admin_login_start)
         ],
@@ -239,6 +292,8 @@ def register_routes(app):
 
     # ورود عامل (انتقال به ابتدای هندلرها برای اولویت بالاتر)
     agent_login_conv = ConversationHandler(
+        name="agent_login",
+        persistent=True,
         entry_points=[
             MessageHandler(filters.Regex("^🔐 ورود عامل$"), agent_login_start)
         ],
@@ -267,6 +322,8 @@ def register_routes(app):
     )
     
     create_agent_conv = ConversationHandler(
+        name="create_agent",
+        persistent=True,
         entry_points=[MessageHandler(filters.Regex("^➕ ایجاد عامل$"), create_agent_start)],
         states={
             NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_name)],
@@ -291,6 +348,8 @@ def register_routes(app):
     from bot.handlers.admin import TOGGLE_AGENT, toggle_agent_by_id
     
     toggle_agent_conv = ConversationHandler(
+        name="toggle_agent",
+        persistent=True,
         entry_points=[MessageHandler(filters.Regex("^⛔ فعال / غیرفعال عامل$"), toggle_agent_start)],
         states={
             TOGGLE_AGENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, toggle_agent_by_id)],
@@ -336,6 +395,8 @@ def register_routes(app):
     
     # ConversationHandler انتقال وجه بین عامل‌ها
     transfer_funds_conv = ConversationHandler(
+        name="transfer_funds",
+        persistent=True,
         entry_points=[
             MessageHandler(filters.Regex("^💸 انتقال وجه بین عامل‌ها$"), start_transfer_funds)
         ],
@@ -388,6 +449,8 @@ def register_routes(app):
     # ========= AGENT ACTIONS =========
     # ارسال حواله جدید
     send_hawala_conv = ConversationHandler(
+        name="send_hawala",
+        persistent=True,
         entry_points=[
             MessageHandler(filters.Regex("^💸 ارسال حواله جدید$"), send_hawala_start)
         ],
@@ -423,6 +486,8 @@ def register_routes(app):
 
     # پیگیری حواله و پرداخت توسط عامل مقصد
     track_hawala_conv = ConversationHandler(
+        name="track_hawala",
+        persistent=True,
         entry_points=[
             MessageHandler(
                 filters.Regex("^🔍 پیگیری با کد حواله$"), track_transaction_start
@@ -465,6 +530,8 @@ def register_routes(app):
     )
     
     manage_pending_conv = ConversationHandler(
+        name="manage_pending",
+        persistent=True,
         entry_points=[
             MessageHandler(
                 filters.Regex("^✏️ مدیریت حواله‌های در انتظار$"),
@@ -513,6 +580,8 @@ def register_routes(app):
 
     # افزایش/کاهش موجودی و ارز جدید
     increase_balance_conv = ConversationHandler(
+        name="increase_balance",
+        persistent=True,
         entry_points=[MessageHandler(filters.Regex("^➕ افزایش موجودی$"), increase_balance_start)],
         states={
             INCREASE_BALANCE_CURRENCY: [MessageHandler(filters.Regex("^(🇦🇫 AFN|🇺🇸 USD|🔙 بازگشت)$"), increase_balance_currency)],
@@ -524,6 +593,8 @@ def register_routes(app):
     app.add_handler(increase_balance_conv)
 
     decrease_balance_conv = ConversationHandler(
+        name="decrease_balance",
+        persistent=True,
         entry_points=[MessageHandler(filters.Regex("^➖ کاهش موجودی$"), decrease_balance_start)],
         states={
             DECREASE_BALANCE_CURRENCY: [MessageHandler(filters.Regex("^(🇦🇫 AFN|🇺🇸 USD|🔙 بازگشت)$"), decrease_balance_currency)],
@@ -534,6 +605,8 @@ def register_routes(app):
     app.add_handler(decrease_balance_conv)
 
     add_currency_conv = ConversationHandler(
+        name="add_currency",
+        persistent=True,
         entry_points=[MessageHandler(filters.Regex("^💱 اضافه کردن ارز جدید$"), add_currency_start)],
         states={
             ADD_CURRENCY_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_currency_confirm)],
@@ -547,6 +620,8 @@ def register_routes(app):
 
     # جستجوی پیشرفته عامل
     search_conv = ConversationHandler(
+        name="search",
+        persistent=True,
         entry_points=[MessageHandler(filters.Regex("^🔍 جستجوی پیشرفته$"), search_advanced_start)],
         states={
             SEARCH_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_advanced_type)],
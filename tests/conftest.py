@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# ریشه مخزن برای import کردن bot، routes و config
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# تست‌ها هیچ‌وقت به دیتابیس واقعی (hawala.db) دست نمی‌زنند؛
+# config مقدار DB_PATH را هنگام import می‌خواند، پس قبل از هر import تنظیم می‌شود
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="hawala-test-"), "hawala.db")
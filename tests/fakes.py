@@ -0,0 +1,46 @@
+from bot.services.database import init_db, db_connection, invalidate_admin
+
+ADMIN_TELEGRAM_ID = 424242
+
+
+class FakeMessage:
+    def __init__(self, text=""):
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append((text, kwargs))
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeUpdate:
+    callback_query = None
+
+    def __init__(self, text="", user_id=ADMIN_TELEGRAM_ID):
+        self.message = FakeMessage(text)
+        self.effective_user = FakeUser(user_id)
+
+
+class FakeContext:
+    def __init__(self, user_data=None):
+        self.user_data = {} if user_data is None else user_data
+
+
+def create_admin(telegram_id=ADMIN_TELEGRAM_ID, username="test_admin"):
+    """ادمین فعال متصل به telegram_id؛ شناسه ادمین را برمی‌گرداند"""
+    init_db()
+    with db_connection() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO admins (username, password_hash, telegram_id, is_active) "
+            "VALUES (?, 'x', ?, 1)",
+            (username, telegram_id),
+        )
+        conn.execute("UPDATE admins SET telegram_id = ? WHERE username = ?", (telegram_id, username))
+        conn.commit()
+        admin_id = conn.execute("SELECT id FROM admins WHERE username = ?", (username,)).fetchone()[0]
+    invalidate_admin(telegram_id)
+    return admin_id
@@ -0,0 +1,46 @@
+import asyncio
+
+from bot.services.auth import require_admin, require_any_auth
+from bot.services.database import bind_admin_telegram_id, unbind_admin_telegram_id
+from fakes import FakeContext, FakeUpdate, create_admin
+
+OLD_TELEGRAM_ID = 515151
+NEW_TELEGRAM_ID = 616161
+
+
+@require_admin
+async def admin_only(update, context):
+    return "ok"
+
+
+@require_any_auth
+async def any_auth(update, context):
+    return "ok"
+
+
+def _admin_session(admin_id):
+    return FakeContext({"role": "admin", "admin_id": admin_id})
+
+
+def test_persisted_admin_session_is_dropped_after_rebind():
+    admin_id = create_admin(OLD_TELEGRAM_ID, username="rebind_admin")
+    assert asyncio.run(admin_only(FakeUpdate(user_id=OLD_TELEGRAM_ID), _admin_session(admin_id))) == "ok"
+
+    bind_admin_telegram_id(admin_id, NEW_TELEGRAM_ID)
+
+    for handler in (admin_only, any_auth):
+        context = _admin_session(admin_id)
+        update = FakeUpdate(user_id=OLD_TELEGRAM_ID)
+        assert asyncio.run(handler(update, context)) is None
+        assert "role" not in context.user_data and "admin_id" not in context.user_data
+
+    assert asyncio.run(admin_only(FakeUpdate(user_id=NEW_TELEGRAM_ID), _admin_session(admin_id))) == "ok"
+
+
+def test_persisted_admin_session_is_dropped_after_unbind():
+    admin_id = create_admin(OLD_TELEGRAM_ID, username="unbind_admin")
+    unbind_admin_telegram_id(OLD_TELEGRAM_ID)
+
+    context = _admin_session(admin_id)
+    assert asyncio.run(admin_only(FakeUpdate(user_id=OLD_TELEGRAM_ID), context)) is None
+    assert context.user_data.get("role") is None
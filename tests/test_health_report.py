@@ -0,0 +1,25 @@
+import asyncio
+import re
+
+from bot.handlers.admin_alerts import system_health_check
+from fakes import FakeContext, FakeUpdate, create_admin
+
+
+def _markdown_balanced(text):
+    """Markdown قدیمی تلگرام: هر * ، _ و ` باید بسته شود (داخل `...` حساب نمی‌شود)"""
+    outside_code = re.sub(r"`[^`]*`", "", text)
+    if outside_code.count("`"):
+        return False
+    return outside_code.count("*") % 2 == 0 and outside_code.count("_") % 2 == 0
+
+
+def test_health_report_markdown_is_balanced():
+    create_admin()
+
+    update = FakeUpdate()
+    asyncio.run(system_health_check(update, FakeContext()))
+
+    text, kwargs = update.message.replies[-1]
+    assert kwargs.get("parse_mode") == "Markdown"
+    assert "کش هویت" in text
+    assert _markdown_balanced(text), text
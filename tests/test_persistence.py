@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+from bot.handlers.admin import get_password, confirm_password, confirm_agent
+from bot.services.database import db_connection
+from bot.services.migrations import _drop_persisted_password_hashes
+from bot.services.persistence import SQLitePersistence
+from bot.services.security import verify_password
+from fakes import FakeContext, FakeUpdate, create_admin
+
+
+def _persisted_user_data(user_data, user_id=1):
+    """user_data را با SQLitePersistence روی دیسک می‌نویسد و همان ردیف ذخیره شده را برمی‌گرداند"""
+    async def write():
+        persistence = SQLitePersistence()
+        await persistence.update_user_data(user_id, dict(user_data))
+        await persistence.flush()
+
+    asyncio.run(write())
+    with db_connection() as conn:
+        row = conn.execute(
+            "SELECT data FROM persistence WHERE kind = 'user' AND key = ?", (str(user_id),)
+        ).fetchone()
+    return json.loads(row[0]) if row else {}
+
+
+def test_add_agent_flow_never_persists_password():
+    create_admin()
+    context = FakeContext({"name": "عامل تست"})
+
+    asyncio.run(get_password(FakeUpdate("secret123"), context))
+    asyncio.run(confirm_password(FakeUpdate("secret123"), context))
+
+    # بین تأیید پسورد و ثبت نهایی نه پسورد خام و نه هش آن روی دیسک نمی‌رود
+    persisted = _persisted_user_data(context.user_data)
+    assert persisted.get("name") == "عامل تست"
+    assert not any("secret123" in str(v) or "$2b$" in str(v) for v in persisted.values())
+
+    context.user_data.update(
+        {"province": "کابل", "phone": "0700000001", "tazkira": "T-1", "currency": "AFN", "balance": 1000.0}
+    )
+    asyncio.run(confirm_agent(FakeUpdate("✅ تأیید"), context))
+
+    with db_connection() as conn:
+        row = conn.execute("SELECT password_hash FROM agents WHERE phone = '0700000001'").fetchone()
+    assert row and verify_password("secret123", row[0])
+    assert "temp_password" not in context.user_data
+
+
+def test_migration_drops_persisted_password_hashes():
+    with db_connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO persistence (kind, key, data) VALUES ('user', '99', ?)",
+            (json.dumps({"password": "$2b$12$abc", "role": "admin"}),),
+        )
+        _drop_persisted_password_hashes(conn)
+        conn.commit()
+        data = json.loads(conn.execute("SELECT data FROM persistence WHERE kind = 'user' AND key = '99'").fetchone()[0])
+    assert data == {"role": "admin"}
@@ -0,0 +1,131 @@
+import re
+import sqlite3
+
+import pytest
+
+from bot.services.alerts import OLD_PENDING, _TIME_RULES
+from bot.services.migrations import apply_migrations
+
+# جدول‌هایی که نباید در مسیرهای پرتکرار کامل اسکن شوند
+HOT_TABLES = {"transactions", "balances", "balance_requests"}
+
+# کوئری‌های هندلرها، همان‌طور که در کد نوشته شده‌اند (با تغییر هر کدام اینجا هم به‌روز شود)
+HOT_QUERIES = {
+    # agent.agent_menu
+    "agent_menu_pending_counts": """
+        SELECT COUNT(*), currency
+        FROM transactions
+        WHERE receiver_agent_id = ? AND status = 'pending'
+        GROUP BY currency
+    """,
+    # agent.list_my_transactions
+    "my_transactions_stats": """
+        SELECT
+            COUNT(*) as total,
+            SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) as pending_count,
+            SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed_count,
+            SUM(CASE WHEN status = 'cancelled' THEN 1 ELSE 0 END) as cancelled_count,
+            SUM(amount) as total_amount
+        FROM transactions
+        WHERE agent_id = ?
+    """,
+    "my_transactions_list": """
+        SELECT
+            t.transaction_code, t.receiver_name, t.amount, t.currency, t.status, t.created_at,
+            a.name as receiver_agent_name, a.province as receiver_province
+        FROM transactions t
+        LEFT JOIN agents a ON t.receiver_agent_id = a.id
+        WHERE t.agent_id = ?
+        ORDER BY t.created_at DESC
+        LIMIT 20
+    """,
+    # agent.list_payable_transactions
+    "payable_transactions": """
+        SELECT
+            t.transaction_code, t.receiver_name, t.amount, t.currency, t.sender_name, t.created_at,
+            a.name as sender_agent_name
+        FROM transactions t
+        JOIN agents a ON t.agent_id = a.id
+        WHERE t.receiver_agent_id = ? AND t.status = 'pending'
+        ORDER BY t.created_at DESC
+    """,
+    # agent.manage_pending_transactions_start
+    "manage_pending": """
+        SELECT transaction_code, receiver_name, amount, currency, created_at
+        FROM transactions
+        WHERE agent_id = ? AND status = 'pending'
+        ORDER BY created_at DESC
+        LIMIT 10
+    """,
+    # admin.list_balance_requests
+    "pending_balance_requests": """
+        SELECT
+            br.id, br.agent_id, br.amount, br.currency, br.receipt_photo_id, br.created_at,
+            a.name as agent_name
+        FROM balance_requests br
+        JOIN agents a ON br.agent_id = a.id
+        WHERE br.status = 'pending'
+        ORDER BY br.created_at ASC
+    """,
+    # database.get_agent_transactions
+    "agent_transactions": """
+        SELECT
+            t.id, t.transaction_code, t.receiver_name, t.amount, t.currency, t.commission,
+            t.status, t.created_at, a.name as receiver_agent_name, a.province as receiver_province
+        FROM transactions t
+        LEFT JOIN agents a ON t.receiver_agent_id = a.id
+        WHERE t.agent_id = ?
+        ORDER BY t.created_at DESC
+        LIMIT ?
+    """,
+    # database.get_transaction_by_code
+    "transaction_by_code": """
+        SELECT t.*, a1.name as sender_agent_name, a2.name as receiver_agent_name,
+               a2.province as receiver_province
+        FROM transactions t
+        LEFT JOIN agents a1 ON t.agent_id = a1.id
+        LEFT JOIN agents a2 ON t.receiver_agent_id = a2.id
+        WHERE t.transaction_code = ?
+    """,
+    # database.get_agent_balance
+    "agent_balance": """
+        SELECT balance
+        FROM balances
+        WHERE agent_id = ? AND currency = ?
+    """,
+    # alerts.sync_time_alerts (اسکن دوره‌ای هشدارها)
+    "old_pending_alerts": _TIME_RULES[OLD_PENDING],
+}
+
+
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory):
+    conn = sqlite3.connect(tmp_path_factory.mktemp("plans") / "plans.db")
+    apply_migrations(conn)
+    yield conn
+    conn.close()
+
+
+def _hot_names(sql):
+    """نام جدول‌های پرتکرار و alias های آن‌ها در کوئری"""
+    names = set(HOT_TABLES)
+    for table, alias in re.findall(r"\b(transactions|balances|balance_requests)\s+(?:AS\s+)?(\w+)", sql, re.I):
+        if alias.upper() not in {"WHERE", "JOIN", "LEFT", "INNER", "ON", "ORDER", "GROUP", "LIMIT"}:
+            names.add(alias)
+    return names
+
+
+def _plan(conn, sql):
+    named = re.findall(r":(\w+)", sql)
+    params = dict.fromkeys(named) if named else [None] * sql.count("?")
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_does_not_scan(conn, name):
+    sql = HOT_QUERIES[name]
+    plan = _plan(conn, sql)
+
+    hot = _hot_names(sql)
+    scans = [detail for detail in plan if detail.startswith("SCAN ") and detail.split()[1] in hot]
+    assert not scans, f"{name}: {plan}"
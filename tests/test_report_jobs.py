@@ -0,0 +1,70 @@
+import asyncio
+
+from bot.services import jobs
+from bot.services.database import db_connection, init_db
+from bot.services.jobs import ReportFailed, ReportJobQueue, report_job
+
+
+@report_job("test_always_fails")
+def _always_fails():
+    raise ReportFailed("❌ test")
+
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id, text):
+        self.messages.append((chat_id, text))
+
+
+class FakeApplication:
+    def __init__(self):
+        self.bot = FakeBot()
+
+
+def _status(job_id):
+    with db_connection() as conn:
+        return conn.execute("SELECT status FROM report_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+
+def _run_job(queue, kind, params, chat_id):
+    async def run():
+        await queue.start(FakeApplication())
+        try:
+            await queue.submit(kind, params, chat_id)
+            await queue._queue.join()
+        finally:
+            await queue.stop()
+
+    asyncio.run(run())
+    with db_connection() as conn:
+        return conn.execute("SELECT MAX(id) FROM report_jobs WHERE kind = ?", (kind,)).fetchone()[0]
+
+
+def test_failed_build_is_finished_even_if_closing_recipients_fails(monkeypatch):
+    init_db()
+
+    def busy(cur, job_id):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(jobs, "_close_recipients", busy)
+    job_id = _run_job(ReportJobQueue(workers=1), "test_always_fails", {"n": 1}, 1)
+
+    # کار 'running' نمی‌ماند، پس درخواست یکسان بعدی کار تازه می‌سازد
+    assert _status(job_id) == "failed"
+    monkeypatch.undo()
+    assert _run_job(ReportJobQueue(workers=1), "test_always_fails", {"n": 1}, 1) != job_id
+
+
+def test_report_builders_leave_every_run_db_thread_a_connection(monkeypatch):
+    from bot.services import database
+    from config import REPORT_WORKERS
+
+    pool = database.get_pool()
+    monkeypatch.setattr(pool, "timeout", 0.5)
+
+    # هر سازنده گزارش یک اتصال نگه می‌دارد؛ همه نخ‌های run_db باز هم بدون انتظار اتصال می‌گیرند
+    held = [pool.acquire() for _ in range(REPORT_WORKERS + database._executor._max_workers)]
+    for conn in held:
+        conn.close()
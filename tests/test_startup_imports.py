@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# کتابخانه‌های سنگین فقط هنگام ساخت رسید یا خروجی import می‌شوند، نه هنگام شروع ربات
+LAZY_MODULES = ("PIL", "openpyxl", "pyarrow", "arabic_reshaper", "bidi")
+
+
+def test_cold_start_does_not_import_heavy_modules():
+    code = (
+        "import sys, routes, main; "
+        f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        env=os.environ.copy(),
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "", f"imported at startup: {result.stdout.strip()}"
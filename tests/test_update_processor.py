@@ -0,0 +1,81 @@
+import asyncio
+import random
+from datetime import datetime, timezone
+
+from telegram import Chat, Message, Update, User
+
+from bot.services.update_processor import PerUserUpdateProcessor
+
+
+def _update(update_id, user_id):
+    user = User(id=user_id, first_name="u", is_bot=False)
+    chat = Chat(id=user_id, type=Chat.PRIVATE)
+    message = Message(message_id=update_id, date=datetime.now(timezone.utc), chat=chat, from_user=user, text="x")
+    return Update(update_id=update_id, message=message)
+
+
+class Recorder:
+    """ترتیب اجرای آپدیت‌ها و بیشترین تعداد همزمان"""
+
+    def __init__(self):
+        self.running = set()
+        self.max_running = 0
+        self.started = {}
+        self.finished = {}
+
+    async def handle(self, user_id, seq, delay):
+        assert user_id not in {u for u, _ in self.running}, "two updates of one user overlapped"
+        self.running.add((user_id, seq))
+        self.max_running = max(self.max_running, len(self.running))
+        self.started.setdefault(user_id, []).append(seq)
+        await asyncio.sleep(delay)
+        self.running.discard((user_id, seq))
+        self.finished.setdefault(user_id, []).append(seq)
+
+
+async def _process_all(processor, recorder, jobs):
+    # مثل Application: هر آپدیت در task جدا و به ترتیب رسیدن به پردازشگر داده می‌شود
+    tasks = []
+    for update_id, (user_id, seq, delay) in enumerate(jobs, start=1):
+        coroutine = recorder.handle(user_id, seq, delay)
+        tasks.append(asyncio.create_task(processor.process_update(_update(update_id, user_id), coroutine)))
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+
+
+def test_same_user_in_order_other_users_overlap():
+    processor = PerUserUpdateProcessor(2)
+    recorder = Recorder()
+    # اولین آپدیت کاربر ۱ کند است؛ دومی نباید از آن جلو بزند
+    jobs = [(1, 0, 0.05), (1, 1, 0.0), (2, 0, 0.02), (3, 0, 0.02)]
+
+    asyncio.run(_process_all(processor, recorder, jobs))
+
+    assert recorder.finished[1] == [0, 1]
+    assert recorder.max_running == 2  # کاربرهای مختلف همزمان، ولی نه بیشتر از سقف
+    assert processor.active_users() == 0
+
+
+def test_load_keeps_per_user_order_within_concurrency_limit():
+    limit = 8
+    processor = PerUserUpdateProcessor(limit)
+    recorder = Recorder()
+    rng = random.Random(6)
+    users = range(1000, 1050)
+    per_user = 5
+    arrivals = [user_id for user_id in users for _ in range(per_user)]
+    rng.shuffle(arrivals)
+    # آپدیت‌های هر کاربر به ترتیب seq می‌رسند، بین کاربرها در هم
+    next_seq = dict.fromkeys(users, 0)
+    jobs = []
+    for user_id in arrivals:
+        jobs.append((user_id, next_seq[user_id], rng.uniform(0, 0.005)))
+        next_seq[user_id] += 1
+
+    asyncio.run(_process_all(processor, recorder, jobs))
+
+    for user_id in users:
+        assert recorder.started[user_id] == list(range(per_user))
+        assert recorder.finished[user_id] == list(range(per_user))
+    assert 1 < recorder.max_running <= limit
+    assert processor.active_users() == 0